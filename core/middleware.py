@@ -0,0 +1,256 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware times each request and collects, through hooks that
+only record while a request is being measured:
+
+- database queries: count and time, via an execute wrapper installed on
+  every connection (async views query on other threads, so it cannot only
+  be installed on the request thread's connection)
+- template rendering time, through the TimedDjangoTemplates backend
+  (settings.TEMPLATES)
+- cache gets on the default cache, split into hits and misses, by wrapping
+  the get methods of the request's cache object (not its class)
+- whether the page cache answered, from its X-Page-Cache header
+
+Static files (STATIC_URL, served by WhiteNoise) are not measured.
+
+Results go out as a ``Server-Timing`` header (PERFORMANCE_SERVER_TIMING) and
+one JSON line per request on the ``core.performance`` logger, tagged with the
+resolved URL name. Requests slower than PERFORMANCE_SLOW_REQUEST_MS are
+logged at WARNING with the SQL they ran, slowest first.
+"""
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from types import MethodType
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+
+logger = logging.getLogger('core.performance')
+
+# Most statements kept per request for the slow-request log
+MAX_CAPTURED_QUERIES = 200
+
+_current = ContextVar('request_metrics', default=None)
+_MISSING = object()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.captured = []
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_depth = 0
+        self.lock = threading.Lock()
+
+    def record_query(self, sql, seconds):
+        with self.lock:
+            self.queries += 1
+            self.db_seconds += seconds
+            if len(self.captured) < MAX_CAPTURED_QUERIES:
+                self.captured.append((seconds, sql))
+
+    def record_cache(self, hits, misses):
+        with self.lock:
+            self.cache_hits += hits
+            self.cache_misses += misses
+
+
+def _record_queries(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(sql, time.perf_counter() - started)
+
+
+def _add_query_hook(connection, **kwargs):
+    if _record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_queries)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        # Only the outermost render counts; includes render inside it
+        if metrics is None or metrics.template_depth:
+            return super().render(context, request)
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            metrics.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with render time recorded per request"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def _counted_get(get):
+    def wrapper(self, key, default=None, version=None):
+        metrics = _current.get()
+        if metrics is None or metrics.cache_depth:
+            return get(self, key, default, version)
+        metrics.cache_depth += 1
+        try:
+            value = get(self, key, _MISSING, version)
+        finally:
+            metrics.cache_depth -= 1
+        metrics.record_cache(value is not _MISSING, value is _MISSING)
+        return default if value is _MISSING else value
+    return wrapper
+
+
+def _counted_get_many(get_many):
+    def wrapper(self, keys, version=None):
+        metrics = _current.get()
+        if metrics is None or metrics.cache_depth:
+            return get_many(self, keys, version)
+        keys = list(keys)
+        # Some backends implement get_many() with get(); count once
+        metrics.cache_depth += 1
+        try:
+            found = get_many(self, keys, version)
+        finally:
+            metrics.cache_depth -= 1
+        metrics.record_cache(len(found), len(keys) - len(found))
+        return found
+    return wrapper
+
+
+def _add_cache_hook(cache):
+    # caches[] hands each thread its own object, so only threads that serve
+    # requests get wrapped
+    if '_performance_hooked' not in vars(cache):
+        backend = type(cache)
+        cache.get = MethodType(_counted_get(backend.get), cache)
+        cache.get_many = MethodType(_counted_get_many(backend.get_many), cache)
+        cache._performance_hooked = True
+
+
+def _static_prefix():
+    prefix = urlsplit(settings.STATIC_URL or '').path
+    return prefix if prefix.startswith('/') and prefix != '/' else None
+
+
+def _url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else None
+
+
+class PerformanceMiddleware:
+    """Measure every request, see the module docstring"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PERFORMANCE_INSTRUMENTATION', True)
+        if self.enabled:
+            connection_created.connect(_add_query_hook, dispatch_uid='core.performance')
+        self.static_prefix = _static_prefix()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.measures(request):
+            return self.get_response(request)
+        metrics, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        if not self.measures(request):
+            return await self.get_response(request)
+        metrics, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, metrics)
+        return response
+
+    def measures(self, request):
+        return self.enabled and not (self.static_prefix and request.path.startswith(self.static_prefix))
+
+    def start(self):
+        metrics = RequestMetrics()
+        # The request thread's connection may predate the connection_created hook
+        for connection in connections.all(initialized_only=True):
+            _add_query_hook(connection)
+        _add_cache_hook(caches['default'])
+        return metrics, _current.set(metrics)
+
+    def finish(self, request, response, metrics):
+        total_ms = (time.perf_counter() - metrics.started) * 1000
+        db_ms = metrics.db_seconds * 1000
+        template_ms = metrics.template_seconds * 1000
+        page_cache = response.get('X-Page-Cache', '')
+
+        if getattr(settings, 'PERFORMANCE_SERVER_TIMING', False):
+            timings = [
+                f'db;dur={db_ms:.1f};desc="{metrics.queries} queries"',
+                f'tpl;dur={template_ms:.1f}',
+                f'cache;desc="{metrics.cache_hits} hits, {metrics.cache_misses} misses"',
+            ]
+            if page_cache:
+                timings.append(f'page-cache;desc="{page_cache}"')
+            timings.append(f'total;dur={total_ms:.1f}')
+            response['Server-Timing'] = ', '.join(timings)
+
+        record = {
+            'url_name': _url_name(request),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 1),
+            'db_queries': metrics.queries,
+            'db_ms': round(db_ms, 1),
+            'template_ms': round(template_ms, 1),
+            'cache_hits': metrics.cache_hits,
+            'cache_misses': metrics.cache_misses,
+            'page_cache': page_cache or None,
+        }
+        slow_ms = getattr(settings, 'PERFORMANCE_SLOW_REQUEST_MS', 500)
+        if slow_ms is not None and total_ms >= slow_ms:
+            record['slow'] = True
+            record['sql'] = [
+                {'ms': round(seconds * 1000, 2), 'sql': sql}
+                for seconds, sql in sorted(metrics.captured, key=lambda query: query[0], reverse=True)
+            ]
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        else:
+            logger.info(json.dumps(record, ensure_ascii=False))
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.PerformanceMiddleware",  # Outermost, so it times everything below
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",  # Add Whitenoise for static files
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -60,7 +61,8 @@ ROOT_URLCONF = "core.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # DjangoTemplates that also times renders for PerformanceMiddleware
+        "BACKEND": "core.middleware.TimedDjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -76,6 +78,12 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "core.wsgi.application"
+ASGI_APPLICATION = "core.asgi.application"
+
+# Serve the public read views (home, property_list, property_detail,
+# agent_profile) from properties.async_views. gunicorn.conf.py switches to
+# core.asgi on uvicorn workers on the same flag.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
 
 
 # Database
@@ -153,7 +161,8 @@ AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY', '')
 AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME', '')
 AWS_S3_REGION_NAME = os.environ.get('AWS_S3_REGION_NAME', 'ap-northeast-1')
 AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.{AWS_S3_REGION_NAME}.amazonaws.com'
-AWS_S3_ENDPOINT_URL = f'https://s3.{AWS_S3_REGION_NAME}.amazonaws.com'
+# Override to point at an S3-compatible server, e.g. `moto_server` on http://127.0.0.1:5000
+AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL', f'https://s3.{AWS_S3_REGION_NAME}.amazonaws.com')
 AWS_LOCATION = 'media'
 
 # S3 settings (no ACL - use bucket permissions instead)
@@ -163,6 +172,24 @@ AWS_S3_OBJECT_PARAMETERS = {
 AWS_S3_FILE_OVERWRITE = False
 AWS_QUERYSTRING_AUTH = False  # Don't add auth params to URLs
 
+# core.storage_backends.PooledS3Storage shares one boto3 client per process;
+# batch uploads (image variants, staged listing photos) run on a thread pool,
+# staged photos AWS_S3_UPLOAD_WORKERS at a time
+AWS_S3_UPLOAD_WORKERS = int(os.environ.get('AWS_S3_UPLOAD_WORKERS', '8'))
+AWS_S3_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_S3_MAX_POOL_CONNECTIONS', '20'))
+
+# Reads of S3 media (image resizing, admin previews) go through a disk cache
+# shared by the workers on a host, see core.storage_backends.ReadCacheMixin
+MEDIA_CACHE_DIR = os.environ.get('MEDIA_CACHE_DIR', '/tmp/estate_agency_media_cache')
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', str(1024 ** 3)))  # 0 disables it
+# Seconds a cached copy is used before its ETag is checked again
+MEDIA_CACHE_TRUST_SECONDS = int(os.environ.get('MEDIA_CACHE_TRUST_SECONDS', '300'))
+
+# Listing photos are uploaded by the browser straight to media storage
+# (presigned S3 POSTs, see properties.uploads); these bound each upload
+PROPERTY_UPLOAD_MAX_BYTES = int(os.environ.get('PROPERTY_UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+PROPERTY_UPLOAD_EXPIRES = int(os.environ.get('PROPERTY_UPLOAD_EXPIRES', '3600'))
+
 # Conditional storage backend - use S3 only if credentials are provided
 USE_S3 = os.environ.get('USE_S3', 'False') == 'True'
 
@@ -170,7 +197,7 @@ if USE_S3 and AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY and AWS_STORAGE_BUCKET
     # Use S3 for media files
     STORAGES = {
         'default': {
-            'BACKEND': 'storages.backends.s3.S3Storage',
+            'BACKEND': 'core.storage_backends.CachedS3Storage',
             'OPTIONS': {
                 'access_key': AWS_ACCESS_KEY_ID,
                 'secret_key': AWS_SECRET_ACCESS_KEY,
@@ -196,6 +223,121 @@ else:
         },
     }
 
+# ============================================================================
+# CACHE CONFIGURATION
+# ============================================================================
+# Set REDIS_URL (and install the `redis` extra) to share the cache between
+# workers and hosts. Without it, production falls back to a file-based cache
+# under CACHE_LOCATION that only the gunicorn workers of one container share:
+# - each replica keeps its own copy, so an edit made through one replica only
+#   invalidates that replica's pages; the others serve the old page for up to
+#   PAGE_CACHE_TIMEOUT
+# - a redeploy or restart starts it empty
+# - it holds CACHE_MAX_ENTRIES files, dropping a third of them when full, and
+#   every write lists the directory to count them, so keep it in the thousands
+# Development uses a per-process in-memory cache.
+
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+elif not DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', '/tmp/estate_agency_cache'),
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', '2000')),
+            },
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# How often (seconds) each worker revalidates its in-process copy of the
+# Company row against the shared cache
+COMPANY_CACHE_CHECK_SECONDS = int(os.environ.get('COMPANY_CACHE_CHECK_SECONDS', '5'))
+
+# How often (seconds) each worker picks up listing changes other workers made
+# to the in-process location autocomplete index (properties.autocomplete)
+LOCATION_INDEX_CHECK_SECONDS = int(os.environ.get('LOCATION_INDEX_CHECK_SECONDS', '5'))
+
+# Full-page cache for anonymous visitors (properties.cache.cache_public_page).
+# Entries are invalidated by model changes; the timeout only bounds memory use.
+PAGE_CACHE_ENABLED = os.environ.get('PAGE_CACHE_ENABLED', 'True') == 'True'
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', str(60 * 60 * 24)))
+
+# Listing cards are cached as fragments keyed on (pk, updated_at, language)
+# for every visitor (properties.templatetags.property_filters.property_cards)
+CARD_CACHE_ENABLED = os.environ.get('CARD_CACHE_ENABLED', 'True') == 'True'
+
+# property_list counts matches up to this many and shows "1,000+" beyond
+# (properties.counts); counts are cached per filter combination
+PROPERTY_COUNT_LIMIT = int(os.environ.get('PROPERTY_COUNT_LIMIT', '1000'))
+
+# ============================================================================
+# PERFORMANCE INSTRUMENTATION
+# ============================================================================
+# core.middleware.PerformanceMiddleware logs one JSON line per request (query
+# count/time, template time, cache hits/misses, total) on `core.performance`.
+
+PERFORMANCE_INSTRUMENTATION = os.environ.get('PERFORMANCE_INSTRUMENTATION', 'True') == 'True'
+# Also send the numbers to the browser in a Server-Timing header. Off in
+# production by default, as it tells anyone how the page was built.
+PERFORMANCE_SERVER_TIMING = os.environ.get('PERFORMANCE_SERVER_TIMING', str(DEBUG)) == 'True'
+# Requests at least this slow are logged at WARNING with their SQL
+PERFORMANCE_SLOW_REQUEST_MS = int(os.environ.get('PERFORMANCE_SLOW_REQUEST_MS', '500'))
+
+# Development logging (production replaces it below). Python's fallback
+# handler only prints WARNING and up, so without this the INFO lines would be
+# dropped. require_debug_true keeps them out of test runs, which set DEBUG=False.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'require_debug_true': {
+            '()': 'django.utils.log.RequireDebugTrue',
+        },
+    },
+    'handlers': {
+        'performance_console': {
+            'class': 'logging.StreamHandler',
+            'filters': ['require_debug_true'],
+        },
+    },
+    'loggers': {
+        'core.performance': {
+            'handlers': ['performance_console'],
+            'level': os.environ.get('PERFORMANCE_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# ============================================================================
+# BACKGROUND JOBS
+# ============================================================================
+# Image storage and resizing run in `python manage.py run_jobs` workers using
+# the database as the queue. With JOBS_EAGER (the default) jobs run inline
+# instead, so nothing is left queued on a deploy without a worker. Set
+# JOBS_EAGER=False only where a worker runs (the Procfile, or the Railway
+# worker service from railway.worker.toml).
+
+JOBS_EAGER = os.environ.get('JOBS_EAGER', 'True') == 'True'
+# Seconds a worker may hold a job before it is handed to another worker
+JOBS_VISIBILITY_TIMEOUT = int(os.environ.get('JOBS_VISIBILITY_TIMEOUT', '300'))
+# Seconds an idle worker waits between polls
+JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', '2'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/6.0/ref/settings/#default-auto-field
 
@@ -216,7 +358,9 @@ if not DEBUG:
     DATABASES = {
         'default': dj_database_url.config(
             default=os.environ.get('DATABASE_URL'),
-            conn_max_age=600,
+            # Persistent connections are per thread, and async views run queries
+            # on short-lived threads, so under ASGI they would only pile up
+            conn_max_age=0 if ASYNC_VIEWS else 600,
             conn_health_checks=True,
         )
     }
@@ -265,5 +409,11 @@ if not DEBUG:
                 'level': 'INFO',
                 'propagate': False,
             },
+            # One JSON line per request, see core.middleware
+            'core.performance': {
+                'handlers': ['console'],
+                'level': os.environ.get('PERFORMANCE_LOG_LEVEL', 'INFO'),
+                'propagate': False,
+            },
         },
     }
@@ -5,7 +5,26 @@ This module provides custom storage backends for media files.
 Uses the modern storages.backends.s3.S3Storage (not deprecated S3Boto3Storage).
 ACLs are NOT used - bucket-level permissions should be configured instead.
 """
+import errno
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
 from storages.backends.s3 import S3Storage
+from storages.utils import ReadBytesWrapper, clean_name, is_seekable
+
+logger = logging.getLogger(__name__)
 
 
 class MediaStorage(S3Storage):
@@ -19,3 +38,408 @@ class MediaStorage(S3Storage):
     location = 'media'
     file_overwrite = False
     # Do NOT set default_acl - S3 buckets block ACLs by default now
+
+
+# boto3 clients are thread-safe (sessions and resources are not), so each
+# process shares one client, and its connection pool, per set of credentials
+_clients = {}
+_clients_lock = threading.Lock()
+
+_upload_pool = None
+_upload_pool_lock = threading.Lock()
+
+
+def upload_pool():
+    """The process-wide thread pool batch uploads run on (AWS_S3_UPLOAD_WORKERS threads)"""
+    global _upload_pool
+    with _upload_pool_lock:
+        if _upload_pool is None:
+            workers = getattr(settings, 'AWS_S3_UPLOAD_WORKERS', 8)
+            _upload_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='s3-upload')
+        return _upload_pool
+
+
+class UploadMetrics:
+    """Thread-safe upload counters and timings for one storage instance"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.uploads = 0
+        self.failures = 0
+        self.bytes = 0
+        self.upload_seconds = 0.0
+        self.batches = 0
+        self.batch_seconds = 0.0
+
+    def record_upload(self, size, seconds, failed=False):
+        with self.lock:
+            if failed:
+                self.failures += 1
+            else:
+                self.uploads += 1
+                self.bytes += size
+            self.upload_seconds += seconds
+
+    def record_batch(self, seconds):
+        with self.lock:
+            self.batches += 1
+            self.batch_seconds += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'uploads': self.uploads,
+                'failures': self.failures,
+                'bytes': self.bytes,
+                'upload_seconds': round(self.upload_seconds, 4),
+                'batches': self.batches,
+                'batch_seconds': round(self.batch_seconds, 4),
+                'mean_upload_ms': round(1000 * self.upload_seconds / self.uploads, 2) if self.uploads else None,
+            }
+
+
+class PooledS3Storage(S3Storage):
+    """
+    S3Storage that writes through one shared, thread-safe boto3 client per
+    process instead of a boto3 session and resource per thread, and can
+    upload a batch of files concurrently with ``save_many()``.
+
+    Reads and listings still go through the inherited per-thread resource.
+    """
+
+    def __init__(self, **settings):
+        super().__init__(**settings)
+        self.metrics = UploadMetrics()
+        # Names chosen by in-flight saves, so concurrent saves of the same name don't collide
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+
+    @property
+    def client(self):
+        key = (self.session_profile, self.access_key, self.secret_key, self.security_token,
+               self.region_name, self.endpoint_url, self.use_ssl, self.verify)
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                pool_size = getattr(settings, 'AWS_S3_MAX_POOL_CONNECTIONS', 20)
+                config = self.client_config.merge(Config(max_pool_connections=pool_size))
+                client = _clients[key] = self._create_session().client(
+                    's3',
+                    region_name=self.region_name,
+                    use_ssl=self.use_ssl,
+                    endpoint_url=self.endpoint_url,
+                    config=config,
+                    verify=self.verify,
+                )
+            return client
+
+    def get_available_name(self, name, max_length=None):
+        if self.file_overwrite:
+            return super().get_available_name(name, max_length)
+        while True:
+            name = super().get_available_name(name, max_length)
+            with self._pending_lock:
+                if name not in self._pending:
+                    self._pending.add(name)
+                    return name
+
+    def exists(self, name):
+        with self._pending_lock:
+            if clean_name(name) in self._pending:
+                return True
+        key = self._normalize_name(clean_name(name))
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=key)
+            return True
+        except ClientError as err:
+            if err.response['ResponseMetadata']['HTTPStatusCode'] == 404:
+                return False
+            raise
+
+    def delete(self, name):
+        key = self._normalize_name(clean_name(name))
+        # DeleteObject succeeds for missing keys
+        self.client.delete_object(Bucket=self.bucket_name, Key=key)
+
+    def _save(self, name, content):
+        cleaned_name = clean_name(name)
+        key = self._normalize_name(cleaned_name)
+        params = self._get_write_parameters(key, content)
+        size = getattr(content, 'size', None) or 0
+        if is_seekable(content):
+            content.seek(0, os.SEEK_SET)
+        content = ReadBytesWrapper(content)
+        if self.gzip and params['ContentType'] in self.gzip_content_types and 'ContentEncoding' not in params:
+            content = self._compress_content(content)
+            params['ContentEncoding'] = 'gzip'
+
+        started = time.perf_counter()
+        # s3transfer closes the file when done; the caller owns it (boto/s3transfer#80)
+        original_close = content.close
+        content.close = lambda: None
+        try:
+            self.client.upload_fileobj(content, self.bucket_name, key, ExtraArgs=params, Config=self.transfer_config)
+        except Exception:
+            self.metrics.record_upload(0, time.perf_counter() - started, failed=True)
+            raise
+        finally:
+            content.close = original_close
+            with self._pending_lock:
+                self._pending.discard(cleaned_name)
+        self.metrics.record_upload(size, time.perf_counter() - started)
+        return cleaned_name
+
+    def save_many(self, files, max_length=None):
+        """
+        Save ``(name, content)`` pairs concurrently on the shared upload pool
+        and return the stored names in the same order. If any upload fails,
+        the others still finish and the first error is raised.
+        """
+        files = list(files)
+        started = time.perf_counter()
+        futures = [upload_pool().submit(self.save, name, content, max_length) for name, content in files]
+        names, error = [], None
+        for future in futures:
+            try:
+                names.append(future.result())
+            except Exception as exc:
+                error = error or exc
+        elapsed = time.perf_counter() - started
+        self.metrics.record_batch(elapsed)
+        logger.debug('Uploaded %d files in %.3fs', len(files), elapsed)
+        if error is not None:
+            raise error
+        return names
+
+
+class CacheMetrics:
+    """Thread-safe hit/miss counters for one storage instance's read cache"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_downloaded = 0
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+
+    def record(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self.lock:
+            reads = self.hits + self.revalidated + self.misses
+            return {
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+                'hit_ratio': round((self.hits + self.revalidated) / reads, 4) if reads else None,
+                'bytes_downloaded': self.bytes_downloaded,
+                'evicted_files': self.evicted_files,
+                'evicted_bytes': self.evicted_bytes,
+            }
+
+
+# Cached copies are named by their ETag, which S3 keeps to [0-9a-f-]
+_SAFE_ETAG = re.compile(r'^[0-9A-Za-z_-]{1,128}$')
+_TEMP_PREFIX = '.tmp-'
+
+
+class ReadCacheMixin:
+    """
+    Read-through disk cache for an S3Storage: files opened for reading are
+    served from a local copy under MEDIA_CACHE_DIR.
+
+    Each object is kept at ``<dir>/<sha[:2]>/<sha of key>/<ETag>``, written to
+    a temporary file and renamed into place, so workers sharing the directory
+    never see a partial copy. A copy younger than MEDIA_CACHE_TRUST_SECONDS
+    is used as is; an older one is revalidated with a conditional GET, which
+    only downloads the object if its ETag changed. Access times drive LRU
+    eviction once the directory outgrows MEDIA_CACHE_MAX_BYTES (0 disables
+    the cache); one worker at a time sweeps, under an flock where the
+    platform has one (not on Windows, where concurrent sweeps just overlap).
+    """
+
+    def __init__(self, **settings_):
+        super().__init__(**settings_)
+        self.cache_dir = getattr(settings, 'MEDIA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'estate_agency_media_cache'))
+        self.cache_max_bytes = getattr(settings, 'MEDIA_CACHE_MAX_BYTES', 1024 ** 3)
+        self.cache_trust_seconds = getattr(settings, 'MEDIA_CACHE_TRUST_SECONDS', 300)
+        self.cache_metrics = CacheMetrics()
+        self._written_since_sweep = 0
+        self._sweep_lock = threading.Lock()
+
+    def _s3_client(self):
+        return getattr(self, 'client', None) or self.connection.meta.client
+
+    def _cache_key_dir(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _cached_copy(self, key_dir):
+        """Path and ETag of the cached copy in ``key_dir``, or (None, None)"""
+        try:
+            entries = [entry for entry in os.scandir(key_dir) if not entry.name.startswith('.')]
+        except FileNotFoundError:
+            return None, None
+        if not entries:
+            return None, None
+        newest = max(entries, key=lambda entry: entry.stat().st_mtime)
+        return newest.path, newest.name
+
+    def _open(self, name, mode='rb'):
+        if not self.cache_max_bytes or 'r' not in mode or '+' in mode:
+            return super()._open(name, mode)
+        key = self._normalize_name(clean_name(name))
+        key_dir = self._cache_key_dir(key)
+        path, etag = self._cached_copy(key_dir)
+        try:
+            validated_at = os.stat(path).st_mtime if path is not None else None
+            if validated_at is not None and time.time() - validated_at < self.cache_trust_seconds:
+                self.cache_metrics.record(hits=1)
+                # atime is the LRU clock; mtime stays the last validation
+                os.utime(path, (time.time(), validated_at))
+            else:
+                path = self._fetch(name, key, key_dir, path, etag)
+                if os.path.basename(path).startswith(_TEMP_PREFIX):
+                    # An uncacheable download: hand over its content and drop the file
+                    with open(path, 'rb') as handle:
+                        content = handle.read()
+                    self._remove(path)
+                    return ContentFile(content if 'b' in mode else content.decode(), name=name)
+            return File(open(path, mode), name=name)
+        except FileNotFoundError:
+            # Evicted by another worker in between: read straight from S3 this once
+            return super()._open(name, mode)
+
+    def _fetch(self, name, key, key_dir, path, etag):
+        """Download ``key`` into the cache unless ``etag`` is still current"""
+        params = {'Bucket': self.bucket_name, 'Key': key}
+        if path is not None:
+            params['IfNoneMatch'] = f'"{etag}"'
+        try:
+            response = self._s3_client().get_object(**params)
+        except ClientError as err:
+            status = err.response['ResponseMetadata']['HTTPStatusCode']
+            if status == 304:
+                now = time.time()
+                os.utime(path, (now, now))
+                self.cache_metrics.record(revalidated=1)
+                return path
+            if status == 404:
+                raise FileNotFoundError(errno.ENOENT, 'No such object', name) from err
+            raise
+
+        new_etag = response['ETag'].strip('"')
+        os.makedirs(key_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=key_dir, prefix=_TEMP_PREFIX, delete=False) as handle:
+            try:
+                shutil.copyfileobj(response['Body'], handle, 1024 * 1024)
+            except BaseException:
+                os.unlink(handle.name)
+                raise
+        size = os.path.getsize(handle.name)
+        self.cache_metrics.record(misses=1, bytes_downloaded=size)
+        if not _SAFE_ETAG.match(new_etag):
+            # Not nameable, so not cacheable; _open() reads this copy and deletes it
+            logger.warning('Not caching %s: unexpected ETag %r', key, new_etag)
+            return handle.name
+        new_path = os.path.join(key_dir, new_etag)
+        os.replace(handle.name, new_path)
+        for entry in os.scandir(key_dir):
+            if entry.path != new_path and not entry.name.startswith('.'):
+                self._remove(entry.path)
+        self._maybe_sweep(size)
+        return new_path
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _forget(self, name):
+        key_dir = self._cache_key_dir(self._normalize_name(clean_name(name)))
+        shutil.rmtree(key_dir, ignore_errors=True)
+
+    def _save(self, name, content):
+        self._forget(name)
+        return super()._save(name, content)
+
+    def delete(self, name):
+        self._forget(name)
+        super().delete(name)
+
+    def _maybe_sweep(self, written):
+        # Sweep after writing a tenth of the cap, rather than walking the tree every time
+        with self._sweep_lock:
+            self._written_since_sweep += written
+            if self._written_since_sweep < self.cache_max_bytes // 10:
+                return
+            self._written_since_sweep = 0
+        self.sweep()
+
+    def sweep(self):
+        """Evict least recently read copies until the cache is under 90% of its cap"""
+        try:
+            import fcntl
+        except ImportError:  # Windows
+            fcntl = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, '.sweep.lock'), 'w') as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return  # Another worker is sweeping
+            entries, total, now = [], 0, time.time()
+            for directory, _, filenames in os.walk(self.cache_dir):
+                for filename in filenames:
+                    path = os.path.join(directory, filename)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if filename.startswith(_TEMP_PREFIX):
+                        # Left behind by a worker that died mid-download
+                        if now - stat.st_mtime > 3600:
+                            self._remove(path)
+                        continue
+                    if not filename.startswith('.'):
+                        entries.append((stat.st_atime, stat.st_size, path))
+                        total += stat.st_size
+            target = self.cache_max_bytes * 9 // 10
+            if total <= self.cache_max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                self._remove(path)
+                total -= size
+                self.cache_metrics.record(evicted_files=1, evicted_bytes=size)
+
+
+class CachedS3Storage(ReadCacheMixin, PooledS3Storage):
+    """PooledS3Storage with reads served from the shared disk cache"""
+
+
+class CachedMediaStorage(ReadCacheMixin, MediaStorage):
+    """MediaStorage with reads served from the shared disk cache"""
+
+
+def save_many(storage, files):
+    """Save ``(name, content)`` pairs, concurrently when the backend supports it"""
+    if hasattr(storage, 'save_many'):
+        return storage.save_many(files)
+    return [storage.save(name, content) for name, content in files]
@@ -0,0 +1,16 @@
+"""
+Gunicorn configuration, read automatically from the working directory.
+
+ASYNC_VIEWS=True serves core.asgi through uvicorn workers (install the
+`asgi` extra), so the public read views in properties.async_views run on an
+event loop and one worker holds many slow connections. Otherwise core.wsgi
+runs on gunicorn's default sync workers, as before.
+"""
+import os
+
+
+if os.environ.get('ASYNC_VIEWS', 'False') == 'True':
+    wsgi_app = 'core.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'core.wsgi:application'
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Agent, Property, PropertyImage, Contact, Company
+from django.utils import timezone
+from .models import Agent, Property, PropertyImage, Contact, Company, Job
+from .search import search as search_properties
 
 
 @admin.register(Company)
@@ -59,7 +61,8 @@ class AgentAdmin(admin.ModelAdmin):
 class PropertyAdmin(admin.ModelAdmin):
     list_display = ['title', 'property_type', 'price', 'status', 'bedrooms', 'bathrooms', 'agent', 'featured', 'created_at']
     list_filter = ['status', 'property_type', 'featured', 'city']
-    search_fields = ['title', 'address', 'description']
+    # Answered from the full-text index by get_search_results(), not by scans
+    search_fields = ['title', 'city', 'address', 'postal_code', 'description']
     list_editable = ['status', 'featured']
     inlines = [PropertyImageInline]
     date_hierarchy = 'created_at'
@@ -78,6 +81,11 @@ class PropertyAdmin(admin.ModelAdmin):
             'fields': ('agent',)
         }),
     )
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Whole words and word prefixes in any of search_fields, like the site's
+        # search box; the index has no substring matches
+        return search_properties(queryset, search_term), False
 
 
 @admin.register(PropertyImage)
@@ -93,3 +101,15 @@ class ContactAdmin(admin.ModelAdmin):
     search_fields = ['name', 'email', 'phone', 'message']
     list_editable = ['responded']
     readonly_fields = ['created_at']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['task', 'status', 'attempts', 'max_attempts', 'run_after', 'locked_by', 'updated_at']
+    list_filter = ['status', 'task']
+    readonly_fields = ['created_at', 'updated_at']
+    actions = ['retry_now']
+    
+    @admin.action(description='Retry selected jobs now')
+    def retry_now(self, request, queryset):
+        queryset.update(status='queued', attempts=0, run_after=timezone.now(), locked_until=None)
@@ -0,0 +1,84 @@
+"""
+Async versions of the public read views, routed instead of the ones in
+properties.views when ASYNC_VIEWS is on and the site is served through
+core.asgi by an ASGI worker.
+
+Queries go through Django's async ORM, so a slow client or database call
+holds an event-loop task rather than a worker. Templates are still rendered
+in a thread: context processors and template tags are synchronous.
+"""
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404, render
+
+from .cache import add_cache_tags, cache_public_page
+from .counts import asearch_count
+from .facets import facet_counts
+from .models import Agent, AgentStats, Property
+from .pagination import KeysetPaginator
+from .views import PROPERTY_LIST_PAGE_SIZE, property_search, tag_cards
+
+
+arender = sync_to_async(render)
+afacet_counts = sync_to_async(facet_counts)
+
+
+@cache_public_page('property_list', 'company')
+async def home(request):
+    featured_properties = [
+        property async for property in Property.objects.filter(featured=True, status='available').with_card_data()[:6]
+    ]
+    tag_cards(request, featured_properties)
+    context = {
+        'featured_properties': featured_properties,
+    }
+    return await arender(request, 'properties/home.html', context)
+
+
+@cache_public_page('property_list', 'company')
+async def property_list(request):
+    properties, ordering, context = property_search(request.GET)
+    paginator = KeysetPaginator(properties, PROPERTY_LIST_PAGE_SIZE, ordering)
+    paginator.count, count_is_approximate = await asearch_count(properties, request.GET)
+    page_obj = await paginator.aget_page(request.GET.get('cursor'))
+    tag_cards(request, page_obj)
+
+    context.update({
+        'properties': page_obj,
+        'page_obj': page_obj,
+        'count_is_approximate': count_is_approximate,
+        'facets': await afacet_counts(request.GET),
+    })
+    return await arender(request, 'properties/property_list.html', context)
+
+
+@cache_public_page('property:{pk}', 'company')
+async def property_detail(request, pk):
+    property = await aget_object_or_404(
+        Property.objects.select_related('agent__user').prefetch_related('images'),
+        pk=pk,
+    )
+    if property.agent_id:
+        add_cache_tags(request, f'agent:{property.agent_id}')
+    context = {
+        'property': property,
+    }
+    return await arender(request, 'properties/property_detail.html', context)
+
+
+@cache_public_page('agent:{pk}', 'agent_listings:{pk}', 'company')
+async def agent_profile(request, pk):
+    agent = await aget_object_or_404(Agent.objects.select_related('user'), pk=pk)
+    agent_properties = [
+        property async for property in
+        Property.objects.filter(agent=agent, status='available').with_card_data().order_by('-created_at')
+    ]
+    tag_cards(request, agent_properties)
+    stats = await AgentStats.afor_agent(agent)
+
+    context = {
+        'agent': agent,
+        'properties': agent_properties,
+        'total_properties': stats.available,
+        'sold_properties': stats.sold,
+    }
+    return await arender(request, 'properties/agent_profile.html', context)
@@ -0,0 +1,233 @@
+"""
+Location autocomplete served from process memory.
+
+Each worker keeps a sorted list of normalized location terms (cities,
+districts, streets and postal codes of available listings) and answers
+prefix queries with bisect, so a lookup never touches the database.
+
+Property signals apply each change to the local index once it commits,
+bump a version counter in the shared cache and store the change under the
+new version. Every LOCATION_INDEX_CHECK_SECONDS a worker replays the
+changes made since its version, fetched with one get_many. Only when a
+change is missing (expired, or a bulk invalidate()) does it rebuild from
+the database, in a background thread and one rebuild at a time, while the
+stale index keeps answering.
+
+A change is a listing's new terms, not a delta, and the index remembers
+each listing's terms, so replaying a change twice is harmless. A rebuild
+reads the version before the rows: a change committed in between is both
+in the rows and replayed afterwards, and the replay changes nothing.
+"""
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+
+LOCATION_INDEX_VERSION_KEY = 'autocomplete:version'
+LOCATION_INDEX_CHANGE_PREFIX = 'autocomplete:change:'
+# How long changes are kept for other workers to replay
+CHANGE_TIMEOUT = 60 * 60
+# Workers further behind than this rebuild rather than replay
+MAX_REPLAY = 1000
+
+# Property fields the suggestions are built from
+LOCATION_FIELDS = ('status', 'city', 'address', 'postal_code')
+
+# Prefix matches examined per lookup before ranking by listing count
+MAX_CANDIDATES = 200
+
+DISTRICT_RE = re.compile(r'(?:[縣市])?([^\s\d縣市區鄉鎮]{1,4}[區鄉鎮])')
+CJK_STREET_RE = re.compile(r'([^\s\d縣市區鄉鎮號樓巷弄]{1,8}?(?:大道|路|街)(?:[一二三四五六七八九十]+段)?)')
+# '12-3 Zhongshan Rd., Sec. 2' -> 'Zhongshan Rd., Sec. 2'
+LATIN_STREET_RE = re.compile(r'^\s*(?:no\.?\s*)?[\d\-]+[a-z]?,?\s+([a-z].*)$', re.IGNORECASE)
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').strip().lower()
+
+
+def location_terms(values):
+    """(kind, display text) suggestions contributed by one listing's ``values``"""
+    if values.get('status') != 'available':
+        return []
+    terms = []
+    city = (values.get('city') or '').strip()
+    if city:
+        terms.append(('city', city))
+    postal_code = (values.get('postal_code') or '').strip()
+    if postal_code:
+        terms.append(('postal_code', postal_code))
+    address = unicodedata.normalize('NFKC', values.get('address') or '').strip()
+    if address:
+        district = DISTRICT_RE.search(address)
+        if district:
+            terms.append(('district', district.group(1)))
+        street = CJK_STREET_RE.search(address)
+        if street:
+            terms.append(('street', street.group(1)))
+        else:
+            latin = LATIN_STREET_RE.match(address)
+            if latin:
+                terms.append(('street', latin.group(1).strip()))
+    return terms
+
+
+class LocationIndex:
+    """Sorted ``(normalized, kind, display)`` keys with per-key listing counts"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held by the one thread rebuilding from the database
+        self.rebuild_lock = threading.Lock()
+        self.keys = []
+        self.counts = Counter()
+        # Listing pk -> the terms it contributes
+        self.terms = {}
+        self.version = None
+        self.checked_at = 0.0
+        self.loaded = False
+
+    def _key(self, term):
+        kind, display = term
+        return (normalize(display), kind, display)
+
+    def _add(self, terms):
+        for term in terms:
+            key = self._key(term)
+            self.counts[key] += 1
+            if self.counts[key] == 1:
+                insort(self.keys, key)
+
+    def _remove(self, terms):
+        for term in terms:
+            key = self._key(term)
+            if self.counts[key] <= 0:
+                continue
+            self.counts[key] -= 1
+            if self.counts[key] == 0:
+                del self.counts[key]
+                index = bisect_left(self.keys, key)
+                if index < len(self.keys) and self.keys[index] == key:
+                    del self.keys[index]
+
+    def _set(self, pk, terms):
+        """Make listing ``pk`` contribute ``terms``, whatever it contributed before"""
+        self._remove(self.terms.pop(pk, ()))
+        if terms:
+            self.terms[pk] = terms
+            self._add(terms)
+
+    def rebuild(self):
+        from .models import Property
+
+        # Before the rows, so later changes are replayed even if the rows have them
+        version = cache.get_or_set(LOCATION_INDEX_VERSION_KEY, 0, None)
+        counts, listing_terms = Counter(), {}
+        rows = Property.objects.filter(status='available').values_list('pk', *LOCATION_FIELDS)
+        for pk, *values in rows.iterator():
+            terms = tuple(location_terms(dict(zip(LOCATION_FIELDS, values))))
+            if terms:
+                listing_terms[pk] = terms
+                counts.update(self._key(term) for term in terms)
+        with self.lock:
+            self.counts = counts
+            self.keys = sorted(counts)
+            self.terms = listing_terms
+            self.version = version
+            self.loaded = True
+
+    def _rebuild_in_background(self):
+        if not self.rebuild_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.rebuild()
+            finally:
+                connection.close()
+                self.rebuild_lock.release()
+        threading.Thread(target=run, name='location-index-rebuild', daemon=True).start()
+
+    def _replay(self, current):
+        """Apply the changes up to version ``current``; False if some are gone"""
+        if current - self.version > MAX_REPLAY:
+            return False
+        keys = [f'{LOCATION_INDEX_CHANGE_PREFIX}{version}' for version in range(self.version + 1, current + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            return False
+        with self.lock:
+            # In version order, so each listing ends with its latest terms
+            for key in keys:
+                self._set(*changes[key])
+            self.version = current
+        return True
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+        interval = getattr(settings, 'LOCATION_INDEX_CHECK_SECONDS', 5)
+        if self.loaded and now - self.checked_at < interval:
+            return
+        if not self.loaded:
+            # Nothing to serve yet: build it here, once for all waiting threads
+            with self.rebuild_lock:
+                if not self.loaded:
+                    self.rebuild()
+        else:
+            current = cache.get(LOCATION_INDEX_VERSION_KEY)
+            if current is None or current < self.version or (current > self.version and not self._replay(current)):
+                self._rebuild_in_background()
+        self.checked_at = now
+
+    def _bump(self):
+        try:
+            return cache.incr(LOCATION_INDEX_VERSION_KEY)
+        except ValueError:
+            cache.add(LOCATION_INDEX_VERSION_KEY, 0, None)
+            return cache.incr(LOCATION_INDEX_VERSION_KEY)
+
+    def apply_change(self, pk, old_values, new_values):
+        """Update listing ``pk``'s terms locally and publish them to other workers"""
+        old_terms, new_terms = tuple(location_terms(old_values)), tuple(location_terms(new_values))
+        if old_terms == new_terms:
+            return
+        with self.lock:
+            version = self._bump()
+            cache.set(f'{LOCATION_INDEX_CHANGE_PREFIX}{version}', (pk, new_terms), CHANGE_TIMEOUT)
+            if self.loaded:
+                self._set(pk, new_terms)
+
+    def invalidate(self):
+        """Make every worker rebuild: this one on its next lookup, others in the background"""
+        with self.lock:
+            self._bump()
+            self.loaded = False
+
+    def suggest(self, query, limit=8):
+        """Up to ``limit`` suggestions starting with ``query``, most listings first"""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        self.ensure_fresh()
+        with self.lock:
+            start = bisect_left(self.keys, (prefix,))
+            matches = []
+            for key in self.keys[start:start + MAX_CANDIDATES]:
+                if not key[0].startswith(prefix):
+                    break
+                matches.append((self.counts[key], key))
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return [
+            {'text': display, 'kind': kind, 'count': count}
+            for count, (normalized, kind, display) in matches[:limit]
+        ]
+
+
+location_index = LocationIndex()
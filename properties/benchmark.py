@@ -0,0 +1,400 @@
+"""
+Synthetic data and request mixes for load benchmarks.
+
+seed() bulk-creates agents, listings, images and inquiries shaped like the
+agency's real stock: mostly Hualien, a Taipei minority, prices, sizes and
+property types drawn per city. It writes the derived data bulk_create
+skips (geohashes, image summaries, search documents, agent stats, map
+clusters). Rows are marked with a ``BENCH-`` reference so a seeded database
+is easy to recognise; seed into a scratch database, not production.
+
+build_scenarios() turns that data into weighted requests against every GET
+route in properties/urls.py, and summarize() reduces timings to the
+percentiles `run_benchmark` reports and compares.
+"""
+import math
+import random
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+from urllib.parse import urlencode
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import clusters, facets
+from .autocomplete import location_index
+from .cache import invalidate_tags
+from .counts import COUNT_TAG
+from .filters import filter_properties
+from .images import generate_variants
+from .models import Agent, AgentStats, Contact, Property, PropertyImage, SearchDocument
+from .pagination import SORT_ORDERINGS, KeysetPaginator, encode_cursor
+from .search import build_document
+from .views import PROPERTY_LIST_PAGE_SIZE
+
+
+REFERENCE_PREFIX = 'BENCH-'
+AGENT_USERNAME_PREFIX = 'bench-agent-'
+# Seeded agents can sign in with this, e.g. for authenticated benchmark runs
+AGENT_PASSWORD = 'benchmark'
+
+PLACEHOLDER_COUNT = 8
+
+# (city, share of listings, districts); each district is
+# (English name, Chinese name, postal code, latitude, longitude, weight)
+CITIES = (
+    ('Hualien', 0.6, (
+        ('Hualien City', '花蓮市', '970', 23.9769, 121.6044, 45),
+        ("Ji'an", '吉安鄉', '973', 23.9686, 121.5665, 25),
+        ('Xincheng', '新城鄉', '971', 24.1280, 121.6400, 10),
+        ('Shoufeng', '壽豐鄉', '974', 23.8690, 121.5090, 10),
+        ('Fenglin', '鳳林鎮', '975', 23.7450, 121.4520, 5),
+        ('Yuli', '玉里鎮', '981', 23.3360, 121.3110, 5),
+    )),
+    ('Taipei', 0.4, (
+        ("Da'an", '大安區', '106', 25.0264, 121.5436, 25),
+        ('Xinyi', '信義區', '110', 25.0330, 121.5654, 20),
+        ('Zhongshan', '中山區', '104', 25.0685, 121.5266, 20),
+        ('Neihu', '內湖區', '114', 25.0830, 121.5880, 15),
+        ('Shilin', '士林區', '111', 25.0930, 121.5250, 10),
+        ('Wanhua', '萬華區', '108', 25.0350, 121.4990, 10),
+    )),
+)
+
+# Property type weights per city
+PROPERTY_TYPES = {
+    'Hualien': {'house': 35, 'apartment': 30, 'condo': 15, 'villa': 8, 'land': 12},
+    'Taipei': {'apartment': 50, 'condo': 35, 'house': 8, 'villa': 2, 'land': 5},
+}
+
+# Median price in TWD per (city, listing type); prices are log-normal around it
+MEDIAN_PRICES = {
+    ('Hualien', 'sale'): 8_000_000,
+    ('Hualien', 'rent'): 15_000,
+    ('Taipei', 'sale'): 25_000_000,
+    ('Taipei', 'rent'): 35_000,
+}
+
+# Median floor area in square metres per property type
+MEDIAN_AREAS = {'apartment': 80, 'condo': 100, 'house': 150, 'villa': 250, 'land': 500}
+
+TYPE_NAMES = {
+    'house': ('透天厝', 'House'),
+    'apartment': ('公寓', 'Apartment'),
+    'condo': ('電梯大樓', 'Condo'),
+    'villa': ('別墅', 'Villa'),
+    'land': ('建地', 'Land'),
+}
+
+STREETS = ('中山路', '中正路', '中華路', '林森路', '民權路', '建國路', '和平路', '光復街', '信義街', '復興路')
+
+STATUS_WEIGHTS = {'available': 80, 'pending': 8, 'sold': 12}
+
+
+def _weighted(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _lognormal(rng, median, sigma):
+    return median * math.exp(rng.gauss(0, sigma))
+
+
+def make_listing(rng, index, agent_ids, now):
+    """One unsaved benchmark Property"""
+    city, _, districts = rng.choices(CITIES, weights=[share for _, share, _ in CITIES])[0]
+    district, district_zh, postal_code, latitude, longitude, _ = rng.choices(
+        districts, weights=[district[-1] for district in districts]
+    )[0]
+    property_type = _weighted(rng, PROPERTY_TYPES[city])
+    listing_type = 'rent' if property_type != 'land' and rng.random() < 0.25 else 'sale'
+    area = max(15.0, _lognormal(rng, MEDIAN_AREAS[property_type], 0.35))
+    price = _lognormal(rng, MEDIAN_PRICES[(city, listing_type)], 0.5) * (area / MEDIAN_AREAS[property_type]) ** 0.5
+    bedrooms = 0 if property_type == 'land' else min(6, max(1, round(area / 35)))
+    bathrooms = 0 if property_type == 'land' else max(1, bedrooms - rng.randint(0, 2))
+    type_zh, type_en = TYPE_NAMES[property_type]
+    street = rng.choice(STREETS)
+    created_at = now - timedelta(seconds=rng.randint(0, 3 * 365 * 86400))
+    property = Property(
+        reference=f'{REFERENCE_PREFIX}{index}',
+        title=f'{district_zh}{type_zh} {bedrooms}房 / {type_en} in {district}' if bedrooms else f'{district_zh}{type_zh} / {type_en} in {district}',
+        description=(
+            f'{district_zh}{street}{type_zh}，面積約{area:.0f}平方公尺。'
+            f'\n{type_en} of about {area:.0f} sqm on {street}, {district}, {city}.'
+        ),
+        price=Decimal(round(price, -3 if listing_type == 'sale' else -2)).quantize(Decimal('0.01')),
+        listing_type=listing_type,
+        property_type=property_type,
+        status=_weighted(rng, STATUS_WEIGHTS),
+        address=f'{district_zh}{street}{rng.randint(1, 400)}號',
+        city=city,
+        postal_code=postal_code,
+        latitude=Decimal(latitude + rng.gauss(0, 0.012)).quantize(Decimal('0.000001')),
+        longitude=Decimal(longitude + rng.gauss(0, 0.012)).quantize(Decimal('0.000001')),
+        bedrooms=bedrooms,
+        bathrooms=bathrooms,
+        area_sqm=Decimal(area).quantize(Decimal('0.01')),
+        year_built=None if property_type == 'land' else rng.randint(1975, now.year),
+        parking_spaces=0 if property_type == 'land' else rng.choice((0, 0, 1, 1, 1, 2)),
+        agent_id=rng.choice(agent_ids) if agent_ids else None,
+        featured=rng.random() < 0.02,
+    )
+    property.geohash = property.compute_geohash()
+    # auto_now_add overrides this on insert; it is written back with bulk_update
+    property.created_at = created_at
+    return property
+
+
+def placeholder_images():
+    """
+    (storage name, variants JSON) for a few shared placeholder photos, created
+    with their responsive variants on first use, so seeded listings render
+    srcsets without storing an image per row
+    """
+    field = PropertyImage._meta.get_field('image')
+    placeholders = []
+    for index in range(PLACEHOLDER_COUNT):
+        name = f'benchmark/placeholder_{index}.jpg'
+        if not field.storage.exists(name):
+            buffer = BytesIO()
+            hue = 30 + index * 25
+            Image.new('RGB', (1600, 1200), (hue, 120, 200 - hue // 2)).save(buffer, 'JPEG', quality=85)
+            name = field.storage.save(name, ContentFile(buffer.getvalue()))
+        variants = PropertyImage.objects.filter(image=name).values_list('image_variants', flat=True).first()
+        if not variants:
+            variants = generate_variants(PropertyImage(image=name).image)
+        placeholders.append((name, variants))
+    return placeholders
+
+
+def seed_agents(count, rng):
+    """Create ``count`` benchmark agents and return their ids"""
+    start = User.objects.filter(username__startswith=AGENT_USERNAME_PREFIX).count()
+    password = make_password(AGENT_PASSWORD)
+    first_names = ('美玲', '志明', '淑芬', '家豪', 'Mei', 'Wei', 'Ting', 'Chen')
+    last_names = ('林', '陳', '王', '張', '李', 'Lin', 'Wang', 'Huang')
+    users = User.objects.bulk_create([
+        User(
+            username=f'{AGENT_USERNAME_PREFIX}{start + index}',
+            email=f'{AGENT_USERNAME_PREFIX}{start + index}@example.com',
+            password=password,
+            first_name=rng.choice(first_names),
+            last_name=rng.choice(last_names),
+        )
+        for index in range(count)
+    ])
+    # Not every backend returns pks from bulk_create
+    users = User.objects.filter(username__in=[user.username for user in users])
+    specializations = ('Residential', 'Luxury homes', 'Rentals', 'Land', 'Commercial', '')
+    Agent.objects.bulk_create([
+        Agent(
+            user=user,
+            phone=f'09{rng.randint(10000000, 99999999)}',
+            specialization=rng.choice(specializations),
+            bio='Benchmark agent',
+            is_authorized=rng.random() < 0.9,
+        )
+        for user in users
+    ])
+    return list(Agent.objects.filter(user__in=users).values_list('pk', flat=True))
+
+
+def seed(count, agent_count=200, images_per_listing=4, contact_ratio=0.1, batch_size=2000, random_seed=0, progress=None):
+    """
+    Bulk-create ``count`` listings (plus agents, images and contacts) and
+    rebuild the derived data. ``progress(done)`` is called after each batch.
+    Returns a dict of created row counts.
+    """
+    rng = random.Random(random_seed)
+    now = timezone.now()
+    created = {'agents': 0, 'properties': 0, 'images': 0, 'contacts': 0}
+    start = Property.objects.filter(reference__startswith=REFERENCE_PREFIX).count()
+
+    with transaction.atomic():
+        agent_ids = seed_agents(agent_count, rng)
+    created['agents'] = len(agent_ids)
+    placeholders = placeholder_images() if images_per_listing else []
+
+    for offset in range(0, count, batch_size):
+        size = min(batch_size, count - offset)
+        with transaction.atomic():
+            listings = [make_listing(rng, start + offset + i, agent_ids, now) for i in range(size)]
+            created_at = {listing.reference: listing.created_at for listing in listings}
+            Property.objects.bulk_create(listings)
+            listings = list(Property.objects.filter(reference__in=list(created_at)))
+
+            images = []
+            for listing in listings:
+                listing.created_at = created_at[listing.reference]
+                for order in range(max(0, min(2 * images_per_listing, round(rng.gauss(images_per_listing, 1.5))))):
+                    name, variants = rng.choice(placeholders)
+                    images.append(PropertyImage(
+                        property=listing, image=name, image_variants=variants,
+                        order=order, is_primary=order == 0,
+                    ))
+            PropertyImage.objects.bulk_create(images)
+
+            # The denormalized summary refresh_image_summary() would keep
+            primary = {}
+            for property_id, image_id, is_primary in (
+                PropertyImage.objects.filter(property__in=listings).values_list('property_id', 'pk', 'is_primary')
+            ):
+                primary.setdefault(property_id, [None, 0])
+                primary[property_id][1] += 1
+                if is_primary:
+                    primary[property_id][0] = image_id
+            for listing in listings:
+                listing.primary_image_id, listing.image_count = primary.get(listing.pk, (None, 0))
+            Property.objects.bulk_update(listings, ['created_at', 'primary_image', 'image_count'])
+
+            SearchDocument.objects.bulk_create([
+                SearchDocument(property_id=listing.pk, **build_document(listing)) for listing in listings
+            ])
+            contacts = [
+                Contact(
+                    name=f'Buyer {start + offset + i}',
+                    email=f'buyer{start + offset + i}@example.com',
+                    phone=f'09{rng.randint(10000000, 99999999)}',
+                    property=listing,
+                    message='Is this listing still available? 請問還在嗎？',
+                    responded=rng.random() < 0.6,
+                )
+                for i, listing in enumerate(listings)
+                if rng.random() < contact_ratio
+            ]
+            Contact.objects.bulk_create(contacts)
+        created['properties'] += len(listings)
+        created['images'] += len(images)
+        created['contacts'] += len(contacts)
+        if progress:
+            progress(offset + size)
+
+    for agent_id in agent_ids:
+        AgentStats.refresh(agent_id)
+    clusters.rebuild()
+    facets.rebuild()
+    location_index.invalidate()
+    invalidate_tags('property_list', 'agent_list', COUNT_TAG)
+    return created
+
+
+Scenario = namedtuple('Scenario', 'name url weight login')
+
+
+def _list_url(**params):
+    return f"{reverse('properties:property_list')}?{urlencode(params)}" if params else reverse('properties:property_list')
+
+
+def deep_cursor(params, sort_by, page):
+    """The cursor property_list would link to for page ``page`` (0-based) of a search"""
+    queryset = filter_properties(Property.objects.filter(status='available'), params)
+    ordering = SORT_ORDERINGS[sort_by]
+    paginator = KeysetPaginator(queryset, PROPERTY_LIST_PAGE_SIZE, ordering)
+    boundary = queryset.order_by(*ordering)[page * PROPERTY_LIST_PAGE_SIZE - 1:page * PROPERTY_LIST_PAGE_SIZE].first()
+    if boundary is None:
+        return None
+    return encode_cursor(paginator._row_values(boundary), 'n')
+
+
+def build_scenarios(rng, sample_size=50, authenticated=True):
+    """
+    Weighted requests covering every GET route in properties/urls.py.
+    Routes that change data on GET (image delete, logout) and POST-only
+    endpoints are left out. ``login`` names the agent a request runs as.
+    """
+    available = Property.objects.filter(status='available')
+    property_ids = list(available.order_by('?').values_list('pk', flat=True)[:sample_size])
+    agents = list(Agent.objects.filter(stats__available__gt=0).order_by('?').values_list('pk', 'user__username')[:sample_size])
+    scenarios = [
+        Scenario('home', reverse('properties:home'), 10, None),
+        Scenario('property_list', _list_url(), 15, None),
+        Scenario('agent_list', reverse('properties:agent_list'), 3, None),
+        Scenario('agent_list', f"{reverse('properties:agent_list')}?q=lin", 1, None),
+        Scenario('about', reverse('properties:about'), 2, None),
+        Scenario('contacts', reverse('properties:contacts'), 2, None),
+        Scenario('agent_login', reverse('properties:agent_login'), 1, None),
+        Scenario('agent_register', reverse('properties:agent_register'), 1, None),
+    ]
+    for sort_by in SORT_ORDERINGS:
+        scenarios.append(Scenario('property_list', _list_url(sort_by=sort_by), 3, None))
+    for params in (
+        {'listing_type': 'sale', 'property_type': 'house,apartment'},
+        {'listing_type': 'rent', 'max_price': '30000'},
+        {'min_price': '5000000', 'max_price': '20000000', 'bedrooms': '3'},
+        {'property_type': 'condo', 'bathrooms': '2', 'sort_by': 'price_low'},
+        {'location': 'Hualien'},
+        {'location': '大安'},
+        {'q': '花蓮 透天'},
+        {'q': 'villa', 'sort_by': 'price_high'},
+        {'lat': '23.9769', 'lng': '121.6044', 'radius_km': '5'},
+        {'bbox': '25.00,121.50,25.10,121.60', 'listing_type': 'sale'},
+    ):
+        scenarios.append(Scenario('property_list', _list_url(**params), 4, None))
+    for page in (5, 50, 500):
+        cursor = deep_cursor({}, 'newest', page)
+        if cursor:
+            scenarios.append(Scenario('property_list', _list_url(cursor=cursor), 2, None))
+    for pk in property_ids:
+        scenarios.append(Scenario('property_detail', reverse('properties:property_detail', args=[pk]), 30 / max(len(property_ids), 1), None))
+    for pk, _ in agents:
+        scenarios.append(Scenario('agent_profile', reverse('properties:agent_profile', args=[pk]), 8 / max(len(agents), 1), None))
+    for zoom, bbox in ((8, '23.0,120.9,25.3,122.0'), (12, '23.90,121.50,24.05,121.70'), (15, '25.02,121.53,25.05,121.57')):
+        scenarios.append(Scenario('map_clusters', f"{reverse('properties:map_clusters')}?{urlencode({'zoom': zoom, 'bbox': bbox})}", 3, None))
+    for params in ({}, {'listing_type': 'rent'}, {'property_type': 'house', 'bedrooms': '3'}, {'q': '花蓮'}):
+        scenarios.append(Scenario('property_facets', f"{reverse('properties:property_facets')}?{urlencode(params)}", 2, None))
+    for prefix in ('hua', '花', 'tai', '大安', 'ji'):
+        scenarios.append(Scenario('location_autocomplete', f"{reverse('properties:location_autocomplete')}?q={prefix}", 2, None))
+
+    if authenticated and agents:
+        owned = list(
+            Property.objects.filter(agent_id__in=[pk for pk, _ in agents])
+            .order_by('?').values_list('pk', 'agent__user__username')[:sample_size]
+        )
+        for pk, username in agents[:10]:
+            scenarios.append(Scenario('agent_dashboard', reverse('properties:agent_dashboard'), 0.5, username))
+            scenarios.append(Scenario('property_create', reverse('properties:property_create'), 0.1, username))
+        for pk, username in owned[:10]:
+            scenarios.append(Scenario('property_edit', reverse('properties:property_edit', args=[pk]), 0.2, username))
+            scenarios.append(Scenario('property_delete', reverse('properties:property_delete', args=[pk]), 0.05, username))
+    return scenarios
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples):
+    """
+    Per-route and overall stats from ``(name, seconds, queries, status)``
+    samples: count, errors, p50/p95/p99/mean latency in ms and queries.
+    """
+    groups = {}
+    for sample in samples:
+        groups.setdefault(sample[0], []).append(sample)
+    groups['*'] = samples
+
+    result = {}
+    for name, group in sorted(groups.items()):
+        latencies = sorted(seconds * 1000 for _, seconds, _, _ in group)
+        queries = [count for _, _, count, _ in group if count is not None]
+        result[name] = {
+            'requests': len(group),
+            'errors': sum(1 for _, _, _, status in group if status >= 400),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'queries_max': max(queries) if queries else None,
+        }
+    return result
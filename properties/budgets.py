@@ -0,0 +1,149 @@
+"""
+Per-URL performance budgets.
+
+performance_budgets.toml caps, for every URL name in properties/urls.py,
+the queries one request may run and its time in milliseconds on the seeded
+benchmark dataset (see properties.benchmark). The check_performance_budgets
+command checks both against a database seeded with seed_benchmark_data.
+The test suite only checks query counts, which don't depend on the machine
+or the dataset size, on a small dataset of its own.
+
+Requests are measured with warm process caches (company, location index)
+and without the page cache, so the numbers are what a view itself costs.
+"""
+import os
+import re
+import time
+import tomllib
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+
+BUDGET_FILE = os.path.join(os.path.dirname(__file__), 'performance_budgets.toml')
+
+# Measured requests per URL, after one unmeasured warm-up request
+RUNS = 3
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r'IN \((?:\?, )*\?\)')
+
+
+def load_budgets(path=BUDGET_FILE):
+    """
+    ``{url_name: {'queries': int, 'ms': float}}``; routes listed with only a
+    ``skip`` reason map to None
+    """
+    with open(path, 'rb') as handle:
+        data = tomllib.load(handle)
+    budgets = {}
+    for namespace, routes in data.items():
+        for name, budget in routes.items():
+            budgets[f'{namespace}:{name}'] = None if 'skip' in budget else {
+                'queries': budget['queries'],
+                'ms': budget['ms'] * time_factor(),
+            }
+    return budgets
+
+
+def time_factor():
+    """PERFORMANCE_BUDGET_TIME_FACTOR scales every time budget, for slow CI machines"""
+    return float(os.environ.get('PERFORMANCE_BUDGET_TIME_FACTOR', '1'))
+
+
+def normalize_sql(sql):
+    """``sql`` with literals replaced by ``?``, so repeats of one statement compare equal"""
+    return _IN_LIST_RE.sub('IN (...)', _LITERAL_RE.sub('?', sql))
+
+
+def measure(fetch, url):
+    """
+    Request ``url`` with ``fetch(url)`` once to warm up, then RUNS times.
+    Returns ``(status, queries, ms)``: the SQL of the measured request that
+    ran the most and the slowest time.
+    """
+    fetch(url)
+    status, worst, slowest = None, None, 0.0
+    for _ in range(RUNS):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = fetch(url)
+            slowest = max(slowest, (time.perf_counter() - started) * 1000)
+        status = response.status_code
+        if worst is None or len(captured.captured_queries) > len(worst):
+            worst = [query['sql'] for query in captured.captured_queries]
+    return status, worst, slowest
+
+
+def sql_report(queries, allowed):
+    """
+    The statements a request ran, in order, with a ``+`` before those over
+    budget: repeats of an earlier statement (usually a query in a loop) and,
+    failing that, whatever ran after the first ``allowed``
+    """
+    shapes = [normalize_sql(sql) for sql in queries]
+    extra = len(queries) - allowed
+    seen = Counter()
+    marks = []
+    for shape in shapes:
+        seen[shape] += 1
+        marks.append(seen[shape] > 1)
+    for index in range(len(shapes) - 1, -1, -1):
+        if sum(marks) >= extra:
+            break
+        marks[index] = True
+    return '\n'.join(f"{'+' if marked else ' '} {sql}" for marked, sql in zip(marks, queries))
+
+
+def check(name, url, status, queries, ms, budget, check_time=True):
+    """Problems with one measured request, as a list of messages"""
+    problems = []
+    if status >= 400:
+        problems.append(f'{name} {url} returned {status}')
+    if len(queries) > budget['queries']:
+        problems.append(
+            f"{name} {url} ran {len(queries)} queries, budget {budget['queries']} "
+            f"(+{len(queries) - budget['queries']}):\n{sql_report(queries, budget['queries'])}"
+        )
+    if check_time and ms > budget['ms']:
+        problems.append(f"{name} {url} took {ms:.0f} ms, budget {budget['ms']:.0f} ms")
+    return problems
+
+
+def unbudgeted_routes(budgets):
+    """URL names in properties/urls.py missing from the budget file"""
+    from . import urls
+    return sorted(
+        f'{urls.app_name}:{pattern.name}' for pattern in urls.urlpatterns
+        if f'{urls.app_name}:{pattern.name}' not in budgets
+    )
+
+
+def check_scenarios(scenarios, budgets, check_time=True):
+    """
+    Measure each distinct URL of ``scenarios`` (see
+    properties.benchmark.build_scenarios) against its route's budget, or
+    only its query budget without ``check_time``. Returns ``(results,
+    problems)``: one ``(url_name, url, status, queries, ms)`` tuple per URL
+    and the messages for those over budget.
+    """
+    clients = {}
+    results, problems, seen = [], [], set()
+    for scenario in scenarios:
+        name = f'properties:{scenario.name}'
+        budget = budgets.get(name)
+        if scenario.url in seen or budget is None:
+            continue
+        seen.add(scenario.url)
+        client = clients.get(scenario.login)
+        if client is None:
+            client = clients[scenario.login] = Client()
+            if scenario.login:
+                client.force_login(User.objects.get(username=scenario.login))
+        status, queries, ms = measure(lambda url: client.get(url, secure=True), scenario.url)
+        results.append((name, scenario.url, status, queries, ms))
+        problems.extend(check(name, scenario.url, status, queries, ms, budget, check_time))
+    return results, problems
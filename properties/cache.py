@@ -0,0 +1,190 @@
+"""
+Full-page response cache for anonymous visitors with tag-based invalidation.
+
+Each cached page records the version of every tag it depends on (e.g.
+``property:12``, ``agent:3``, ``property_list``). Model signals bump tag
+versions when data changes, and a page whose recorded versions no longer
+match is treated as a miss, so only the affected pages are re-rendered.
+
+Fragments (listing cards) are cached the same way by render_fragments(),
+for every visitor, so a page that does get rendered reuses unchanged cards.
+"""
+import hashlib
+import re
+import uuid
+from functools import wraps
+from inspect import iscoroutinefunction
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.translation import get_language
+
+
+PAGE_KEY_PREFIX = 'page:'
+FRAGMENT_KEY_PREFIX = 'fragment:'
+TAG_KEY_PREFIX = 'pagetag:'
+
+# Query parameters that never change the rendered page
+IGNORED_QUERY_PARAMS = ('fbclid', 'gclid')
+IGNORED_QUERY_PREFIXES = ('utm_',)
+
+# Cached HTML must not hand one visitor's CSRF token to another, so the
+# token is swapped for a placeholder on store and a fresh one on each hit
+CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = '__PAGE_CACHE_CSRF_TOKEN__'
+
+
+def normalize_query_string(query_dict):
+    """Sorted, empty-free query string so equivalent URLs share a cache entry"""
+    items = []
+    for key in sorted(query_dict):
+        if key in IGNORED_QUERY_PARAMS or key.startswith(IGNORED_QUERY_PREFIXES):
+            continue
+        for value in sorted(query_dict.getlist(key)):
+            if value != '':
+                items.append((key, value))
+    return urlencode(items)
+
+
+def page_cache_key(request):
+    raw = f'{request.path}?{normalize_query_string(request.GET)}#{get_language()}'
+    return PAGE_KEY_PREFIX + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def add_cache_tags(request, *tags):
+    """Declare extra tags the page being rendered depends on (e.g. one per card)"""
+    if hasattr(request, '_page_cache_tags'):
+        request._page_cache_tags.update(tags)
+
+
+def get_tag_versions(tags):
+    tags = sorted(tags)
+    found = cache.get_many([TAG_KEY_PREFIX + tag for tag in tags])
+    return {tag: found.get(TAG_KEY_PREFIX + tag) for tag in tags}
+
+
+async def aget_tag_versions(tags):
+    tags = sorted(tags)
+    found = await cache.aget_many([TAG_KEY_PREFIX + tag for tag in tags])
+    return {tag: found.get(TAG_KEY_PREFIX + tag) for tag in tags}
+
+
+def invalidate_tags(*tags):
+    """Bump the given tags once the current transaction commits"""
+    def bump():
+        version = uuid.uuid4().hex
+        cache.set_many({TAG_KEY_PREFIX + tag: version for tag in tags}, None)
+    transaction.on_commit(bump)
+
+
+def render_fragments(items, render):
+    """
+    HTML for each of ``items``, a list of ``(key, tags, obj)``: the cached
+    fragment for ``key`` if none of its ``tags`` changed since it was
+    stored, else ``render(obj)``, stored for next time. Fragments and tag
+    versions are read with a single get_many().
+    """
+    keys = [FRAGMENT_KEY_PREFIX + hashlib.sha256(key.encode()).hexdigest() for key, _, _ in items]
+    tags = {tag for _, item_tags, _ in items for tag in item_tags}
+    found = cache.get_many(keys + [TAG_KEY_PREFIX + tag for tag in tags])
+
+    fragments, stale = [], {}
+    for cache_key, (_, item_tags, obj) in zip(keys, items):
+        versions = {tag: found.get(TAG_KEY_PREFIX + tag) for tag in item_tags}
+        entry = found.get(cache_key)
+        if entry is None or entry['tags'] != versions:
+            entry = stale[cache_key] = {'html': render(obj), 'tags': versions}
+        fragments.append(entry['html'])
+    if stale:
+        cache.set_many(stale, getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24))
+    return fragments
+
+
+def _cached_response(request, entry):
+    content = entry['content'].replace(CSRF_PLACEHOLDER, get_token(request))
+    response = HttpResponse(content, content_type=entry['content_type'])
+    response['X-Page-Cache'] = 'hit'
+    return response
+
+
+def _is_cacheable(response):
+    return response.status_code == 200 and not response.streaming
+
+
+def _page_entry(response, versions):
+    content = CSRF_INPUT_RE.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', response.content.decode(response.charset))
+    response['X-Page-Cache'] = 'miss'
+    return {
+        'content': content,
+        'content_type': response['Content-Type'],
+        'tags': versions,
+    }
+
+
+def cache_public_page(*tags):
+    """
+    Cache a view's response for anonymous GET/HEAD requests.
+
+    ``tags`` may use the view's URL kwargs, e.g. ``'property:{pk}'``; views add
+    data-dependent tags with add_cache_tags(). The key covers the path, the
+    normalized query string and the active language. Works on sync and
+    async views alike.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                if (not getattr(settings, 'PAGE_CACHE_ENABLED', True)
+                        or request.method not in ('GET', 'HEAD')
+                        or (await request.auser()).is_authenticated):
+                    return await view_func(request, *args, **kwargs)
+
+                key = page_cache_key(request)
+                entry = await cache.aget(key)
+                if entry is not None and await aget_tag_versions(entry['tags']) == entry['tags']:
+                    return _cached_response(request, entry)
+
+                static_tags = {tag.format(**kwargs) for tag in tags}
+                versions = await aget_tag_versions(static_tags)
+                request._page_cache_tags = set()
+                response = await view_func(request, *args, **kwargs)
+
+                if _is_cacheable(response):
+                    dynamic_tags = request._page_cache_tags - static_tags
+                    if dynamic_tags:
+                        versions.update(await aget_tag_versions(dynamic_tags))
+                    await cache.aset(key, _page_entry(response, versions), getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24))
+                return response
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if (not getattr(settings, 'PAGE_CACHE_ENABLED', True)
+                    or request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated):
+                return view_func(request, *args, **kwargs)
+
+            key = page_cache_key(request)
+            entry = cache.get(key)
+            if entry is not None and get_tag_versions(entry['tags']) == entry['tags']:
+                return _cached_response(request, entry)
+
+            # Snapshot versions before rendering so a change made mid-render
+            # invalidates what we are about to store
+            static_tags = {tag.format(**kwargs) for tag in tags}
+            versions = get_tag_versions(static_tags)
+            request._page_cache_tags = set()
+            response = view_func(request, *args, **kwargs)
+
+            if _is_cacheable(response):
+                dynamic_tags = request._page_cache_tags - static_tags
+                if dynamic_tags:
+                    versions.update(get_tag_versions(dynamic_tags))
+                cache.set(key, _page_entry(response, versions), getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24))
+            return response
+        return wrapper
+    return decorator
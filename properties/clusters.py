@@ -0,0 +1,149 @@
+"""
+Server-side map marker clustering.
+
+Available properties with coordinates are counted into geohash cells at a
+few precisions (MapCluster rows). Each save adjusts only the cells the
+property leaves and enters, so serving a viewport is a range read of
+pre-aggregated rows whose size depends on the zoom, not on the inventory.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, Max, Min, Q, Value, When
+
+from . import geo
+from .models import MapCluster, Property
+
+
+# Geohash precisions that get aggregates; 8 is a ~40m cell
+CLUSTER_PRECISIONS = range(1, 9)
+
+# Property fields whose change moves a listing between clusters
+CLUSTER_FIELDS = ('status', 'latitude', 'longitude', 'price')
+
+
+def precision_for_zoom(zoom):
+    """
+    Precision whose cells are about a quarter of a 256px map tile wide at
+    ``zoom``, so a viewport shows a few hundred clusters at most.
+    """
+    for precision in CLUSTER_PRECISIONS:
+        if geo.cell_size(precision)[1] <= 360.0 / 2 ** (zoom + 2):
+            return precision
+    return CLUSTER_PRECISIONS[-1]
+
+
+def contribution(values):
+    """(geohash, latitude, longitude, price) a property adds to the map, or None"""
+    if values.get('status') != 'available':
+        return None
+    latitude, longitude = values.get('latitude'), values.get('longitude')
+    if latitude is None or longitude is None:
+        return None
+    return geo.encode(latitude, longitude), float(latitude), float(longitude), values['price']
+
+
+def _add(geohash, latitude, longitude, price):
+    for precision in CLUSTER_PRECISIONS:
+        cell = geohash[:precision]
+        rows = MapCluster.objects.filter(precision=precision, cell=cell)
+        changes = {
+            'count': F('count') + 1,
+            'latitude_sum': F('latitude_sum') + latitude,
+            'longitude_sum': F('longitude_sum') + longitude,
+            # Case/When rather than LEAST/GREATEST: SQLite binds decimals as text
+            'min_price': Case(When(min_price__gt=price, then=Value(price, DecimalField())), default=F('min_price')),
+            'max_price': Case(When(max_price__lt=price, then=Value(price, DecimalField())), default=F('max_price')),
+        }
+        if rows.update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                MapCluster.objects.create(
+                    precision=precision, cell=cell, count=1,
+                    latitude_sum=latitude, longitude_sum=longitude,
+                    min_price=price, max_price=price,
+                )
+        except IntegrityError:
+            # Another writer created the cell first
+            rows.update(**changes)
+
+
+def _remove(geohash, latitude, longitude, price):
+    for precision in CLUSTER_PRECISIONS:
+        cell = geohash[:precision]
+        rows = MapCluster.objects.filter(precision=precision, cell=cell)
+        rows.update(
+            count=F('count') - 1,
+            latitude_sum=F('latitude_sum') - latitude,
+            longitude_sum=F('longitude_sum') - longitude,
+        )
+        cluster = rows.first()
+        if cluster is None:
+            continue
+        if cluster.count <= 0:
+            cluster.delete()
+        elif price in (cluster.min_price, cluster.max_price):
+            # Min/max can't be decremented; re-read the bounds of this cell
+            bounds = cell_properties(cell).aggregate(low=Min('price'), high=Max('price'))
+            rows.update(min_price=bounds['low'], max_price=bounds['high'])
+
+
+def cell_properties(cell):
+    return Property.objects.filter(status='available', geohash__gte=cell, geohash__lt=cell + geo.PREFIX_END)
+
+
+def apply_change(old, new):
+    """Move a property's contribution from ``old`` to ``new`` (either may be None)"""
+    if old == new:
+        return
+    with transaction.atomic():
+        if old is not None:
+            _remove(*old)
+        if new is not None:
+            _add(*new)
+
+
+def rebuild():
+    """Recompute every MapCluster row from the property table"""
+    rows = {}
+    located = Property.objects.filter(status='available', latitude__isnull=False, longitude__isnull=False)
+    for geohash, latitude, longitude, price in located.values_list('geohash', 'latitude', 'longitude', 'price').iterator():
+        for precision in CLUSTER_PRECISIONS:
+            key = (precision, geohash[:precision])
+            row = rows.get(key)
+            if row is None:
+                rows[key] = MapCluster(
+                    precision=precision, cell=key[1], count=1,
+                    latitude_sum=float(latitude), longitude_sum=float(longitude),
+                    min_price=price, max_price=price,
+                )
+                continue
+            row.count += 1
+            row.latitude_sum += float(latitude)
+            row.longitude_sum += float(longitude)
+            row.min_price = min(row.min_price, price)
+            row.max_price = max(row.max_price, price)
+    with transaction.atomic():
+        MapCluster.objects.all().delete()
+        MapCluster.objects.bulk_create(rows.values(), batch_size=1000)
+    return len(rows)
+
+
+def clusters_in_view(bbox, zoom):
+    """Cluster dicts for the cells at ``zoom``'s precision that overlap ``bbox``"""
+    precision = precision_for_zoom(zoom)
+    cells = Q()
+    for low, high in geo.cover_ranges(bbox, max_precision=precision):
+        cells |= Q(cell__gte=low, cell__lt=high)
+    clusters = []
+    for cluster in MapCluster.objects.filter(cells, precision=precision).order_by('cell'):
+        if not geo.intersects(geo.cell_bounds(cluster.cell), bbox):
+            continue
+        clusters.append({
+            'cell': cluster.cell,
+            'count': cluster.count,
+            'latitude': round(cluster.latitude_sum / cluster.count, 6),
+            'longitude': round(cluster.longitude_sum / cluster.count, 6),
+            'min_price': float(cluster.min_price),
+            'max_price': float(cluster.max_price),
+        })
+    return precision, clusters
@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.utils.functional import SimpleLazyObject
 from .models import Company
 
 
@@ -9,13 +10,18 @@ def google_maps_api_key(request):
     }
 
 
-def company_info(request):
-    """Make company information available in all templates"""
+def _get_company():
     try:
-        company = Company.get_instance()
-    except:
-        company = None
-    
+        return Company.get_cached()
+    except Exception:
+        return None
+
+
+def company_info(request):
+    """
+    Make company information available in all templates.
+    Lazy, so pages that never use {{ company }} don't touch the cache or DB.
+    """
     return {
-        'company': company
+        'company': SimpleLazyObject(_get_company)
     }
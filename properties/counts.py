@@ -0,0 +1,87 @@
+"""
+Cached result counts for property_list searches.
+
+Counts are cached per filter signature (the normalized filter parameters;
+sorting and the cursor don't change a count) under the version of the
+``property_counts`` tag, which signals bump only when a listing is added,
+removed, or changes a field some filter looks at. Editing a description
+that no search matches on leaves every cached count in place.
+
+Counting stops at PROPERTY_COUNT_LIMIT rows: a broader search reports
+"1,000+" instead of counting every match, so a count reads no more rows
+than a bounded page fetch.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import aget_tag_versions, get_tag_versions
+from .filters import FILTER_PARAMS, GEO_PARAMS
+from .search import SEARCH_FIELDS
+
+
+COUNT_KEY_PREFIX = 'property_count:'
+COUNT_TAG = 'property_counts'
+
+# Property fields the property_list filters read; other changes keep counts
+COUNT_FIELDS = tuple(dict.fromkeys(
+    ('status', 'listing_type', 'property_type', 'price', 'bedrooms', 'bathrooms', 'latitude', 'longitude')
+    + SEARCH_FIELDS
+))
+
+
+def count_limit():
+    return getattr(settings, 'PROPERTY_COUNT_LIMIT', 1000)
+
+
+def filter_signature(params):
+    """The filters in ``params`` in a canonical form, e.g. ``bedrooms=2&property_type=condo,house``"""
+    parts = []
+    for name in sorted(FILTER_PARAMS + GEO_PARAMS):
+        value = ' '.join(str(params.get(name) or '').split())
+        if name == 'property_type':
+            value = ','.join(sorted(set(filter(None, value.split(',')))))
+        if value:
+            parts.append(f'{name}={value}')
+    return '&'.join(parts)
+
+
+def count_key(params, version):
+    raw = f'{version}|{filter_signature(params)}'
+    return COUNT_KEY_PREFIX + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _bounded_count_queryset(queryset, limit):
+    # COUNT(*) over a LIMIT subquery, so at most limit + 1 rows are read
+    return queryset.order_by()[:limit + 1]
+
+
+def _result(count, limit):
+    return (limit, True) if count > limit else (count, False)
+
+
+def search_count(queryset, params):
+    """
+    ``(count, approximate)`` for the property_list search ``queryset``
+    built from ``params``. When there are more than PROPERTY_COUNT_LIMIT
+    matches the count is the limit and ``approximate`` is True.
+    """
+    limit = count_limit()
+    key = count_key(params, get_tag_versions([COUNT_TAG])[COUNT_TAG])
+    count = cache.get(key)
+    if count is None:
+        count = _bounded_count_queryset(queryset, limit).count()
+        cache.set(key, count, getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24))
+    return _result(count, limit)
+
+
+async def asearch_count(queryset, params):
+    """search_count() through the async cache and ORM"""
+    limit = count_limit()
+    key = count_key(params, (await aget_tag_versions([COUNT_TAG]))[COUNT_TAG])
+    count = await cache.aget(key)
+    if count is None:
+        count = await _bounded_count_queryset(queryset, limit).acount()
+        await cache.aset(key, count, getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24))
+    return _result(count, limit)
@@ -0,0 +1,51 @@
+"""
+Cached agent directory for agent_list and about.
+
+The annotated directory query (Agent.objects.directory()) is cached per
+search query under the version of the ``agent_list`` page-cache tag, which
+signals bump whenever an Agent, its User, or a listing's agent/status
+changes. A bump makes every cached directory unreachable at once.
+
+agent_list pages in the query: the match count and each page's rows are
+cached separately, so a page never loads or stores the whole directory.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+
+from .cache import get_tag_versions
+from .models import Agent
+
+
+DIRECTORY_KEY_PREFIX = 'agent_directory:'
+AGENT_PAGE_SIZE = 12
+
+
+def directory_key(query):
+    version = get_tag_versions(['agent_list'])['agent_list']
+    raw = f'{version}|{" ".join(query.lower().split())}'
+    return DIRECTORY_KEY_PREFIX + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def agent_directory(query=''):
+    """All agents matching ``query``, with user and listing counts, from the cache if possible"""
+    key = directory_key(query)
+    agents = cache.get(key)
+    if agents is None:
+        agents = list(Agent.objects.directory().search(query))
+        cache.set(key, agents, getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24))
+    return agents
+
+
+def agent_directory_page(query='', page=1):
+    """Page ``page`` of the agents matching ``query``, from the cache if possible"""
+    key = directory_key(query)
+    timeout = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24)
+    paginator = Paginator(Agent.objects.directory().search(query), AGENT_PAGE_SIZE)
+    # The count doesn't need the joins and annotations of the page query
+    paginator.count = cache.get_or_set(f'{key}:count', lambda: Agent.objects.search(query).count(), timeout)
+    page_obj = paginator.get_page(page)
+    page_obj.object_list = cache.get_or_set(f'{key}:page:{page_obj.number}', lambda: list(page_obj.object_list), timeout)
+    return page_obj
@@ -0,0 +1,296 @@
+"""
+Facet counts for the property_list sidebar.
+
+For the current search each facet (listing type, property type, bedrooms,
+bathrooms, price band) is counted with every filter applied except its own,
+so an option's count is the number of results picking it would give.
+
+Searches that only use facet filters are answered from FacetCount: one row
+per combination of facet values, adjusted by signals as listings change
+(like MapCluster), so the answer never depends on the inventory size. Text,
+location, map and price filters need the listings themselves; those counts
+come from a single query with one conditional COUNT per option. Either way
+the result is cached per filter signature under the ``property_counts``
+tag, like the result counts in properties.counts.
+"""
+import hashlib
+from bisect import bisect_right
+from collections import Counter, namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+
+from .cache import get_tag_versions
+from .counts import COUNT_TAG, filter_signature
+from .filters import GEO_PARAMS, TEXT_SEARCH_PARAMS, filter_properties, parse_geo_search
+from .models import FacetCount, Property
+
+
+FACET_KEY_PREFIX = 'property_facets:'
+
+FACETS = ('listing_type', 'property_type', 'bedrooms', 'bathrooms', 'price')
+
+# Property fields whose change moves a listing between FacetCount rows
+FACET_FIELDS = ('status', 'listing_type', 'property_type', 'bedrooms', 'bathrooms', 'price')
+
+# FacetCount columns, in the order contribution() returns them
+CELL_FIELDS = ('listing_type', 'property_type', 'bedrooms', 'bathrooms', 'price_band')
+
+# "N+" options for bedrooms and bathrooms. FacetCount caps both at the last
+# option, which still answers every one of them.
+BEDROOM_OPTIONS = (1, 2, 3, 4, 5)
+BATHROOM_OPTIONS = (1, 2, 3, 4)
+
+# Lower bounds (NT$) of the price bands per listing type; the last is open-ended
+PRICE_BANDS = {
+    'sale': (0, 5_000_000, 10_000_000, 20_000_000, 30_000_000, 50_000_000),
+    'rent': (0, 10_000, 20_000, 30_000, 50_000, 100_000),
+}
+
+# Smallest price increment. A band ends just below the next band's lower
+# bound, so the inclusive max_price the sidebar sends selects exactly the
+# listings the band counts.
+PRICE_STEP = Decimal(1).scaleb(-Property._meta.get_field('price').decimal_places)
+
+Selection = namedtuple('Selection', 'listing_type property_types bedrooms bathrooms min_price max_price')
+
+
+def price_band(listing_type, price):
+    bounds = PRICE_BANDS.get(listing_type, PRICE_BANDS['sale'])
+    return max(bisect_right(bounds, price) - 1, 0)
+
+
+def contribution(values):
+    """The FacetCount cell a listing counts towards, or None if it isn't listed"""
+    if values.get('status') != 'available':
+        return None
+    # Unsaved attributes may still be raw input, e.g. price='10000000'
+    values = {name: Property._meta.get_field(name).to_python(values[name]) for name in FACET_FIELDS}
+    return (
+        values['listing_type'],
+        values['property_type'],
+        min(values['bedrooms'] or 0, BEDROOM_OPTIONS[-1]),
+        min(values['bathrooms'] or 0, BATHROOM_OPTIONS[-1]),
+        price_band(values['listing_type'], values['price']),
+    )
+
+
+def _cell(values):
+    return dict(zip(CELL_FIELDS, values))
+
+
+def apply_change(old, new):
+    """Move a listing from FacetCount cell ``old`` to ``new`` (either may be None)"""
+    if old == new:
+        return
+    with transaction.atomic():
+        if old is not None:
+            rows = FacetCount.objects.filter(**_cell(old))
+            rows.update(count=F('count') - 1)
+            rows.filter(count__lte=0).delete()
+        if new is not None:
+            rows = FacetCount.objects.filter(**_cell(new))
+            if rows.update(count=F('count') + 1):
+                return
+            try:
+                with transaction.atomic():
+                    FacetCount.objects.create(count=1, **_cell(new))
+            except IntegrityError:
+                # Another writer created the cell first
+                rows.update(count=F('count') + 1)
+
+
+def rebuild():
+    """Recompute every FacetCount row from the property table"""
+    cells = Counter(
+        contribution(values)
+        for values in Property.objects.filter(status='available').values(*FACET_FIELDS).iterator()
+    )
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(
+            [FacetCount(count=count, **_cell(cell)) for cell, count in cells.items()],
+            batch_size=1000,
+        )
+    return len(cells)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _decimal(value):
+    try:
+        value = Decimal(value)
+    except (TypeError, InvalidOperation):
+        return None
+    return value if value.is_finite() else None
+
+
+def selection(params):
+    """The facet filters set in ``params``, parsed; unset or malformed ones are None"""
+    property_types = frozenset(filter(None, (params.get('property_type') or '').split(',')))
+    return Selection(
+        params.get('listing_type') or None,
+        property_types or None,
+        _int(params.get('bedrooms')),
+        _int(params.get('bathrooms')),
+        _decimal(params.get('min_price')),
+        _decimal(params.get('max_price')),
+    )
+
+
+def options():
+    """(facet, value, label) for every sidebar option, in display order"""
+    result = [('listing_type', value, label) for value, label in Property.LISTING_TYPE_CHOICES]
+    result += [('property_type', value, label) for value, label in Property.TYPE_CHOICES]
+    result += [('bedrooms', n, f'{n}+') for n in BEDROOM_OPTIONS]
+    result += [('bathrooms', n, f'{n}+') for n in BATHROOM_OPTIONS]
+    for listing_type, bounds in PRICE_BANDS.items():
+        result += [('price', (listing_type, band), None) for band in range(len(bounds))]
+    return result
+
+
+def _band_bounds(listing_type, band):
+    # [low, high): the band's prices are low <= price < high
+    bounds = PRICE_BANDS[listing_type]
+    return bounds[band], bounds[band + 1] if band + 1 < len(bounds) else None
+
+
+def _band_max_price(high):
+    # The inclusive max_price filter equivalent to price < high
+    return high - PRICE_STEP if high is not None else None
+
+
+def _answered_by_cells(params, selection):
+    """Whether FacetCount alone can answer ``params``"""
+    if any(params.get(name) for name in TEXT_SEARCH_PARAMS) or parse_geo_search(params) is not None:
+        return False
+    if params.get('min_price') or params.get('max_price'):
+        return False
+    if params.get('bedrooms') and not (selection.bedrooms is not None and 0 <= selection.bedrooms <= BEDROOM_OPTIONS[-1]):
+        return False
+    if params.get('bathrooms') and not (selection.bathrooms is not None and 0 <= selection.bathrooms <= BATHROOM_OPTIONS[-1]):
+        return False
+    return True
+
+
+def _cell_selected(cell, selection, skip):
+    listing_type, property_type, bedrooms, bathrooms, _ = cell
+    return (
+        (skip == 'listing_type' or selection.listing_type is None or listing_type == selection.listing_type)
+        and (skip == 'property_type' or selection.property_types is None or property_type in selection.property_types)
+        and (skip == 'bedrooms' or selection.bedrooms is None or bedrooms >= selection.bedrooms)
+        and (skip == 'bathrooms' or selection.bathrooms is None or bathrooms >= selection.bathrooms)
+    )
+
+
+def _cell_has(cell, facet, value):
+    listing_type, property_type, bedrooms, bathrooms, band = cell
+    if facet == 'price':
+        return (listing_type, band) == value
+    if facet in ('bedrooms', 'bathrooms'):
+        return (bedrooms if facet == 'bedrooms' else bathrooms) >= value
+    return (listing_type if facet == 'listing_type' else property_type) == value
+
+
+def _cell_counts(selection, option_list):
+    cells = [(row[:-1], row[-1]) for row in FacetCount.objects.values_list(*CELL_FIELDS, 'count')]
+    return [
+        sum(count for cell, count in cells if _cell_selected(cell, selection, facet) and _cell_has(cell, facet, value))
+        for facet, value, _ in option_list
+    ]
+
+
+def _selection_q(selection, skip):
+    q = Q()
+    if skip != 'listing_type' and selection.listing_type:
+        q &= Q(listing_type=selection.listing_type)
+    if skip != 'property_type' and selection.property_types:
+        q &= Q(property_type__in=selection.property_types)
+    if skip != 'bedrooms' and selection.bedrooms is not None:
+        q &= Q(bedrooms__gte=selection.bedrooms)
+    if skip != 'bathrooms' and selection.bathrooms is not None:
+        q &= Q(bathrooms__gte=selection.bathrooms)
+    if skip != 'price' and selection.min_price is not None:
+        q &= Q(price__gte=selection.min_price)
+    if skip != 'price' and selection.max_price is not None:
+        q &= Q(price__lte=selection.max_price)
+    return q
+
+
+def _option_q(facet, value):
+    if facet == 'price':
+        low, high = _band_bounds(*value)
+        q = Q(listing_type=value[0], price__gte=low)
+        return q & Q(price__lt=high) if high is not None else q
+    if facet in ('bedrooms', 'bathrooms'):
+        return Q(**{f'{facet}__gte': value})
+    return Q(**{facet: value})
+
+
+def _query_counts(params, selection, option_list):
+    # Text, location and map filters narrow the rows; the facet filters
+    # become conditions on each option's COUNT
+    listings = filter_properties(
+        Property.objects.filter(status='available'),
+        {name: params.get(name) for name in TEXT_SEARCH_PARAMS + GEO_PARAMS},
+    )
+    result = listings.aggregate(**{
+        f'option_{index}': Count('pk', filter=_selection_q(selection, facet) & _option_q(facet, value))
+        for index, (facet, value, _) in enumerate(option_list)
+    })
+    return [result[f'option_{index}'] for index in range(len(option_list))]
+
+
+def _is_selected(selection, facet, value):
+    if facet == 'listing_type':
+        return selection.listing_type == value
+    if facet == 'property_type':
+        return value in (selection.property_types or ())
+    if facet == 'price':
+        low, high = _band_bounds(*value)
+        # The sidebar leaves a zero minimum out of the query string
+        return (selection.min_price or 0, selection.max_price) == (low, _band_max_price(high))
+    return getattr(selection, facet) == value
+
+
+def facet_counts(params):
+    """
+    ``{facet: [option, ...]}`` for the property_list search ``params``.
+    Options carry ``count`` and ``selected``, plus ``value`` and ``label``,
+    or for price bands ``listing_type``, ``min`` and ``max`` (the next band's
+    lower bound) and ``max_price``, the max_price filter that selects them.
+    """
+    version = get_tag_versions([COUNT_TAG])[COUNT_TAG]
+    key = FACET_KEY_PREFIX + hashlib.sha256(f'{version}|{filter_signature(params)}'.encode()).hexdigest()
+    facets = cache.get(key)
+    if facets is not None:
+        return facets
+
+    current = selection(params)
+    option_list = options()
+    if _answered_by_cells(params, current):
+        counts = _cell_counts(current, option_list)
+    else:
+        counts = _query_counts(params, current, option_list)
+
+    facets = {facet: [] for facet in FACETS}
+    for (facet, value, label), count in zip(option_list, counts):
+        entry = {'count': count, 'selected': _is_selected(current, facet, value)}
+        if facet == 'price':
+            entry['listing_type'] = value[0]
+            entry['min'], entry['max'] = _band_bounds(*value)
+            max_price = _band_max_price(entry['max'])
+            entry['max_price'] = str(max_price) if max_price is not None else None
+        else:
+            entry['value'], entry['label'] = value, label
+        facets[facet].append(entry)
+    cache.set(key, facets, getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24))
+    return facets
@@ -0,0 +1,142 @@
+"""
+Search filters shared by property_list and the management commands that
+replay its query strings.
+"""
+import math
+from collections import namedtuple
+
+from django.db.models import FloatField, Q
+from django.db.models.functions import Cast, Sqrt
+
+from . import geo, search
+
+
+# Query string parameters that narrow the property_list result set
+FILTER_PARAMS = ('q', 'listing_type', 'property_type', 'location', 'min_price', 'max_price', 'bedrooms', 'bathrooms')
+
+# Filters answered by the full-text index (properties.search) rather than B-tree indexes
+TEXT_SEARCH_PARAMS = ('q', 'location')
+
+# Map search: a center point with a radius, and/or a 'south,west,north,east' box
+GEO_PARAMS = ('lat', 'lng', 'radius_km', 'bbox')
+DEFAULT_RADIUS_KM = 5
+
+GeoSearch = namedtuple('GeoSearch', 'bbox center radius_km')
+
+
+def parse_geo_search(params):
+    """The map search described by ``params``, or None. Malformed values are ignored."""
+    bbox = geo.parse_bbox(params.get('bbox'))
+    center = radius_km = None
+    try:
+        lat, lng = float(params.get('lat')), float(params.get('lng'))
+    except (TypeError, ValueError):
+        pass
+    else:
+        if -90 <= lat <= 90 and -180 <= lng <= 180:
+            center = (lat, lng)
+            try:
+                radius_km = float(params.get('radius_km') or DEFAULT_RADIUS_KM)
+            except ValueError:
+                radius_km = DEFAULT_RADIUS_KM
+            radius_km = min(max(radius_km, 0.1), geo.MAX_RADIUS_KM)
+            circle = geo.radius_bbox(lat, lng, radius_km)
+            if bbox is None:
+                bbox = circle
+            else:
+                bbox = geo.BoundingBox(
+                    max(bbox.south, circle.south), max(bbox.west, circle.west),
+                    min(bbox.north, circle.north), min(bbox.east, circle.east),
+                )
+    if bbox is None:
+        return None
+    if center is None:
+        center = ((bbox.south + bbox.north) / 2, (bbox.west + bbox.east) / 2)
+    return GeoSearch(bbox, center, radius_km)
+
+
+def filter_geo(queryset, search):
+    """
+    Restrict ``queryset`` to ``search`` and annotate ``distance_km`` from its
+    center. The geohash ranges do the index work; the exact bounds and the
+    (equirectangular) distance are only evaluated on rows inside those cells.
+    """
+    bbox = search.bbox
+    if bbox.south > bbox.north or bbox.west > bbox.east:
+        return queryset.none()
+    cells = Q()
+    for low, high in geo.cover_ranges(bbox):
+        cells |= Q(geohash__gte=low, geohash__lt=high)
+    queryset = queryset.filter(
+        cells,
+        latitude__gte=bbox.south, latitude__lte=bbox.north,
+        longitude__gte=bbox.west, longitude__lte=bbox.east,
+    )
+    
+    lat, lng = search.center
+    dy = Cast('latitude', FloatField()) - lat
+    dx = (Cast('longitude', FloatField()) - lng) * math.cos(math.radians(lat))
+    queryset = queryset.annotate(distance_km=Sqrt(dy * dy + dx * dx) * geo.KM_PER_DEGREE)
+    if search.radius_km is not None:
+        queryset = queryset.filter(distance_km__lte=search.radius_km)
+    return queryset
+
+
+def filter_location(queryset, location):
+    """
+    Listings whose city, address or postal code matches ``location``.
+
+    The full-text index matches whole words and word prefixes: 'hual' finds
+    Hualien, but 'lien' no longer does. That is a deliberate change from the
+    old icontains scan. The index can't see a lone Chinese character at the
+    end of a run (路 in 中山路), so such queries still match substrings. The
+    choice depends on the query alone, and no query is run to make it.
+    """
+    terms = search.query_terms(location)
+    if terms and not any(len(token) == 1 and search.CJK_RE.match(token) for token, _ in terms):
+        return search.search(queryset, location, location_only=True)
+    substring = Q()
+    for name in search.DOCUMENT_FIELDS['location_tokens']:
+        substring |= Q(**{f'{name}__icontains': location})
+    return queryset.filter(substring)
+
+
+def filter_properties(queryset, params):
+    """
+    Apply the property_list filters found in ``params`` (a QueryDict or dict).
+    A ``q`` search also annotates ``search_rank`` for relevance ordering.
+    """
+    q = params.get('q')
+    listing_type = params.get('listing_type')
+    property_type = params.get('property_type')
+    location = params.get('location')
+    min_price = params.get('min_price')
+    max_price = params.get('max_price')
+    bedrooms = params.get('bedrooms')
+    bathrooms = params.get('bathrooms')
+    geo_search = parse_geo_search(params)
+    
+    if q:
+        queryset = search.search(queryset, q, rank=True)
+    if listing_type:
+        queryset = queryset.filter(listing_type=listing_type)
+    
+    # Handle multiple property types
+    if property_type:
+        property_types = property_type.split(',')
+        queryset = queryset.filter(property_type__in=property_types)
+    
+    if location:
+        queryset = filter_location(queryset, location)
+    if min_price:
+        queryset = queryset.filter(price__gte=min_price)
+    if max_price:
+        queryset = queryset.filter(price__lte=max_price)
+    if bedrooms:
+        queryset = queryset.filter(bedrooms__gte=bedrooms)
+    if bathrooms:
+        queryset = queryset.filter(bathrooms__gte=bathrooms)
+    if geo_search:
+        queryset = filter_geo(queryset, geo_search)
+    
+    return queryset
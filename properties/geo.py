@@ -0,0 +1,150 @@
+"""
+Geohash helpers for radius and bounding-box search without PostGIS.
+
+Every Property with coordinates stores its 12-character geohash in an
+indexed column. A geohash prefix is a rectangular cell, and all points in a
+cell share that prefix, so a map area can be covered by a handful of cells
+and each cell becomes an index range scan (``prefix <= geohash < prefix+'{'``)
+on SQLite and PostgreSQL alike; the column compares in byte order (see
+models.GeohashField) so those ranges hold exactly the prefix. Exact bounds
+and distances are then only computed for the rows inside those cells.
+"""
+import math
+from collections import namedtuple
+
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_LENGTH = 12
+# Sorts after every BASE32 character, closing a prefix range
+PREFIX_END = '{'
+
+KM_PER_DEGREE = 111.195
+MAX_RADIUS_KM = 100
+# Upper bound on cells (index ranges) used to cover one search area
+MAX_COVER_CELLS = 16
+
+BoundingBox = namedtuple('BoundingBox', 'south west north east')
+
+
+def _bits(precision):
+    """(longitude bits, latitude bits) in a geohash of ``precision`` characters"""
+    total = 5 * precision
+    return (total + 1) // 2, total // 2
+
+
+def cell_size(precision):
+    """(height, width) in degrees of a cell at ``precision``"""
+    lon_bits, lat_bits = _bits(precision)
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def _cell_index(lat, lon, precision):
+    lon_bits, lat_bits = _bits(precision)
+    row = min(int((lat + 90.0) / 180.0 * 2 ** lat_bits), 2 ** lat_bits - 1)
+    col = min(int((lon + 180.0) / 360.0 * 2 ** lon_bits), 2 ** lon_bits - 1)
+    return row, col
+
+
+def _cell_hash(row, col, precision):
+    """Interleave the column (longitude) and row (latitude) bits, longitude first"""
+    lon_bits, lat_bits = _bits(precision)
+    value = 0
+    for i in range(5 * precision):
+        if i % 2 == 0:
+            lon_bits -= 1
+            bit = (col >> lon_bits) & 1
+        else:
+            lat_bits -= 1
+            bit = (row >> lat_bits) & 1
+        value = (value << 1) | bit
+    return value
+
+
+def _to_string(value, precision):
+    chars = []
+    for _ in range(precision):
+        chars.append(BASE32[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def encode(lat, lon, precision=GEOHASH_LENGTH):
+    lat, lon = float(lat), float(lon)
+    return _to_string(_cell_hash(*_cell_index(lat, lon, precision), precision), precision)
+
+
+def parse_bbox(value):
+    """'south,west,north,east' -> BoundingBox, or None if malformed"""
+    try:
+        south, west, north, east = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+        return None
+    return BoundingBox(south, west, north, east)
+
+
+def radius_bbox(lat, lon, radius_km):
+    """Smallest BoundingBox containing the circle, clamped to valid coordinates"""
+    dlat = radius_km / KM_PER_DEGREE
+    dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+    return BoundingBox(max(lat - dlat, -90.0), max(lon - dlon, -180.0), min(lat + dlat, 90.0), min(lon + dlon, 180.0))
+
+
+def cell_bounds(geohash):
+    """BoundingBox of the cell named by ``geohash``"""
+    value = 0
+    for char in geohash:
+        value = (value << 5) | BASE32.index(char)
+    precision = len(geohash)
+    lon_bits, lat_bits = _bits(precision)
+    row = col = 0
+    for i in range(5 * precision):
+        bit = (value >> (5 * precision - 1 - i)) & 1
+        if i % 2 == 0:
+            col = (col << 1) | bit
+        else:
+            row = (row << 1) | bit
+    height, width = cell_size(precision)
+    south, west = row * height - 90.0, col * width - 180.0
+    return BoundingBox(south, west, south + height, west + width)
+
+
+def intersects(a, b):
+    return a.south <= b.north and b.south <= a.north and a.west <= b.east and b.west <= a.east
+
+
+def cover_ranges(bbox, max_cells=MAX_COVER_CELLS, max_precision=GEOHASH_LENGTH):
+    """
+    Geohash ranges ``[(low, high), ...]`` that together contain ``bbox``,
+    using the finest precision (up to ``max_precision``) that needs at most
+    ``max_cells`` cells. Cells adjacent in geohash order are merged.
+    """
+    cells, precision = None, 1
+    for candidate in range(1, max_precision + 1):
+        row0, col0 = _cell_index(bbox.south, bbox.west, candidate)
+        row1, col1 = _cell_index(bbox.north, bbox.east, candidate)
+        if (row1 - row0 + 1) * (col1 - col0 + 1) > max_cells:
+            break
+        cells = [(row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+        precision = candidate
+    if cells is None:
+        # Larger than a precision-1 grid allows: cover everything
+        return [('', PREFIX_END)]
+
+    values = sorted(_cell_hash(row, col, precision) for row, col in cells)
+    ranges, start, end = [], values[0], values[0]
+    for value in values[1:]:
+        if value == end + 1:
+            end = value
+            continue
+        ranges.append((start, end))
+        start = end = value
+    ranges.append((start, end))
+    return [(_to_string(low, precision), _to_string(high, precision) + PREFIX_END) for low, high in ranges]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(math.sqrt(a))
@@ -0,0 +1,146 @@
+"""
+Responsive image variants.
+
+Uploaded photos are resized with Pillow into fixed-width WebP and JPEG
+variants saved next to the original through the field's storage, so the
+same code works with FileSystemStorage and the S3 MediaStorage. The names
+and sizes of the generated files are recorded in a ``<field>_variants``
+JSONField on the model, which the ``responsive_image`` template tag reads
+to build ``srcset`` attributes without touching storage.
+"""
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.dispatch import Signal
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from core.storage_backends import save_many
+
+
+logger = logging.getLogger(__name__)
+
+# Sent with ``instance`` and ``field_name`` after refresh_variants() stored
+# new variants. They are written with update(), which sends no post_save.
+variants_refreshed = Signal()
+
+# Variant name -> longest edge in pixels, smallest first
+VARIANT_SIZES = {
+    'thumb': 160,
+    'card': 640,
+    'gallery': 1280,
+    'full': 2048,
+}
+
+# (key stored in the variants JSON, Pillow format, file extension, save options)
+VARIANT_FORMATS = (
+    ('webp', 'WEBP', 'webp', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+
+def variant_name(name, variant, extension):
+    """'properties/photo.jpg' -> 'properties/variants/photo_card.webp'"""
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'variants', f'{stem}_{variant}.{extension}')
+
+
+def _flatten(image):
+    """RGB copy of ``image``, compositing any transparency onto white for JPEG"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def is_image(fieldfile):
+    """Whether the stored file is an image Pillow can read"""
+    try:
+        with fieldfile.open('rb') as handle:
+            Image.open(handle).verify()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return False
+    return True
+
+
+def generate_variants(fieldfile):
+    """
+    Render every variant of ``fieldfile`` and save it through the field's
+    storage. Returns the JSON-serializable description stored on the model.
+    """
+    storage = fieldfile.storage
+    with fieldfile.open('rb') as handle:
+        image = Image.open(handle)
+        image = ImageOps.exif_transpose(image)
+        image = _flatten(image)
+
+    data = {'source': fieldfile.name, 'variants': {}}
+    files, slots = [], []
+    previous_size = None
+    for variant, edge in VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        # Small originals would otherwise produce identical larger variants
+        if resized.size == previous_size:
+            continue
+        previous_size = resized.size
+
+        entry = data['variants'][variant] = {'width': resized.width, 'height': resized.height}
+        for key, pil_format, extension, options in VARIANT_FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            files.append((variant_name(fieldfile.name, variant, extension), ContentFile(buffer.getvalue())))
+            slots.append((entry, key))
+    # Rendered first, then uploaded together (concurrently on S3)
+    for (entry, key), name in zip(slots, save_many(storage, files)):
+        entry[key] = name
+    return data
+
+
+def delete_variants(storage, data):
+    for entry in (data or {}).get('variants', {}).values():
+        for key, *_ in VARIANT_FORMATS:
+            if entry.get(key):
+                storage.delete(entry[key])
+
+
+def refresh_variants(instance, field_name):
+    """
+    Make ``<field_name>_variants`` on ``instance`` match its current file,
+    generating or deleting variant files as needed. Safe to call repeatedly.
+    """
+    fieldfile = getattr(instance, field_name)
+    store_field = f'{field_name}_variants'
+    current = getattr(instance, store_field) or {}
+    if fieldfile and current.get('source') == fieldfile.name:
+        return current
+    if not fieldfile and not current:
+        return current
+
+    delete_variants(fieldfile.storage, current)
+    data = {}
+    if fieldfile:
+        try:
+            data = generate_variants(fieldfile)
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+            logger.warning('Could not generate variants for %s', fieldfile.name, exc_info=True)
+
+    setattr(instance, store_field, data)
+    type(instance).objects.filter(pk=instance.pk).update(**{store_field: data})
+    variants_refreshed.send(sender=type(instance), instance=instance, field_name=field_name)
+    return data
+
+
+def pick_variant(data, variant):
+    """The requested variant, or the largest one available if it was skipped"""
+    variants = (data or {}).get('variants', {})
+    if variant in variants:
+        return variants[variant]
+    if variants:
+        # jsonb does not keep key order, so compare widths
+        return max(variants.values(), key=lambda entry: entry['width'])
+    return None
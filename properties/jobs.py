@@ -0,0 +1,94 @@
+"""
+A small database-backed job queue.
+
+enqueue() inserts a Job row in the caller's transaction, so work is only
+visible to workers once the data it refers to has been committed. Workers
+(`manage.py run_jobs`) claim jobs with a conditional UPDATE, which works on
+SQLite and PostgreSQL alike. A claimed job is hidden from other workers
+until its visibility timeout passes; if the worker dies it is re-delivered.
+Failures are retried with exponential backoff up to ``max_attempts``.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task, max_attempts=5, delay=0, **payload):
+    """
+    Queue ``task`` (a dotted path) to run with ``payload`` as keyword arguments.
+    With JOBS_EAGER the task runs immediately instead, e.g. in development.
+    """
+    if getattr(settings, 'JOBS_EAGER', True):
+        import_string(task)(**payload)
+        return None
+    return Job.objects.create(
+        task=task,
+        payload=payload,
+        max_attempts=max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def _claimable(now):
+    return Q(status='queued', run_after__lte=now) | Q(status='running', locked_until__lt=now)
+
+
+def claim_job(worker_id, visibility_timeout=None):
+    """Atomically take the next due job, or return None if there is none"""
+    if visibility_timeout is None:
+        visibility_timeout = getattr(settings, 'JOBS_VISIBILITY_TIMEOUT', 300)
+    now = timezone.now()
+    candidates = Job.objects.filter(_claimable(now)).order_by('run_after').values_list('pk', flat=True)[:10]
+    for pk in candidates:
+        # Only one worker's UPDATE can match while the job is still claimable
+        claimed = Job.objects.filter(_claimable(now), pk=pk).update(
+            status='running',
+            locked_by=worker_id,
+            locked_until=now + timedelta(seconds=visibility_timeout),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def retry_delay(attempts):
+    """Exponential backoff: 10s, 20s, 40s, ... capped at an hour"""
+    return min(10 * 2 ** (attempts - 1), 3600)
+
+
+def run_job(job, worker_id):
+    """Run a claimed job and record the outcome. Returns True on success."""
+    mine = Job.objects.filter(pk=job.pk, locked_by=worker_id)
+    if job.attempts > job.max_attempts:
+        # Re-delivered after its last attempt timed out
+        mine.update(status='failed', locked_until=None, last_error='Visibility timeout exceeded on final attempt')
+        return False
+    try:
+        import_string(job.task)(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s (%s) failed on attempt %s', job.pk, job.task, job.attempts, exc_info=True)
+        if job.attempts >= job.max_attempts:
+            mine.update(status='failed', locked_until=None, last_error=error)
+        else:
+            mine.update(
+                status='queued',
+                locked_until=None,
+                run_after=timezone.now() + timedelta(seconds=retry_delay(job.attempts)),
+                last_error=error,
+            )
+        return False
+    # Finished jobs have nothing left worth keeping
+    mine.delete()
+    return True
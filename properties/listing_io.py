@@ -0,0 +1,285 @@
+"""
+Streaming bulk import and export of property listings as CSV or JSON Lines.
+
+Rows are read, validated and written one batch at a time, so memory use
+depends on the batch size rather than the file size. Imports upsert: a row
+whose ``reference`` (or ``id``) matches an existing listing updates it, any
+other row creates a new one. Agents are given by username.
+
+bulk_create/bulk_update skip save() and the Property signals, so the
+importer maintains the derived data itself: geohashes and search documents
+per batch, agent stats, map clusters and the location index once at the end.
+"""
+import csv
+import json
+import sys
+from contextlib import contextmanager
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from . import clusters, facets
+from .autocomplete import location_index
+from .cache import invalidate_tags
+from .counts import COUNT_TAG
+from .models import Agent, AgentStats, Property, SearchDocument
+from .search import build_document
+
+
+FORMATS = ('csv', 'jsonl')
+
+# Columns read on import, in export order; 'agent' holds a username
+IMPORT_FIELDS = (
+    'reference', 'title', 'description', 'price', 'listing_type', 'property_type', 'status',
+    'address', 'city', 'postal_code', 'latitude', 'longitude',
+    'bedrooms', 'bathrooms', 'area_sqm', 'year_built', 'parking_spaces', 'featured', 'agent',
+)
+EXPORT_FIELDS = ('id',) + IMPORT_FIELDS
+
+# Written by bulk_update besides the imported columns
+DERIVED_FIELDS = ('geohash', 'updated_at')
+
+TRUE_VALUES = {'1', 'true', 'yes', 't', 'y'}
+FALSE_VALUES = {'0', 'false', 'no', 'f', 'n'}
+
+
+def guess_format(path):
+    return 'jsonl' if str(path).endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+@contextmanager
+def open_stream(path, mode):
+    """Open ``path`` for text I/O; '-' is stdin or stdout"""
+    if path == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+        return
+    with open(path, mode, newline='', encoding='utf-8') as stream:
+        yield stream
+
+
+def read_rows(stream, format):
+    """Yield (line number, row dict) from a CSV or JSON Lines stream"""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            row = ValidationError(f'Invalid JSON: {error}')
+        if not isinstance(row, (dict, ValidationError)):
+            row = ValidationError('Each line must be a JSON object')
+        yield line_number, row
+
+
+class RowWriter:
+    """Write row dicts as CSV (with a header) or JSON Lines"""
+
+    def __init__(self, stream, format, fields=EXPORT_FIELDS):
+        self.stream = stream
+        self.format = format
+        if format == 'csv':
+            self.writer = csv.DictWriter(stream, fieldnames=fields)
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.format == 'csv':
+            self.writer.writerow(row)
+        else:
+            self.stream.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+
+
+def export_rows(queryset, chunk_size=2000):
+    """Yield one export dict per property, streamed from the database"""
+    columns = [name for name in EXPORT_FIELDS if name != 'agent'] + ['agent__user__username']
+    rows = queryset.order_by('pk').values_list(*columns)
+    for values in rows.iterator(chunk_size=chunk_size):
+        row = dict(zip(EXPORT_FIELDS, values[:-1]))
+        row['agent'] = values[-1] or ''
+        # Keep EXPORT_FIELDS order for JSON Lines too
+        yield {name: row[name] for name in EXPORT_FIELDS}
+
+
+def _clean_value(field, value):
+    if isinstance(value, str):
+        value = value.strip()
+    if value is None or value == '':
+        if field.null:
+            value = None
+        elif field.has_default():
+            value = field.get_default()
+        else:
+            value = '' if field.empty_strings_allowed else None
+    elif field.get_internal_type() == 'BooleanField' and isinstance(value, str):
+        lowered = value.lower()
+        if lowered in TRUE_VALUES:
+            value = True
+        elif lowered in FALSE_VALUES:
+            value = False
+    return field.clean(value, None)
+
+
+def clean_row(row):
+    """
+    Model-ready values for one imported row, validated against the Property
+    field definitions. Unknown columns are ignored and missing ones take the
+    field default. Raises ValidationError with per-column messages.
+    """
+    values, errors = {}, {}
+    for name in IMPORT_FIELDS:
+        if name == 'agent':
+            values['agent'] = (row.get('agent') or '').strip()
+            continue
+        field = Property._meta.get_field(name)
+        try:
+            values[name] = _clean_value(field, row.get(name))
+        except ValidationError as error:
+            errors[name] = error.messages
+    raw_id = row.get('id')
+    if raw_id not in (None, ''):
+        try:
+            values['id'] = int(raw_id)
+        except (TypeError, ValueError):
+            errors['id'] = ['Enter a whole number.']
+    if errors:
+        raise ValidationError(errors)
+    return values
+
+
+class ListingImporter:
+    """
+    Upsert cleaned rows in batches. Call ``add()`` per row and ``finish()``
+    at the end; each full batch is written in its own transaction.
+    """
+
+    def __init__(self, batch_size=1000, max_errors=100):
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.batch = []
+        self.agents = {}
+        self.touched_agents = set()
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    @property
+    def processed(self):
+        return self.created + self.updated
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, message))
+
+    def add(self, line, row):
+        if isinstance(row, ValidationError):
+            self.error(line, '; '.join(row.messages))
+            return
+        try:
+            values = clean_row(row)
+        except ValidationError as error:
+            messages = [f'{name}: {" ".join(text)}' for name, text in error.message_dict.items()]
+            self.error(line, '; '.join(messages))
+            return
+        self.batch.append((line, values))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def _resolve_agents(self, rows):
+        missing = {values['agent'] for line, values in rows if values['agent'] and values['agent'] not in self.agents}
+        if missing:
+            self.agents.update(Agent.objects.filter(user__username__in=missing).values_list('user__username', 'pk'))
+        resolved = []
+        for line, values in rows:
+            username = values.pop('agent')
+            if username and username not in self.agents:
+                self.error(line, f'agent: No agent with username "{username}".')
+                continue
+            values['agent_id'] = self.agents.get(username)
+            resolved.append((line, values))
+        return resolved
+
+    def _existing(self, rows):
+        """{('reference', value) or ('id', value): (pk, agent_id)} for rows already stored"""
+        references = [values['reference'] for line, values in rows if values['reference']]
+        ids = [values['id'] for line, values in rows if not values['reference'] and 'id' in values]
+        existing = {}
+        if references:
+            for reference, pk, agent_id in Property.objects.filter(reference__in=references).values_list('reference', 'pk', 'agent_id'):
+                existing[('reference', reference)] = (pk, agent_id)
+        if ids:
+            for pk, agent_id in Property.objects.filter(pk__in=ids).values_list('pk', 'agent_id'):
+                existing[('id', pk)] = (pk, agent_id)
+        return existing
+
+    def flush(self):
+        rows, self.batch = self.batch, []
+        if not rows:
+            return
+        rows = self._resolve_agents(rows)
+        # A key repeated within the batch: the last row wins
+        keyed = {}
+        for line, values in rows:
+            if values['reference']:
+                key = ('reference', values['reference'])
+            elif 'id' in values:
+                key = ('id', values['id'])
+            else:
+                key = ('line', line)
+            keyed[key] = (line, values)
+
+        now = timezone.now()
+        with transaction.atomic():
+            existing = self._existing(list(keyed.values()))
+            to_create, to_update = [], []
+            for key, (line, values) in keyed.items():
+                values.pop('id', None)
+                match = existing.get(key)
+                if match is None and key[0] == 'id':
+                    self.error(line, f'id: No property with id {key[1]}.')
+                    continue
+                property = Property(**values)
+                property.geohash = property.compute_geohash()
+                if match is None:
+                    to_create.append(property)
+                else:
+                    property.pk, old_agent_id = match
+                    property.updated_at = now
+                    to_update.append(property)
+                    self.touched_agents.add(old_agent_id)
+                self.touched_agents.add(property.agent_id)
+
+            Property.objects.bulk_create(to_create)
+            Property.objects.bulk_update(to_update, fields=IMPORT_FIELDS + DERIVED_FIELDS)
+            saved = to_create + to_update
+            SearchDocument.objects.bulk_create(
+                [SearchDocument(property_id=property.pk, **build_document(property)) for property in saved],
+                update_conflicts=True, unique_fields=['property'],
+                update_fields=['title_tokens', 'location_tokens', 'body_tokens'],
+            )
+            tags = {'property_list', COUNT_TAG} | {f'property:{property.pk}' for property in to_update}
+            tags |= {f'agent_listings:{property.agent_id}' for property in saved if property.agent_id}
+            invalidate_tags(*tags)
+        self.created += len(to_create)
+        self.updated += len(to_update)
+
+    def finish(self):
+        """Write the last batch, then rebuild what the bulk writes skipped"""
+        self.flush()
+        if not self.processed:
+            return
+        for agent_id in self.touched_agents - {None}:
+            AgentStats.refresh(agent_id)
+        invalidate_tags('agent_list', *(f'agent:{agent_id}' for agent_id in self.touched_agents - {None}))
+        clusters.rebuild()
+        facets.rebuild()
+        # Facets cached while the batches were written came from the old counts
+        invalidate_tags(COUNT_TAG)
+        location_index.invalidate()
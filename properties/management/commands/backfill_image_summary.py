@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+
+from properties.models import PRIMARY_IMAGE_ORDERING, Property, PropertyImage
+
+
+class Command(BaseCommand):
+    help = 'Backfill Property.primary_image and Property.image_count from PropertyImage rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Properties updated per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        primary_pk = PropertyImage.objects.filter(
+            property=OuterRef('pk')
+        ).order_by(*PRIMARY_IMAGE_ORDERING).values('pk')[:1]
+        queryset = Property.objects.order_by('pk').annotate(
+            computed_primary=Subquery(primary_pk),
+            computed_count=Count('images'),
+        ).only('pk', 'primary_image', 'image_count')
+
+        batch, updated = [], 0
+        for property in queryset.iterator(chunk_size=batch_size):
+            if (property.primary_image_id, property.image_count) == (property.computed_primary, property.computed_count):
+                continue
+            property.primary_image_id = property.computed_primary
+            property.image_count = property.computed_count
+            batch.append(property)
+            if len(batch) >= batch_size:
+                updated += Property.objects.bulk_update(batch, ['primary_image', 'image_count'])
+                batch = []
+        if batch:
+            updated += Property.objects.bulk_update(batch, ['primary_image', 'image_count'])
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} properties'))
@@ -0,0 +1,40 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from properties.benchmark import build_scenarios
+from properties.budgets import check_scenarios, load_budgets, unbudgeted_routes
+from properties.models import Property
+
+
+class Command(BaseCommand):
+    help = (
+        'Request every budgeted route against this database (seed it with seed_benchmark_data) and '
+        'report queries and time per URL against properties/performance_budgets.toml.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the sampled URLs')
+        parser.add_argument('--sample', type=int, default=5, help='Listings and agents sampled per route')
+
+    def handle(self, *args, **options):
+        if not Property.objects.exists():
+            raise CommandError('No listings to measure; run seed_benchmark_data first')
+        budgets = load_budgets()
+        missing = unbudgeted_routes(budgets)
+        if missing:
+            raise CommandError(f"No budget for {', '.join(missing)} in performance_budgets.toml")
+
+        scenarios = build_scenarios(random.Random(options['seed']), sample_size=options['sample'])
+        with override_settings(ALLOWED_HOSTS=['*'], PAGE_CACHE_ENABLED=False, PERFORMANCE_SLOW_REQUEST_MS=None):
+            results, problems = check_scenarios(scenarios, budgets)
+
+        for name, url, status, queries, ms in results:
+            budget = budgets[name]
+            line = f"{status} {len(queries):>3}/{budget['queries']:<3} queries {ms:>7.1f}/{budget['ms']:.0f} ms  {url}"
+            over = status >= 400 or len(queries) > budget['queries'] or ms > budget['ms']
+            self.stdout.write(self.style.ERROR(line) if over else line)
+        if problems:
+            raise CommandError('\n\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS(f'{len(results)} URLs within budget'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from properties.uploads import delete_stale_uploads
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete photos uploaded straight to media storage but never confirmed, once their '
+        'upload token has expired. Run it periodically, e.g. daily.'
+    )
+
+    def handle(self, *args, **options):
+        deleted = delete_stale_uploads()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unconfirmed upload files'))
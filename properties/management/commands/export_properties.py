@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from properties.listing_io import FORMATS, RowWriter, export_rows, guess_format, open_stream
+from properties.models import Property
+
+
+class Command(BaseCommand):
+    help = 'Stream every listing to a CSV or JSON Lines file (or - for stdout), in the format import_properties reads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write, or - for stdout')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to jsonl for .jsonl/.ndjson files, else csv')
+        parser.add_argument('--status', action='append', choices=[value for value, label in Property.STATUS_CHOICES], help='Only export listings with this status (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        queryset = Property.objects.all()
+        if options['status']:
+            queryset = queryset.filter(status__in=options['status'])
+        started = time.perf_counter()
+        written = 0
+        with open_stream(path, 'w') as stream:
+            writer = RowWriter(stream, format)
+            for row in export_rows(queryset, chunk_size=options['chunk_size']):
+                writer.write(row)
+                written += 1
+        elapsed = time.perf_counter() - started
+        rate = written / elapsed if elapsed else 0
+        # stdout may be the export itself
+        self.stderr.write(self.style.SUCCESS(f'Exported {written} rows in {elapsed:.1f}s, {rate:.0f} rows/s'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from properties.images import refresh_variants
+from properties.models import Agent, Company, PropertyImage
+
+
+class Command(BaseCommand):
+    help = 'Generate responsive WebP/JPEG variants for uploaded images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate variants even if they are up to date')
+
+    def handle(self, *args, **options):
+        for model, field_name in ((PropertyImage, 'image'), (Agent, 'photo'), (Company, 'hero_image')):
+            generated = 0
+            queryset = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            for instance in queryset.only('pk', field_name, f'{field_name}_variants').iterator(chunk_size=200):
+                if options['force']:
+                    setattr(instance, f'{field_name}_variants', {})
+                before = getattr(instance, f'{field_name}_variants')
+                if refresh_variants(instance, field_name) is not before:
+                    generated += 1
+            self.stdout.write(f'{model._meta.verbose_name_plural}: generated variants for {generated} image(s)')
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from properties.listing_io import FORMATS, ListingImporter, guess_format, open_stream, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Upsert listings from a CSV or JSON Lines file (or - for stdin). Rows are matched on '
+        'reference, then id; agents are given by username. Invalid rows are reported and skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read, or - for stdin')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to jsonl for .jsonl/.ndjson files, else csv')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per transaction')
+        parser.add_argument('--max-errors', type=int, default=100, help='Abort after this many invalid rows')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        importer = ListingImporter(batch_size=options['batch_size'], max_errors=options['max_errors'])
+        started = time.perf_counter()
+        with open_stream(path, 'r') as stream:
+            for line, row in read_rows(stream, format):
+                importer.add(line, row)
+                if importer.error_count > options['max_errors']:
+                    self.report_errors(importer)
+                    raise CommandError(
+                        f'Aborted at line {line}: more than {options["max_errors"]} invalid rows '
+                        f'({importer.processed} rows already written)'
+                    )
+        importer.finish()
+        elapsed = time.perf_counter() - started
+        self.report_errors(importer)
+        rate = importer.processed / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {importer.processed} rows ({importer.created} created, {importer.updated} updated, '
+            f'{importer.error_count} skipped) in {elapsed:.1f}s, {rate:.0f} rows/s'
+        ))
+
+    def report_errors(self, importer):
+        for line, message in importer.errors:
+            self.stderr.write(f'Line {line}: {message}')
+        if importer.error_count > len(importer.errors):
+            self.stderr.write(f'... and {importer.error_count - len(importer.errors)} more invalid rows')
@@ -0,0 +1,170 @@
+import random
+import re
+from collections import OrderedDict
+from itertools import combinations
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import QueryDict
+
+from properties.filters import FILTER_PARAMS, TEXT_SEARCH_PARAMS, filter_properties
+from properties.models import Property
+from properties.pagination import SORT_ORDERINGS, KeysetPaginator, get_ordering
+from properties.views import PROPERTY_LIST_PAGE_SIZE
+
+
+# Matches the query string of a property_list request in an access log line
+LOG_QUERY_RE = re.compile(r'/properties/\?([^\s"\']+)')
+
+# Representative values used when no query strings are supplied
+SAMPLE_VALUES = {
+    'listing_type': 'sale',
+    'property_type': 'house,apartment',
+    'location': 'Hualien',
+    'min_price': '5000000',
+    'max_price': '20000000',
+    'bedrooms': '3',
+    'bathrooms': '2',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay property_list query strings, EXPLAIN the page query for each and report '
+        'filter combinations that still scan the whole property table. Run against a '
+        'production-sized database: planners happily seq-scan tiny tables.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'sources', nargs='*',
+            help='Files of access log lines or raw query strings (one per line). '
+                 'Defaults to every combination of the search filters.',
+        )
+        parser.add_argument('--sample', type=int, default=500, help='Maximum number of query strings to replay')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for sampling')
+        parser.add_argument('--show-plans', action='store_true', help='Print the full plan for every combination')
+        parser.add_argument('--fail-on-scan', action='store_true', help='Exit with an error if any full scan is found')
+
+    def handle(self, *args, **options):
+        if options['sources']:
+            query_strings = self.sample_query_strings(options['sources'], options['sample'], options['seed'])
+        else:
+            query_strings = self.default_query_strings()
+        if not query_strings:
+            raise CommandError('No property_list query strings found')
+
+        # Plans depend only on which filters are present and the sort, so
+        # EXPLAIN each combination once
+        combinations_seen = OrderedDict()
+        for query_string in query_strings:
+            params = QueryDict(query_string)
+            key = self.signature(params)
+            if key in combinations_seen:
+                combinations_seen[key]['hits'] += 1
+            else:
+                combinations_seen[key] = {'hits': 1, 'params': params}
+
+        table = Property._meta.db_table
+        full_scans = 0
+        for key, entry in combinations_seen.items():
+            try:
+                plan = self.explain(entry['params'])
+            except Exception as exc:
+                self.stdout.write(self.style.WARNING(f'{key}: could not EXPLAIN ({exc})'))
+                continue
+            verdict = analyze_plan(plan, table, connection.vendor)
+            label = f"{key}  [{entry['hits']} request{'s' if entry['hits'] != 1 else ''}]"
+            if verdict['full_scan']:
+                full_scans += 1
+                self.stdout.write(self.style.ERROR(f'FULL SCAN  {label}'))
+            elif verdict['sorts']:
+                self.stdout.write(self.style.WARNING(f'SORT       {label}  via {", ".join(verdict["indexes"]) or "?"}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'OK         {label}  via {", ".join(verdict["indexes"]) or "?"}'))
+            if options['show_plans'] or verdict['full_scan']:
+                for line in plan.splitlines():
+                    self.stdout.write(f'    {line}')
+
+        summary = f'{len(combinations_seen)} filter combinations from {len(query_strings)} query strings, {full_scans} full scan(s)'
+        if full_scans and options['fail_on_scan']:
+            raise CommandError(summary)
+        self.stdout.write(summary)
+
+    def sample_query_strings(self, sources, size, seed):
+        """Reservoir-sample query strings so huge access logs stream in constant memory"""
+        rng = random.Random(seed)
+        reservoir, seen = [], 0
+        for source in sources:
+            try:
+                handle = open(source, encoding='utf-8', errors='replace')
+            except OSError as exc:
+                raise CommandError(f'Cannot read {source}: {exc}')
+            with handle:
+                for line in handle:
+                    query_string = self.extract_query_string(line.strip())
+                    if query_string is None:
+                        continue
+                    seen += 1
+                    if len(reservoir) < size:
+                        reservoir.append(query_string)
+                    else:
+                        index = rng.randrange(seen)
+                        if index < size:
+                            reservoir[index] = query_string
+        return reservoir
+
+    def extract_query_string(self, line):
+        if not line:
+            return None
+        match = LOG_QUERY_RE.search(line)
+        if match:
+            return match.group(1)
+        if ' ' not in line and '=' in line:
+            return line.lstrip('?')
+        return None
+
+    def default_query_strings(self):
+        """Every subset of the indexable filters under every sort order"""
+        indexable = [name for name in FILTER_PARAMS if name not in TEXT_SEARCH_PARAMS]
+        query_strings = []
+        for sort_by in SORT_ORDERINGS:
+            for size in range(len(indexable) + 1):
+                for names in combinations(indexable, size):
+                    params = QueryDict(mutable=True)
+                    params['sort_by'] = sort_by
+                    for name in names:
+                        params[name] = SAMPLE_VALUES[name]
+                    query_strings.append(params.urlencode())
+        return query_strings
+
+    def signature(self, params):
+        filters = [name for name in FILTER_PARAMS if params.get(name)]
+        sort_by = params.get('sort_by', 'newest')
+        if sort_by not in SORT_ORDERINGS:
+            sort_by = 'newest'
+        page = 'cursor' if params.get('cursor') else 'first page'
+        return f"{'+'.join(filters) or '(no filters)'} | sort={sort_by} | {page}"
+
+    def explain(self, params):
+        queryset = filter_properties(Property.objects.filter(status='available'), params)
+        paginator = KeysetPaginator(queryset, PROPERTY_LIST_PAGE_SIZE, get_ordering(params.get('sort_by', 'newest')))
+        return paginator.page_queryset(params.get('cursor')).explain()
+
+
+def analyze_plan(plan, table, vendor):
+    """
+    Classify an EXPLAIN plan: whether ``table`` is read with a full scan,
+    whether the result needs a separate sort step, and which indexes are used.
+    """
+    if vendor == 'sqlite':
+        full_scan = re.search(rf'\bSCAN {re.escape(table)}\b(?! USING)', plan) is not None
+        sorts = 'USE TEMP B-TREE FOR ORDER BY' in plan
+        indexes = re.findall(r'USING (?:COVERING )?INDEX (\w+)', plan)
+    elif vendor == 'postgresql':
+        full_scan = re.search(rf'Seq Scan on {re.escape(table)}\b', plan) is not None
+        sorts = re.search(r'->\s+Sort\b|^Sort\b', plan, re.MULTILINE) is not None
+        indexes = re.findall(r'(?:Index|Index Only|Bitmap Index) Scan(?: Backward)? (?:using|on) (\w+)', plan)
+    else:
+        full_scan, sorts, indexes = False, False, []
+    return {'full_scan': full_scan, 'sorts': sorts, 'indexes': list(OrderedDict.fromkeys(indexes))}
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from properties.models import Agent, AgentStats, Property
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount every agent\'s listings into AgentStats. Saves keep the counts current; '
+        'run this after bulk imports or queryset.update() calls that bypass signals.'
+    )
+
+    def handle(self, *args, **options):
+        counts = Property.objects.filter(agent__isnull=False).values('agent_id').annotate(
+            total=Count('pk'),
+            available=Count('pk', filter=Q(status='available')),
+            pending=Count('pk', filter=Q(status='pending')),
+            sold=Count('pk', filter=Q(status='sold')),
+        ).order_by()
+        by_agent = {row.pop('agent_id'): row for row in counts}
+        rows = [AgentStats(agent_id=agent_id, **by_agent.get(agent_id, {})) for agent_id in Agent.objects.values_list('pk', flat=True)]
+        AgentStats.objects.bulk_create(
+            rows, batch_size=1000,
+            update_conflicts=True, unique_fields=['agent'], update_fields=['total', 'available', 'pending', 'sold'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {len(rows)} agents'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from properties import facets
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the search facet counts from scratch. Saves keep them up to date; '
+        'run this after bulk imports or queryset.update() calls that bypass signals.'
+    )
+
+    def handle(self, *args, **options):
+        cells = facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {cells} facet count cells'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from properties import clusters
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the map cluster aggregates from scratch. Saves keep them up to date; '
+        'run this after bulk imports or queryset.update() calls that bypass signals.'
+    )
+
+    def handle(self, *args, **options):
+        cells = clusters.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {cells} map cluster cells'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from properties.models import Property, SearchDocument
+from properties.search import build_document
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-tokenize every property into the full-text search index. Saves keep it up to '
+        'date; run this after bulk imports or changes to the tokenizer.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Documents written per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fields = ('pk', 'title', 'description', 'address', 'city', 'postal_code')
+        batch, written = [], 0
+        with transaction.atomic():
+            SearchDocument.objects.all().delete()
+            for property in Property.objects.only(*fields).iterator(chunk_size=batch_size):
+                batch.append(SearchDocument(property_id=property.pk, **build_document(property)))
+                if len(batch) >= batch_size:
+                    written += len(SearchDocument.objects.bulk_create(batch))
+                    batch = []
+            written += len(SearchDocument.objects.bulk_create(batch))
+        self.stdout.write(self.style.SUCCESS(f'Indexed {written} properties'))
@@ -0,0 +1,183 @@
+import json
+import random
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from properties.benchmark import build_scenarios, summarize
+from properties.models import Property
+
+
+# Query count from the db entry of core.middleware's Server-Timing header
+SERVER_TIMING_QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def queries_from(server_timing):
+    match = SERVER_TIMING_QUERIES_RE.search(server_timing or '')
+    return int(match.group(1)) if match else None
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a weighted mix of requests against every GET route, in process or against a '
+        'running server, and report p50/p95/p99 latency, queries per request and throughput. '
+        'Seed data first with seed_benchmark_data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Measured requests')
+        parser.add_argument('--warmup', type=int, default=100, help='Unmeasured requests sent first')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the request mix')
+        parser.add_argument(
+            '--base-url',
+            help='Benchmark a running server (e.g. http://127.0.0.1:8000) instead of calling views in '
+                 'process. Queries are read from its Server-Timing header; signed-in routes are skipped.',
+        )
+        parser.add_argument('--concurrency', type=int, default=1, help='Parallel requests with --base-url')
+        parser.add_argument('--no-page-cache', action='store_true', help='In process: disable the page cache')
+        parser.add_argument('--anonymous', action='store_true', help='Skip routes that need a signed-in agent')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Results JSON of an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        if not Property.objects.exists():
+            raise CommandError('No listings to benchmark; run seed_benchmark_data first')
+        live = bool(options['base_url'])
+        rng = random.Random(options['seed'])
+        scenarios = build_scenarios(rng, authenticated=not (live or options['anonymous']))
+        weights = [scenario.weight for scenario in scenarios]
+        warmup = rng.choices(scenarios, weights, k=options['warmup'])
+        plan = rng.choices(scenarios, weights, k=options['requests'])
+
+        if live:
+            fetch = self.live_fetcher(options['base_url'].rstrip('/'))
+            concurrency = max(1, options['concurrency'])
+        else:
+            fetch = self.client_fetcher()
+            concurrency = 1
+        overrides = {
+            'ALLOWED_HOSTS': ['*'],
+            'PERFORMANCE_SERVER_TIMING': True,
+            'PERFORMANCE_SLOW_REQUEST_MS': None,
+        }
+        if options['no_page_cache']:
+            overrides['PAGE_CACHE_ENABLED'] = False
+
+        with override_settings(**overrides):
+            self.run(fetch, warmup, concurrency)
+            started = time.perf_counter()
+            samples = self.run(fetch, plan, concurrency)
+            elapsed = time.perf_counter() - started
+
+        results = {
+            'meta': {
+                'started_at': timezone.now().isoformat(),
+                'revision': self.revision(),
+                'mode': 'live' if live else 'in-process',
+                'base_url': options['base_url'],
+                'concurrency': concurrency,
+                'requests': len(plan),
+                'seed': options['seed'],
+                'page_cache': getattr(settings, 'PAGE_CACHE_ENABLED', True) and not options['no_page_cache'],
+                'database': connection.vendor,
+                'properties': Property.objects.count(),
+            },
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(len(plan) / elapsed, 2) if elapsed else None,
+            'routes': summarize(samples),
+        }
+        self.report(results)
+        if options['compare']:
+            self.compare(results, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                json.dump(results, handle, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def client_fetcher(self):
+        clients = {}
+
+        def fetch(scenario):
+            client = clients.get(scenario.login)
+            if client is None:
+                client = clients[scenario.login] = Client()
+                if scenario.login:
+                    client.force_login(User.objects.get(username=scenario.login))
+            started = time.perf_counter()
+            response = client.get(scenario.url, secure=True)
+            return time.perf_counter() - started, response.status_code, response.get('Server-Timing')
+        return fetch
+
+    def live_fetcher(self, base_url):
+        def fetch(scenario):
+            started = time.perf_counter()
+            try:
+                with urlopen(base_url + scenario.url, timeout=60) as response:
+                    response.read()
+                    status, server_timing = response.status, response.headers.get('Server-Timing')
+            except HTTPError as error:
+                status, server_timing = error.code, error.headers.get('Server-Timing')
+            return time.perf_counter() - started, status, server_timing
+        return fetch
+
+    def run(self, fetch, plan, concurrency):
+        def sample(scenario):
+            seconds, status, server_timing = fetch(scenario)
+            return scenario.name, seconds, queries_from(server_timing), status
+        if concurrency == 1:
+            return [sample(scenario) for scenario in plan]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(sample, plan))
+
+    def revision(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'route':<24}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        )
+        for name, stats in results['routes'].items():
+            queries = '-' if stats['queries_mean'] is None else f"{stats['queries_mean']:.1f}"
+            line = (
+                f"{'all' if name == '*' else name:<24}{stats['requests']:>9}{stats['errors']:>8}"
+                f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{queries:>9}"
+            )
+            self.stdout.write(self.style.ERROR(line) if stats['errors'] else line)
+        self.stdout.write(f"{results['throughput_rps']} requests/s over {results['elapsed_s']}s")
+
+    def compare(self, results, path):
+        try:
+            with open(path, encoding='utf-8') as handle:
+                baseline = json.load(handle)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+        self.stdout.write(f"\nAgainst {path} ({baseline['meta'].get('revision') or 'unknown revision'}):")
+        for name, stats in results['routes'].items():
+            before = baseline.get('routes', {}).get(name)
+            if before is None:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_mean'):
+                if stats[key] is None or not before.get(key):
+                    continue
+                change = 100 * (stats[key] - before[key]) / before[key]
+                changes.append(f'{key} {before[key]} -> {stats[key]} ({change:+.0f}%)')
+            self.stdout.write(f"  {'all' if name == '*' else name}: {', '.join(changes)}")
+        if baseline.get('throughput_rps') and results['throughput_rps']:
+            change = 100 * (results['throughput_rps'] - baseline['throughput_rps']) / baseline['throughput_rps']
+            self.stdout.write(f"  throughput: {baseline['throughput_rps']} -> {results['throughput_rps']} req/s ({change:+.0f}%)")
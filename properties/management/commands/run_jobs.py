@@ -0,0 +1,63 @@
+import os
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from properties.jobs import claim_job, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued background jobs (image storage and resizing). Start as many '
+        'workers as needed; each job is claimed by exactly one of them and '
+        're-delivered if its worker dies.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--max-jobs', type=int, default=0, help='Exit after this many jobs (0 = no limit)')
+        parser.add_argument(
+            '--sleep', type=float, default=getattr(settings, 'JOBS_POLL_INTERVAL', 2),
+            help='Seconds to wait between polls when the queue is empty',
+        )
+        parser.add_argument(
+            '--visibility-timeout', type=int, default=getattr(settings, 'JOBS_VISIBILITY_TIMEOUT', 300),
+            help='Seconds before a claimed but unfinished job is handed to another worker',
+        )
+        parser.add_argument('--worker-id', default=None, help='Name recorded on claimed jobs')
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = False
+        # Finish the current job on SIGTERM/SIGINT instead of abandoning it
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        processed = failed = 0
+        while not self.stopping:
+            close_old_connections()
+            job = claim_job(worker_id, options['visibility_timeout'])
+            if job is None:
+                if options['burst']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            started = time.monotonic()
+            if run_job(job, worker_id):
+                self.stdout.write(f'Finished {job.task} #{job.pk} in {time.monotonic() - started:.2f}s')
+            else:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f'Failed {job.task} #{job.pk} (attempt {job.attempts}/{job.max_attempts})'))
+            processed += 1
+            if options['max_jobs'] and processed >= options['max_jobs']:
+                break
+
+        self.stdout.write(f'{worker_id}: processed {processed} job(s), {failed} failed')
+
+    def stop(self, signum, frame):
+        self.stopping = True
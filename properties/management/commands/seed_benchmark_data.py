@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from properties.benchmark import REFERENCE_PREFIX, seed
+from properties.models import Property
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with synthetic Hualien/Taipei listings, agents, images and inquiries '
+        'for load benchmarks (see run_benchmark). Use a scratch database: the rows are real.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--properties', type=int, default=100_000, help='Listings to create')
+        parser.add_argument('--agents', type=int, default=200, help='Agents to create')
+        parser.add_argument('--images', type=float, default=4, help='Average images per listing')
+        parser.add_argument('--contact-ratio', type=float, default=0.1, help='Share of listings with an inquiry')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Listings written per transaction')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible data')
+        parser.add_argument('--append', action='store_true', help='Add to benchmark data that is already there')
+
+    def handle(self, *args, **options):
+        existing = Property.objects.filter(reference__startswith=REFERENCE_PREFIX).count()
+        if existing and not options['append']:
+            raise CommandError(
+                f'{existing} benchmark listings already exist. Pass --append to add more, '
+                f'or seed a fresh database so runs stay comparable.'
+            )
+        total = options['properties']
+        started = time.perf_counter()
+
+        def progress(done):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{done}/{total} listings ({done / elapsed:.0f}/s)')
+
+        created = seed(
+            total,
+            agent_count=options['agents'],
+            images_per_listing=options['images'],
+            contact_ratio=options['contact_ratio'],
+            batch_size=options['batch_size'],
+            random_seed=options['seed'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {created['properties']} listings, {created['images']} images, {created['agents']} agents "
+            f"and {created['contacts']} inquiries in {time.perf_counter() - started:.1f}s"
+        ))
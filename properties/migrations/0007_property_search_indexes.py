@@ -0,0 +1,49 @@
+# Generated by Django 6.1.2 on 2026-10-16 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("properties", "0006_property_image_summary"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="property",
+            index=models.Index(fields=["status", "created_at", "id"], name="property_status_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="property",
+            index=models.Index(fields=["status", "price", "id"], name="property_status_price_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="property",
+            index=models.Index(fields=["status", "area_sqm", "id"], name="property_status_area_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="property",
+            index=models.Index(fields=["status", "listing_type", "created_at", "id"], name="property_listing_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="property",
+            index=models.Index(fields=["status", "listing_type", "price", "id"], name="property_listing_price_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="property",
+            index=models.Index(fields=["status", "property_type", "price"], name="property_type_price_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="property",
+            index=models.Index(fields=["status", "bedrooms", "bathrooms"], name="property_rooms_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="property",
+            index=models.Index(fields=["featured", "status", "created_at"], name="property_featured_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="property",
+            index=models.Index(fields=["agent", "status", "created_at"], name="property_agent_status_idx"),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.1.2 on 2026-10-16 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("properties", "0007_property_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="agent",
+            name="photo_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="company",
+            name="hero_image_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="propertyimage",
+            name="image_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 6.1.2 on 2026-10-16 21:02
+
+from django.db import migrations, models
+
+
+# Frozen copy of properties.geo.encode() as of this migration
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode(lat, lon, precision=12):
+    lon_bits, lat_bits = (5 * precision + 1) // 2, 5 * precision // 2
+    row = min(int((float(lat) + 90.0) / 180.0 * 2 ** lat_bits), 2 ** lat_bits - 1)
+    col = min(int((float(lon) + 180.0) / 360.0 * 2 ** lon_bits), 2 ** lon_bits - 1)
+    value = 0
+    for i in range(5 * precision):
+        if i % 2 == 0:
+            lon_bits -= 1
+            bit = (col >> lon_bits) & 1
+        else:
+            lat_bits -= 1
+            bit = (row >> lat_bits) & 1
+        value = (value << 1) | bit
+    return ''.join(BASE32[(value >> 5 * (precision - 1 - i)) & 31] for i in range(precision))
+
+
+def fill_geohash(apps, schema_editor):
+    Property = apps.get_model('properties', 'Property')
+    located = Property.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    batch = []
+    for property in located.only('pk', 'latitude', 'longitude').iterator(chunk_size=1000):
+        property.geohash = encode(property.latitude, property.longitude)
+        batch.append(property)
+        if len(batch) >= 1000:
+            Property.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    Property.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0009_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['status', 'geohash'], name='property_status_geohash_idx'),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
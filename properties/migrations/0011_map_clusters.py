@@ -0,0 +1,29 @@
+# Generated by Django 6.1.2 on 2026-10-16 21:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0010_property_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MapCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('precision', models.PositiveSmallIntegerField()),
+                ('cell', models.CharField(max_length=12)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('latitude_sum', models.FloatField(default=0)),
+                ('longitude_sum', models.FloatField(default=0)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=12)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('precision', 'cell'), name='mapcluster_precision_cell_uniq')],
+            },
+        ),
+    ]
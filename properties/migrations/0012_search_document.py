@@ -0,0 +1,125 @@
+# Generated by Django 6.1.2 on 2026-10-16 21:05
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Frozen copy of properties.search as of this migration
+DOCUMENT_TABLE = 'properties_searchdocument'
+FTS_TABLE = 'properties_search_fts'
+DOCUMENT_FIELDS = {
+    'title_tokens': ('title',),
+    'location_tokens': ('city', 'address', 'postal_code'),
+    'body_tokens': ('description',),
+}
+POSTGRES_VECTOR = (
+    "setweight(to_tsvector('simple', title_tokens), 'A') || "
+    "setweight(to_tsvector('simple', location_tokens), 'B') || "
+    "setweight(to_tsvector('simple', body_tokens), 'C')"
+)
+CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+TOKEN_RE = re.compile(rf'[{CJK}]+|(?:(?![{CJK}])[^\W_])+')
+CJK_RE = re.compile(rf'[{CJK}]')
+
+
+def tokenize(text):
+    tokens = []
+    for run in TOKEN_RE.findall(unicodedata.normalize('NFKC', text or '').lower()):
+        if CJK_RE.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def build_document(property):
+    return {
+        column: ' '.join(token for name in fields for token in tokenize(getattr(property, name)))
+        for column, fields in DOCUMENT_FIELDS.items()
+    }
+
+
+SQLITE_FORWARD = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        title_tokens, location_tokens, body_tokens,
+        content='{DOCUMENT_TABLE}', content_rowid='property_id',
+        tokenize='unicode61', prefix='1 2 3'
+    )""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {DOCUMENT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title_tokens, location_tokens, body_tokens)
+        VALUES (new.property_id, new.title_tokens, new.location_tokens, new.body_tokens);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {DOCUMENT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title_tokens, location_tokens, body_tokens)
+        VALUES ('delete', old.property_id, old.title_tokens, old.location_tokens, old.body_tokens);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE ON {DOCUMENT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title_tokens, location_tokens, body_tokens)
+        VALUES ('delete', old.property_id, old.title_tokens, old.location_tokens, old.body_tokens);
+        INSERT INTO {FTS_TABLE}(rowid, title_tokens, location_tokens, body_tokens)
+        VALUES (new.property_id, new.title_tokens, new.location_tokens, new.body_tokens);
+    END""",
+]
+SQLITE_REVERSE = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+POSTGRES_FORWARD = [
+    f'ALTER TABLE {DOCUMENT_TABLE} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({POSTGRES_VECTOR}) STORED',
+    f'CREATE INDEX properties_search_vector_idx ON {DOCUMENT_TABLE} USING GIN (search_vector)',
+]
+POSTGRES_REVERSE = [
+    'DROP INDEX IF EXISTS properties_search_vector_idx',
+    f'ALTER TABLE {DOCUMENT_TABLE} DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_fulltext_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD})
+
+
+def drop_fulltext_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE})
+
+
+def fill_search_documents(apps, schema_editor):
+    Property = apps.get_model('properties', 'Property')
+    SearchDocument = apps.get_model('properties', 'SearchDocument')
+    batch = []
+    for property in Property.objects.only('pk', 'title', 'description', 'address', 'city', 'postal_code').iterator(chunk_size=1000):
+        batch.append(SearchDocument(property_id=property.pk, **build_document(property)))
+        if len(batch) >= 1000:
+            SearchDocument.objects.bulk_create(batch)
+            batch = []
+    SearchDocument.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0011_map_clusters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('property', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='properties.property')),
+                ('title_tokens', models.TextField(blank=True)),
+                ('location_tokens', models.TextField(blank=True)),
+                ('body_tokens', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.1.2 on 2026-10-16 21:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0012_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgentStats',
+            fields=[
+                ('agent', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='properties.agent')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('available', models.PositiveIntegerField(default=0)),
+                ('pending', models.PositiveIntegerField(default=0)),
+                ('sold', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Agent stats',
+            },
+        ),
+    ]
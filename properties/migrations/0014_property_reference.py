@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-16 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0013_agent_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='reference',
+            field=models.CharField(blank=True, help_text='Partner listing reference, used to match rows on import', max_length=64, null=True, unique=True),
+        ),
+    ]
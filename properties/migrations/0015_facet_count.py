@@ -0,0 +1,28 @@
+# Generated by Django 6.1.2 on 2026-10-16 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0014_property_reference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing_type', models.CharField(max_length=10)),
+                ('property_type', models.CharField(max_length=20)),
+                ('bedrooms', models.PositiveSmallIntegerField()),
+                ('bathrooms', models.PositiveSmallIntegerField()),
+                ('price_band', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('listing_type', 'property_type', 'bedrooms', 'bathrooms', 'price_band'), name='facetcount_cell_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.1.2 on 2026-10-16 23:04
+
+import properties.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0015_facet_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='property',
+            name='geohash',
+            field=properties.models.GeohashField(blank=True, editable=False, max_length=12),
+        ),
+    ]
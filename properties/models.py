@@ -1,7 +1,37 @@
-from django.db import models
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 
+from . import geo
+
+
+# Shared-cache key whose value changes every time the Company row is saved
+COMPANY_VERSION_KEY = 'company:version'
+
+# Process-local copy of the Company row, see Company.get_cached()
+_company_cache = {'obj': None, 'version': None, 'checked_at': 0.0}
+
+
+class GeohashField(models.CharField):
+    """
+    A geohash column compared in byte order. Prefix range scans
+    (``prefix <= geohash < prefix + '{'``) rely on it; SQLite's default
+    BINARY collation already sorts that way, PostgreSQL needs "C" since a
+    locale collation may order '{' before digits and letters.
+    """
+    def db_parameters(self, connection):
+        params = super().db_parameters(connection)
+        if connection.vendor == 'postgresql':
+            params['collation'] = 'C'
+        return params
+
 
 class Company(models.Model):
     """
@@ -14,6 +44,7 @@ class Company(models.Model):
     # Images
     logo = models.ImageField(upload_to='company/', blank=True, null=True, help_text='Company logo')
     hero_image = models.ImageField(upload_to='company/', blank=True, null=True, help_text='Main hero/banner image for homepage and about page')
+    hero_image_variants = models.JSONField(default=dict, blank=True, editable=False)
     
     # About/Story
     story = models.TextField(blank=True, help_text='Company story and background')
@@ -67,13 +98,66 @@ class Company(models.Model):
         """Ensure only one Company instance exists"""
         if not self.pk and Company.objects.exists():
             raise ValidationError('Only one Company instance is allowed. Please edit the existing one.')
-        return super().save(*args, **kwargs)
+        result = super().save(*args, **kwargs)
+        Company.invalidate_cache()
+        return result
     
     @classmethod
     def get_instance(cls):
         """Get or create the single Company instance"""
         obj, created = cls.objects.get_or_create(pk=1)
         return obj
+    
+    @classmethod
+    def get_cached(cls):
+        """
+        Process-local copy of get_instance().
+        
+        The copy is revalidated against a version stamp in the shared cache at
+        most every COMPANY_CACHE_CHECK_SECONDS, so a save in one worker reaches
+        the others within that window without a database round-trip per request.
+        """
+        now = time.monotonic()
+        interval = getattr(settings, 'COMPANY_CACHE_CHECK_SECONDS', 5)
+        if _company_cache['obj'] is not None and now - _company_cache['checked_at'] < interval:
+            return _company_cache['obj']
+        
+        version = cache.get_or_set(COMPANY_VERSION_KEY, lambda: uuid.uuid4().hex, None)
+        if _company_cache['obj'] is None or _company_cache['version'] != version:
+            _company_cache['obj'] = cls.get_instance()
+            _company_cache['version'] = version
+        _company_cache['checked_at'] = now
+        return _company_cache['obj']
+    
+    @classmethod
+    def invalidate_cache(cls):
+        """Drop this worker's copy now and tell other workers once the save commits"""
+        _company_cache['obj'] = None
+        transaction.on_commit(lambda: cache.set(COMPANY_VERSION_KEY, uuid.uuid4().hex, None))
+
+
+class AgentQuerySet(models.QuerySet):
+    def directory(self):
+        """
+        Agents with their user and listing counts in one statement, for the
+        agent directory: ``active_listings`` and ``sold_listings``.
+        """
+        return self.select_related('user').annotate(
+            active_listings=models.Count('properties', filter=models.Q(properties__status='available')),
+            sold_listings=models.Count('properties', filter=models.Q(properties__status='sold')),
+        ).order_by('user__first_name', 'user__last_name', 'pk')
+    
+    def search(self, query):
+        """Agents whose name, username or specialization contains every word of ``query``"""
+        queryset = self
+        for word in query.split():
+            queryset = queryset.filter(
+                models.Q(user__first_name__icontains=word) |
+                models.Q(user__last_name__icontains=word) |
+                models.Q(user__username__icontains=word) |
+                models.Q(specialization__icontains=word)
+            )
+        return queryset
 
 
 class Agent(models.Model):
@@ -81,13 +165,29 @@ class Agent(models.Model):
     phone = models.CharField(max_length=20)
     bio = models.TextField(blank=True)
     photo = models.ImageField(upload_to='agents/', blank=True, null=True)
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
     specialization = models.CharField(max_length=100, blank=True)
     is_authorized = models.BooleanField(default=False, help_text='Agent must be authorized by admin to manage properties')
     
+    objects = AgentQuerySet.as_manager()
+    
     def __str__(self):
         return f"{self.user.get_full_name() or self.user.username}"
 
 
+# The image shown on listing cards: the one flagged primary, else the first by order
+PRIMARY_IMAGE_ORDERING = ('-is_primary', 'order', 'pk')
+
+
+class PropertyQuerySet(models.QuerySet):
+    def with_card_data(self):
+        """
+        Fetch everything a listing card renders in one query: the agent, its
+        user and the denormalized primary image are all joined in.
+        """
+        return self.select_related('agent__user', 'primary_image')
+
+
 class Property(models.Model):
     STATUS_CHOICES = [
         ('available', '可售 / Available'),
@@ -120,6 +220,8 @@ class Property(models.Model):
     postal_code = models.CharField(max_length=10, blank=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True, help_text='Latitude coordinate for map display')
     longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True, help_text='Longitude coordinate for map display')
+    # Derived from latitude/longitude in save(), see properties.geo
+    geohash = GeohashField(max_length=12, blank=True, editable=False)
     
     bedrooms = models.PositiveIntegerField(default=0)
     bathrooms = models.PositiveIntegerField(default=0)
@@ -131,20 +233,223 @@ class Property(models.Model):
     agent = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, related_name='properties')
     
     featured = models.BooleanField(default=False)
+    reference = models.CharField(max_length=64, unique=True, null=True, blank=True, help_text='Partner listing reference, used to match rows on import')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Denormalized from PropertyImage, kept in sync by refresh_image_summary()
+    primary_image = models.ForeignKey('PropertyImage', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+    image_count = models.PositiveIntegerField(default=0, editable=False)
+    
+    objects = PropertyQuerySet.as_manager()
+    
     class Meta:
         verbose_name_plural = 'Properties'
         ordering = ['-created_at']
+        # Composite indexes for property_list: every search filters on status,
+        # then sorts by created_at/price/area_sqm with an id tiebreaker (keyset
+        # pagination). Leading equality columns narrow the common filters.
+        indexes = [
+            models.Index(fields=['status', 'created_at', 'id'], name='property_status_created_idx'),
+            models.Index(fields=['status', 'price', 'id'], name='property_status_price_idx'),
+            models.Index(fields=['status', 'area_sqm', 'id'], name='property_status_area_idx'),
+            models.Index(fields=['status', 'listing_type', 'created_at', 'id'], name='property_listing_created_idx'),
+            models.Index(fields=['status', 'listing_type', 'price', 'id'], name='property_listing_price_idx'),
+            models.Index(fields=['status', 'property_type', 'price'], name='property_type_price_idx'),
+            models.Index(fields=['status', 'bedrooms', 'bathrooms'], name='property_rooms_idx'),
+            models.Index(fields=['featured', 'status', 'created_at'], name='property_featured_idx'),
+            models.Index(fields=['agent', 'status', 'created_at'], name='property_agent_status_idx'),
+            models.Index(fields=['status', 'geohash'], name='property_status_geohash_idx'),
+        ]
     
     def __str__(self):
         return self.title
+    
+    def save(self, *args, **kwargs):
+        self.geohash = self.compute_geohash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+        # post_save handlers have seen the old values; later saves diff against these
+        self._loaded_values = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+    
+    def compute_geohash(self):
+        if self.latitude is None or self.longitude is None:
+            return ''
+        return geo.encode(self.latitude, self.longitude)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the loaded field values so signal handlers can see what changed"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def refresh_image_summary(self):
+        """Recompute primary_image and image_count from the current images"""
+        images = PropertyImage.objects.filter(property_id=self.pk)
+        self.primary_image = images.order_by(*PRIMARY_IMAGE_ORDERING).first()
+        self.image_count = images.count()
+        # Bump updated_at too: the card's rendered output has changed
+        self.updated_at = timezone.now()
+        Property.objects.filter(pk=self.pk).update(
+            primary_image=self.primary_image,
+            image_count=self.image_count,
+            updated_at=self.updated_at,
+        )
+
+
+class SearchDocument(models.Model):
+    """
+    Tokenized listing text for full-text search, see properties.search.
+    The database's full-text index (FTS5 / tsvector) is built from this table.
+    """
+    property = models.OneToOneField(Property, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    title_tokens = models.TextField(blank=True)
+    location_tokens = models.TextField(blank=True)
+    body_tokens = models.TextField(blank=True)
+    
+    def __str__(self):
+        return f"Search document for property {self.property_id}"
+
+
+class AgentStats(models.Model):
+    """
+    Listing counts per agent, kept current by Property signals so the
+    dashboard and profile read one row instead of counting listings.
+    """
+    agent = models.OneToOneField(Agent, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total = models.PositiveIntegerField(default=0)
+    available = models.PositiveIntegerField(default=0)
+    pending = models.PositiveIntegerField(default=0)
+    sold = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'Agent stats'
+    
+    def __str__(self):
+        return f"Stats for agent {self.agent_id}"
+    
+    @staticmethod
+    def compute(agent_id):
+        """All counts for one agent in a single conditional aggregation query"""
+        return Property.objects.filter(agent_id=agent_id).aggregate(
+            total=models.Count('pk'),
+            available=models.Count('pk', filter=models.Q(status='available')),
+            pending=models.Count('pk', filter=models.Q(status='pending')),
+            sold=models.Count('pk', filter=models.Q(status='sold')),
+        )
+    
+    @classmethod
+    def refresh(cls, agent_id):
+        stats, _ = cls.objects.update_or_create(agent_id=agent_id, defaults=cls.compute(agent_id))
+        return stats
+    
+    @classmethod
+    def for_agent(cls, agent):
+        """The agent's stats row, computed on first use"""
+        stats = cls.objects.filter(agent=agent).first()
+        if stats is None:
+            try:
+                with transaction.atomic():
+                    stats = cls.refresh(agent.pk)
+            except IntegrityError:
+                stats = cls.objects.get(agent=agent)
+        return stats
+    
+    @classmethod
+    async def afor_agent(cls, agent):
+        stats = await cls.objects.filter(agent=agent).afirst()
+        if stats is None:
+            stats = await sync_to_async(cls.for_agent)(agent)
+        return stats
+    
+    @classmethod
+    def apply_change(cls, old, new):
+        """
+        Move one listing between agents/status buckets. ``old`` and ``new``
+        are ``(agent_id, status)`` pairs or None.
+        """
+        deltas = {}
+        for pair, step in ((old, -1), (new, 1)):
+            if pair is None or pair[0] is None:
+                continue
+            agent_id, status = pair
+            changes = deltas.setdefault(agent_id, {})
+            changes['total'] = changes.get('total', 0) + step
+            if status in ('available', 'pending', 'sold'):
+                changes[status] = changes.get(status, 0) + step
+        for agent_id, changes in deltas.items():
+            changes = {name: delta for name, delta in changes.items() if delta}
+            if not changes:
+                continue
+            updated = cls.objects.filter(agent_id=agent_id).update(
+                **{name: models.F(name) + delta for name, delta in changes.items()}
+            )
+            if not updated and Agent.objects.filter(pk=agent_id).exists():
+                # No row yet: count from scratch, which already includes this change
+                cls.refresh(agent_id)
+
+
+class MapCluster(models.Model):
+    """
+    Running totals of available, mapped properties per geohash cell, one
+    row per cell at each precision in properties.clusters.CLUSTER_PRECISIONS.
+    Maintained incrementally by signals; rebuild with `rebuild_map_clusters`.
+    """
+    precision = models.PositiveSmallIntegerField()
+    cell = models.CharField(max_length=12)
+    count = models.PositiveIntegerField(default=0)
+    latitude_sum = models.FloatField(default=0)
+    longitude_sum = models.FloatField(default=0)
+    min_price = models.DecimalField(max_digits=12, decimal_places=2)
+    max_price = models.DecimalField(max_digits=12, decimal_places=2)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['precision', 'cell'], name='mapcluster_precision_cell_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.cell} ({self.count})"
+
+
+class FacetCount(models.Model):
+    """
+    Number of available listings per combination of sidebar facet values
+    (listing type, property type, capped bedrooms/bathrooms, price band),
+    see properties.facets. Maintained incrementally by signals; rebuild with
+    `rebuild_facets`.
+    """
+    listing_type = models.CharField(max_length=10)
+    property_type = models.CharField(max_length=20)
+    bedrooms = models.PositiveSmallIntegerField()
+    bathrooms = models.PositiveSmallIntegerField()
+    price_band = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['listing_type', 'property_type', 'bedrooms', 'bathrooms', 'price_band'],
+                name='facetcount_cell_uniq',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.listing_type}/{self.property_type}/{self.bedrooms}/{self.bathrooms}/{self.price_band} ({self.count})"
 
 
 class PropertyImage(models.Model):
     property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='properties/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     caption = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
     order = models.PositiveIntegerField(default=0)
@@ -170,3 +475,50 @@ class Contact(models.Model):
     
     def __str__(self):
         return f"Contact from {self.name} - {self.created_at.strftime('%Y-%m-%d')}"
+
+
+class Job(models.Model):
+    """
+    A unit of background work, run by `manage.py run_jobs`.
+    The table itself is the queue, so no external broker is needed.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('failed', 'Failed'),
+    ]
+    
+    task = models.CharField(max_length=200, help_text='Dotted path of the task function')
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(blank=True, null=True, help_text='A running job not finished by then is handed to another worker')
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['run_after']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.task} ({self.status})"
+
+
+class StagedUpload(models.Model):
+    """
+    Uploaded file bytes parked in the database until a job moves them to
+    media storage, so the request doesn't wait on S3.
+    """
+    name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.name
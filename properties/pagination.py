@@ -0,0 +1,196 @@
+"""
+Keyset (cursor) pagination for property listings.
+
+Instead of OFFSET/LIMIT, each page is fetched by seeking past the last row of
+the previous page on the sort key plus a ``pk`` tiebreaker, so page 200 costs
+the same as page 1. Cursors are opaque URL-safe tokens.
+"""
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import FloatField, Q
+from django.utils.functional import cached_property
+
+
+# sort_by value -> ordering used for keyset seeks (last field is always the pk tiebreaker)
+SORT_ORDERINGS = {
+    'newest': ('-created_at', '-pk'),
+    'price_low': ('price', 'pk'),
+    'price_high': ('-price', '-pk'),
+    'sqft': ('-area_sqm', '-pk'),
+}
+DEFAULT_SORT = 'newest'
+
+# Map searches sort on the distance_km annotation added by filters.filter_geo
+DISTANCE_ORDERING = ('distance_km', 'pk')
+# Free-text searches sort on the search_rank annotation added by search.search
+RELEVANCE_ORDERING = ('-search_rank', '-pk')
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def get_ordering(sort_by):
+    """Return the keyset ordering for a sort_by value, falling back to newest"""
+    return SORT_ORDERINGS.get(sort_by, SORT_ORDERINGS[DEFAULT_SORT])
+
+
+def encode_cursor(values, direction):
+    """Encode the sort key values of a boundary row and a direction ('n' or 'p')"""
+    payload = json.dumps({'v': [str(v) for v in values], 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into (raw values, direction)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        values, direction = payload['v'], payload['d']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor(cursor)
+    if direction not in ('n', 'p') or not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values, direction
+
+
+class CursorPage:
+    """A page of results with opaque next/previous cursors"""
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset by seeking on ``ordering`` rather than by offset.
+
+    ``ordering`` must be a tuple of non-nullable field names ending in a unique
+    tiebreaker (normally ``pk``), each optionally prefixed with '-'.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.model = queryset.model
+
+    @cached_property
+    def count(self):
+        """Total number of results. Only evaluated if something asks for it."""
+        return self.queryset.count()
+
+    def _fields(self):
+        return [(f.lstrip('-'), f.startswith('-')) for f in self.ordering]
+
+    def _to_python(self, values):
+        fields = self._fields()
+        if len(values) != len(fields):
+            raise InvalidCursor(values)
+        parsed = []
+        for (name, _), raw in zip(fields, values):
+            try:
+                field = self.model._meta.pk if name == 'pk' else self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                # A float annotation such as distance_km
+                field = FloatField()
+            try:
+                parsed.append(field.to_python(raw))
+            except Exception:
+                raise InvalidCursor(values)
+        return parsed
+
+    def _row_values(self, obj):
+        return [getattr(obj, name) for name, _ in self._fields()]
+
+    def _seek_filter(self, values, forward):
+        """
+        Build the row-value comparison ``(a, b, pk) > (x, y, z)`` as an OR of
+        prefix equalities, honouring each field's sort direction.
+        """
+        fields = self._fields()
+        condition = Q()
+        for i, (name, descending) in enumerate(fields):
+            lookup = 'lt' if descending == forward else 'gt'
+            term = Q(**{f'{name}__{lookup}': values[i]})
+            for j in range(i):
+                term &= Q(**{fields[j][0]: values[j]})
+            condition |= term
+        return condition
+
+    def _reversed_ordering(self):
+        return tuple(f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering)
+
+    def _parse_cursor(self, cursor):
+        """Return (values, direction) for a cursor; invalid cursors mean the first page"""
+        if cursor:
+            try:
+                raw, direction = decode_cursor(cursor)
+                return self._to_python(raw), direction
+            except InvalidCursor:
+                pass
+        return None, 'n'
+
+    def page_queryset(self, cursor=None):
+        """The sliced queryset get_page() evaluates, e.g. for EXPLAIN"""
+        values, direction = self._parse_cursor(cursor)
+        return self._page_queryset(values, direction == 'n')
+
+    def _page_queryset(self, values, forward):
+        queryset = self.queryset.order_by(*(self.ordering if forward else self._reversed_ordering()))
+        if values is not None:
+            queryset = queryset.filter(self._seek_filter(values, forward))
+        return queryset[:self.per_page + 1]
+
+    def get_page(self, cursor=None):
+        """Return the page after (or before) ``cursor``; invalid cursors yield the first page"""
+        values, direction = self._parse_cursor(cursor)
+        forward = direction == 'n'
+        return self._build_page(list(self._page_queryset(values, forward)), values, forward)
+
+    async def aget_page(self, cursor=None):
+        """get_page() through the async ORM"""
+        values, direction = self._parse_cursor(cursor)
+        forward = direction == 'n'
+        rows = [row async for row in self._page_queryset(values, forward)]
+        return self._build_page(rows, values, forward)
+
+    def _build_page(self, rows, values, forward):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or not forward:
+                next_cursor = encode_cursor(self._row_values(rows[-1]), 'n')
+            if values is not None and (forward or has_more):
+                previous_cursor = encode_cursor(self._row_values(rows[0]), 'p')
+        return CursorPage(rows, self, next_cursor, previous_cursor)
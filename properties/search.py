@@ -0,0 +1,140 @@
+"""
+Bilingual full-text search over property listings.
+
+Each Property has a SearchDocument row holding pre-tokenized text: English
+words and numbers as-is (lowercased, NFKC-normalized so full-width digits
+match) and Chinese runs as overlapping bigrams, so 花蓮市中山路 is indexed as
+花蓮 蓮市 市中 中山 山路 and a query for 中山路 matches without a dictionary.
+
+The tokens are indexed by the database's own full-text engine:
+
+* SQLite: an external-content FTS5 table kept in sync by triggers, ranked
+  with bm25().
+* PostgreSQL: a stored, weighted tsvector column with a GIN index, ranked
+  with ts_rank().
+
+Both are created by migration 0012. Other backends are not supported.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+
+DOCUMENT_TABLE = 'properties_searchdocument'
+FTS_TABLE = 'properties_search_fts'
+
+# Property fields copied into each SearchDocument column
+DOCUMENT_FIELDS = {
+    'title_tokens': ('title',),
+    'location_tokens': ('city', 'address', 'postal_code'),
+    'body_tokens': ('description',),
+}
+SEARCH_FIELDS = tuple(name for fields in DOCUMENT_FIELDS.values() for name in fields)
+
+# Column weights: title > location > description
+FTS_WEIGHTS = (3.0, 2.0, 1.0)
+POSTGRES_VECTOR = (
+    "setweight(to_tsvector('simple', title_tokens), 'A') || "
+    "setweight(to_tsvector('simple', location_tokens), 'B') || "
+    "setweight(to_tsvector('simple', body_tokens), 'C')"
+)
+
+# Queries longer than this are truncated rather than rejected
+MAX_QUERY_TOKENS = 16
+
+# Kana, CJK Extension A, CJK Unified and Compatibility Ideographs
+CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+TOKEN_RE = re.compile(rf'[{CJK}]+|(?:(?![{CJK}])[^\W_])+')
+CJK_RE = re.compile(rf'[{CJK}]')
+
+
+def _runs(text):
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return TOKEN_RE.findall(text)
+
+
+def tokenize(text):
+    """Index tokens for ``text``: words, and bigrams of Chinese/Japanese runs"""
+    tokens = []
+    for run in _runs(text):
+        if CJK_RE.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def query_terms(text):
+    """
+    (token, is_prefix) pairs for a user query. The last word and any lone
+    CJK character match as prefixes, so 'hual' and 花 find 'Hualien' and 花蓮.
+    """
+    runs = _runs(text)
+    terms = []
+    for index, run in enumerate(runs):
+        is_cjk = CJK_RE.match(run) is not None
+        if is_cjk and len(run) > 1:
+            terms.extend((run[i:i + 2], False) for i in range(len(run) - 1))
+        else:
+            terms.append((run, is_cjk or index == len(runs) - 1))
+    return terms[:MAX_QUERY_TOKENS]
+
+
+def build_document(property):
+    """SearchDocument column values for ``property``"""
+    return {
+        column: ' '.join(token for name in fields for token in tokenize(getattr(property, name)))
+        for column, fields in DOCUMENT_FIELDS.items()
+    }
+
+
+def _fts_query(terms, column=None):
+    scope = f'{column} : ' if column else ''
+    return ' AND '.join(f'{scope}"{token}"{"*" if prefix else ""}' for token, prefix in terms)
+
+
+def _tsquery(terms, weight=''):
+    parts = []
+    for token, prefix in terms:
+        label = ('*' if prefix else '') + weight
+        parts.append(f"'{token}':{label}" if label else f"'{token}'")
+    return ' & '.join(parts)
+
+
+def _match_sql(terms, location_only):
+    """(SQL selecting matching property ids, SQL ranking one property, params)"""
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        match = _fts_query(terms, 'location_tokens' if location_only else None)
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        ids = f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+        # bm25() is lower for better matches
+        rank = (f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s AND rowid = properties_property.id')
+        return ids, rank, [match]
+    if vendor == 'postgresql':
+        tsquery = _tsquery(terms, 'B' if location_only else '')
+        ids = f"SELECT property_id FROM {DOCUMENT_TABLE} WHERE search_vector @@ to_tsquery('simple', %s)"
+        rank = (f"SELECT ts_rank(search_vector, to_tsquery('simple', %s)) FROM {DOCUMENT_TABLE} "
+                f"WHERE property_id = properties_property.id")
+        return ids, rank, [tsquery]
+    raise NotImplementedError(f'Full-text search is not available on {vendor}')
+
+
+def search(queryset, text, location_only=False, rank=False):
+    """
+    Restrict ``queryset`` to properties matching every term of ``text``,
+    optionally annotating a ``search_rank`` (higher is better).
+    ``location_only`` searches city, address and postal code only.
+    """
+    terms = query_terms(text)
+    if not terms:
+        return queryset
+    ids_sql, rank_sql, params = _match_sql(terms, location_only)
+    queryset = queryset.filter(pk__in=RawSQL(ids_sql, params))
+    if rank:
+        queryset = queryset.annotate(search_rank=RawSQL(rank_sql, params, output_field=FloatField()))
+    return queryset
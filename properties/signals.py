@@ -0,0 +1,216 @@
+"""
+Model signal handlers that keep denormalized data and caches in sync.
+
+Signals (rather than overriding save()/delete()) also catch queryset
+deletes such as the admin "delete selected" action.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import clusters, facets, search
+from .autocomplete import LOCATION_FIELDS, location_index
+from .cache import invalidate_tags
+from .counts import COUNT_FIELDS, COUNT_TAG
+from .images import delete_variants, variants_refreshed
+from .jobs import enqueue
+from .models import Agent, AgentStats, Company, Property, PropertyImage, SearchDocument
+
+
+# Image fields that get responsive variants, see properties.images
+IMAGE_VARIANT_FIELDS = {
+    PropertyImage: 'image',
+    Agent: 'photo',
+    Company: 'hero_image',
+}
+
+
+@receiver(post_save, sender=PropertyImage)
+@receiver(post_delete, sender=PropertyImage)
+def sync_property_image_summary(sender, instance, **kwargs):
+    """Refresh primary_image/image_count whenever an image is added, edited or removed"""
+    # Only the pk is needed; during a cascade delete the row is removed right after anyway
+    Property(pk=instance.property_id).refresh_image_summary()
+    invalidate_tags(f'property:{instance.property_id}')
+
+
+@receiver(post_save, sender=Property)
+@receiver(post_delete, sender=Property)
+def invalidate_property_pages(sender, instance, **kwargs):
+    # Any change can move a property in or out of a listing page
+    tags = {f'property:{instance.pk}', 'property_list'}
+    previous_agent_id = getattr(instance, '_loaded_values', {}).get('agent_id')
+    for agent_id in (instance.agent_id, previous_agent_id):
+        if agent_id:
+            tags.add(f'agent_listings:{agent_id}')
+    invalidate_tags(*tags)
+
+
+@receiver(post_save, sender=Agent)
+@receiver(post_delete, sender=Agent)
+def invalidate_agent_pages(sender, instance, **kwargs):
+    invalidate_tags(f'agent:{instance.pk}', 'agent_list')
+
+
+@receiver(post_save, sender=User)
+def invalidate_agent_user_pages(sender, instance, update_fields=None, **kwargs):
+    """Agent pages show the user's name and email"""
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    agent_id = Agent.objects.filter(user=instance).values_list('pk', flat=True).first()
+    if agent_id:
+        invalidate_tags(f'agent:{agent_id}', 'agent_list')
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def invalidate_company_pages(sender, instance, **kwargs):
+    invalidate_tags('company')
+
+
+@receiver(post_save, sender=PropertyImage)
+@receiver(post_save, sender=Agent)
+@receiver(post_save, sender=Company)
+def generate_image_variants(sender, instance, raw=False, **kwargs):
+    """Queue resizing of newly uploaded or replaced photos into srcset variants"""
+    if raw:
+        return
+    field_name = IMAGE_VARIANT_FIELDS[sender]
+    fieldfile = getattr(instance, field_name)
+    current = getattr(instance, f'{field_name}_variants') or {}
+    if (fieldfile.name or None) == current.get('source'):
+        return
+    enqueue(
+        'properties.tasks.generate_image_variants',
+        model=sender._meta.label,
+        pk=instance.pk,
+        field=field_name,
+    )
+
+
+@receiver(variants_refreshed, sender=PropertyImage)
+@receiver(variants_refreshed, sender=Agent)
+@receiver(variants_refreshed, sender=Company)
+def invalidate_variant_pages(sender, instance, **kwargs):
+    """Pages and cards rendered before the variants existed show the full-size original"""
+    if sender is PropertyImage:
+        invalidate_tags(f'property:{instance.property_id}', 'property_list')
+    elif sender is Agent:
+        invalidate_tags(f'agent:{instance.pk}', 'agent_list')
+    else:
+        invalidate_tags('company')
+
+
+@receiver(post_delete, sender=PropertyImage)
+@receiver(post_delete, sender=Agent)
+@receiver(post_delete, sender=Company)
+def delete_image_variants(sender, instance, **kwargs):
+    field_name = IMAGE_VARIANT_FIELDS[sender]
+    delete_variants(getattr(instance, field_name).storage, getattr(instance, f'{field_name}_variants'))
+
+
+# Fields whose pre-save values the post_save handlers below diff against
+TRACKED_FIELDS = tuple(dict.fromkeys(
+    ('agent_id',) + clusters.CLUSTER_FIELDS + LOCATION_FIELDS + COUNT_FIELDS + facets.FACET_FIELDS
+))
+
+
+@receiver(pre_save, sender=Property)
+def remember_tracked_fields(sender, instance, raw=False, **kwargs):
+    """Make sure the pre-save tracked fields are known, e.g. for instances loaded with only()"""
+    if raw or instance._state.adding:
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if not all(name in loaded for name in TRACKED_FIELDS):
+        previous = Property.objects.filter(pk=instance.pk).values(*TRACKED_FIELDS).first() or {}
+        instance._loaded_values = {**loaded, **previous}
+
+
+@receiver(post_save, sender=Property)
+def invalidate_search_counts(sender, instance, created=False, raw=False, **kwargs):
+    """Cached property_list counts only depend on the fields filters look at"""
+    loaded = getattr(instance, '_loaded_values', {})
+    if not (created or raw) and all(name in loaded and loaded[name] == getattr(instance, name) for name in COUNT_FIELDS):
+        return
+    invalidate_tags(COUNT_TAG)
+
+
+@receiver(post_delete, sender=Property)
+def remove_from_search_counts(sender, instance, **kwargs):
+    invalidate_tags(COUNT_TAG)
+
+
+@receiver(post_save, sender=Property)
+def update_map_clusters(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    old = None if created else clusters.contribution(getattr(instance, '_loaded_values', {}))
+    new = clusters.contribution({name: getattr(instance, name) for name in clusters.CLUSTER_FIELDS})
+    clusters.apply_change(old, new)
+
+
+@receiver(post_delete, sender=Property)
+def remove_from_map_clusters(sender, instance, **kwargs):
+    clusters.apply_change(clusters.contribution({name: getattr(instance, name) for name in clusters.CLUSTER_FIELDS}), None)
+
+
+@receiver(post_save, sender=Property)
+def update_facet_counts(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    old = None if created else facets.contribution(getattr(instance, '_loaded_values', {}))
+    new = facets.contribution({name: getattr(instance, name) for name in facets.FACET_FIELDS})
+    facets.apply_change(old, new)
+
+
+@receiver(post_delete, sender=Property)
+def remove_from_facet_counts(sender, instance, **kwargs):
+    facets.apply_change(facets.contribution({name: getattr(instance, name) for name in facets.FACET_FIELDS}), None)
+
+
+@receiver(post_save, sender=Property)
+def update_search_document(sender, instance, created=False, raw=False, **kwargs):
+    """Re-tokenize the listing when any searchable text changed"""
+    if raw:
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if not created and all(name in loaded and loaded[name] == getattr(instance, name) for name in search.SEARCH_FIELDS):
+        return
+    SearchDocument.objects.update_or_create(property=instance, defaults=search.build_document(instance))
+
+
+@receiver(post_save, sender=Property)
+def update_location_index(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    old = {} if created else getattr(instance, '_loaded_values', {})
+    new = {name: getattr(instance, name) for name in LOCATION_FIELDS}
+    transaction.on_commit(lambda: location_index.apply_change(instance.pk, old, new))
+
+
+@receiver(post_delete, sender=Property)
+def remove_from_location_index(sender, instance, **kwargs):
+    old = {name: getattr(instance, name) for name in LOCATION_FIELDS}
+    pk = instance.pk
+    transaction.on_commit(lambda: location_index.apply_change(pk, old, {}))
+
+
+@receiver(post_save, sender=Property)
+def update_agent_stats(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    old = None if created else (loaded.get('agent_id'), loaded.get('status'))
+    new = (instance.agent_id, instance.status)
+    if old != new:
+        AgentStats.apply_change(old, new)
+        # The agent directory shows listing counts
+        invalidate_tags('agent_list')
+
+
+@receiver(post_delete, sender=Property)
+def remove_from_agent_stats(sender, instance, **kwargs):
+    AgentStats.apply_change((instance.agent_id, instance.status), None)
+    if instance.agent_id:
+        invalidate_tags('agent_list')
@@ -0,0 +1,79 @@
+"""
+Background tasks run through properties.jobs.
+
+Tasks receive JSON payloads as keyword arguments and must be safe to run
+more than once: a worker can die after doing the work but before the job
+is marked finished, in which case the job is delivered again.
+"""
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from core.storage_backends import save_many
+
+from .images import is_image, refresh_variants
+from .models import Property, PropertyImage, StagedUpload
+
+
+logger = logging.getLogger(__name__)
+
+
+def store_property_images(property_id, files):
+    """
+    Move staged uploads into media storage as PropertyImage rows.
+    ``files`` is a list of ``{'staged_id', 'order', 'is_primary'}`` dicts.
+    """
+    property = Property.objects.filter(pk=property_id).first()
+    if property is None:
+        StagedUpload.objects.filter(pk__in=[entry['staged_id'] for entry in files]).delete()
+        return
+
+    # Upload a pool's worth of files at a time (concurrently on S3), then
+    # record them, so only one chunk of blobs is held in memory
+    chunk_size = getattr(settings, 'AWS_S3_UPLOAD_WORKERS', 8)
+    for start in range(0, len(files), chunk_size):
+        _store_chunk(property, files[start:start + chunk_size])
+
+
+def _store_chunk(property, files):
+    # Uploads already stored by an earlier delivery of the job are gone from staging
+    staged = StagedUpload.objects.in_bulk([entry['staged_id'] for entry in files])
+    field = PropertyImage._meta.get_field('image')
+    images, uploads = [], []
+    for entry in files:
+        upload = staged.get(entry['staged_id'])
+        if upload is None:
+            continue
+        image = PropertyImage(property=property, order=entry['order'], is_primary=entry['is_primary'])
+        images.append((upload.pk, image))
+        uploads.append((field.generate_filename(image, upload.name), ContentFile(bytes(upload.data))))
+    names = save_many(field.storage, uploads)
+
+    for (staged_id, image), name in zip(images, names):
+        # Each file commits on its own, so a retry skips the ones already stored
+        with transaction.atomic():
+            if not StagedUpload.objects.select_for_update().filter(pk=staged_id).exists():
+                # Another delivery of this job stored it meanwhile
+                field.storage.delete(name)
+                continue
+            image.image = name
+            image.save()
+            StagedUpload.objects.filter(pk=staged_id).delete()
+
+
+def generate_image_variants(model, pk, field):
+    """Render responsive variants for ``model`` (an app label path) row ``pk``"""
+    instance = apps.get_model(model).objects.filter(pk=pk).first()
+    if instance is None:
+        return
+    fieldfile = getattr(instance, field)
+    if isinstance(instance, PropertyImage) and fieldfile and not is_image(fieldfile):
+        # Direct uploads only had their declared Content-Type checked
+        logger.warning('Removing %s: not an image', fieldfile.name)
+        fieldfile.storage.delete(fieldfile.name)
+        instance.delete()
+        return
+    refresh_variants(instance, field)
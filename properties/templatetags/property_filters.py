@@ -1,4 +1,13 @@
 from django import template
+from django.conf import settings
+from django.template.defaultfilters import floatformat
+from django.template.loader import get_template
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+from properties.cache import render_fragments
+from properties.images import pick_variant
 
 register = template.Library()
 
@@ -35,3 +44,84 @@ def get_listing_text(listing_type):
     elif listing_type == 'rent':
         return '蒩蒩 /FOR RENT'
     return 'AVAILABLE'
+
+def _variant_data(fieldfile):
+    """The ``<field>_variants`` JSON stored alongside an image field"""
+    instance = getattr(fieldfile, 'instance', None)
+    field = getattr(fieldfile, 'field', None)
+    if instance is None or field is None:
+        return None
+    return getattr(instance, f'{field.name}_variants', None)
+
+@register.filter
+def variant_url(fieldfile, variant='card'):
+    """URL of a resized WebP variant, falling back to the original upload"""
+    if not fieldfile:
+        return ''
+    entry = pick_variant(_variant_data(fieldfile), variant)
+    if entry:
+        return fieldfile.storage.url(entry['webp'])
+    return fieldfile.url
+
+@register.simple_tag
+def responsive_image(fieldfile, variant='card', sizes='100vw', alt='', css_class='', loading='lazy'):
+    """
+    Render a <picture> with WebP and JPEG srcsets built from the stored
+    variants; ``variant`` picks the fallback <img src>. Images without
+    variants (not generated yet) render as a plain <img> of the original.
+    """
+    if not fieldfile:
+        return ''
+    data = _variant_data(fieldfile)
+    entry = pick_variant(data, variant)
+    if not entry:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="{}" decoding="async">',
+            fieldfile.url, alt, css_class, loading,
+        )
+
+    variants = sorted(data['variants'].values(), key=lambda item: item['width'])
+    storage = fieldfile.storage
+
+    def srcset(key):
+        return ', '.join(f"{storage.url(item[key])} {item['width']}w" for item in variants)
+
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" loading="{}" decoding="async">'
+        '</picture>',
+        srcset('webp'), sizes,
+        storage.url(entry['jpeg']), srcset('jpeg'), sizes, entry['width'], entry['height'], alt, css_class, loading,
+    )
+
+@register.simple_tag
+def property_cards(properties, template_name='includes/_property_card.html', **options):
+    """
+    Render ``template_name`` once per property (with ``property`` and
+    ``options`` in its context) and join the cards. Each card is a cached
+    fragment keyed on (pk, updated_at, language) and dropped when the
+    ``property:<pk>`` or ``agent:<pk>`` tag changes, e.g. once photo
+    variants are generated; the whole grid is one cache get_many().
+    """
+    card = get_template(template_name)
+
+    def render(property):
+        return card.render({'property': property, **options})
+
+    if not getattr(settings, 'CARD_CACHE_ENABLED', True):
+        return mark_safe(''.join(render(property) for property in properties))
+
+    language = get_language()
+    variant = f"{template_name}|{sorted(options.items())}"
+    items = []
+    for property in properties:
+        key = f'{variant}|{property.pk}|{property.updated_at.isoformat()}|{language}'
+        # Geo searches show a per-search distance on the card
+        distance = getattr(property, 'distance_km', None)
+        if distance is not None:
+            key += f'|{floatformat(distance, 1)}'
+        tags = [f'property:{property.pk}']
+        if property.agent_id:
+            tags.append(f'agent:{property.agent_id}')
+        items.append((key, tags, property))
+    return mark_safe(''.join(render_fragments(items, render)))
@@ -1,3 +1,1443 @@
-from django.test import TestCase
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from botocore.exceptions import ClientError
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.template.backends.django import Template as BackendTemplate
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone, translation
+from PIL import Image
+
+from .jobs import claim_job, enqueue, run_job
+from .models import Agent, AgentStats, Company, Job, MapCluster, Property, PropertyImage, StagedUpload, _company_cache
+from .pagination import KeysetPaginator, get_ordering
+
+
+def make_property(**kwargs):
+    defaults = {
+        'title': 'Test Property',
+        'description': 'A test listing',
+        'price': Decimal('1000000'),
+        'property_type': 'house',
+        'address': '1 Zhongshan Rd',
+        'area_sqm': Decimal('100'),
+    }
+    defaults.update(kwargs)
+    return Property.objects.create(**defaults)
+
+
+def make_agent(username='agent', **kwargs):
+    user = User.objects.create_user(username=username, password='pass', first_name='Mei', last_name='Lin')
+    kwargs.setdefault('phone', '0912345678')
+    kwargs.setdefault('is_authorized', True)
+    return Agent.objects.create(user=user, **kwargs)
+
+
+def make_image_file(name='photo.jpg', size=(300, 200)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (40, 90, 160)).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+def make_image(property, **kwargs):
+    kwargs.setdefault('image', make_image_file())
+    return PropertyImage.objects.create(property=property, **kwargs)
+
+
+def make_s3_storage(storage_class, **options):
+    """``storage_class`` on a test bucket; nothing connects until a request is made"""
+    options.setdefault('bucket_name', 'estate-agency-test')
+    options.setdefault('access_key', 'testing')
+    options.setdefault('secret_key', 'testing')
+    options.setdefault('region_name', 'us-east-1')
+    return storage_class(**options)
+
+
+class TempMediaMixin:
+    """Stores the class's uploads under its own MEDIA_ROOT, deleted afterwards"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp(prefix='estate_agency_test_media_')
+        cls._media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls._media_settings.enable()
+        try:
+            super().setUpClass()
+        except Exception:
+            cls._remove_media()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._remove_media()
+
+    @classmethod
+    def _remove_media(cls):
+        cls._media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Duplicate prices force the pk tiebreaker to do its job
+        for i in range(20):
+            make_property(title=f'Listing {i}', price=Decimal(1000 * (i % 5)), area_sqm=Decimal(50 + i))
+
+    def walk(self, sort_by):
+        paginator = KeysetPaginator(Property.objects.all(), 6, get_ordering(sort_by))
+        pages, page = [], paginator.get_page()
+        pages.append([p.pk for p in page])
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            pages.append([p.pk for p in page])
+        return paginator, pages
+
+    def test_forward_walk_matches_offset_ordering(self):
+        for sort_by, ordering in [('newest', ('-created_at', '-pk')), ('price_low', ('price', 'pk')),
+                                  ('price_high', ('-price', '-pk')), ('sqft', ('-area_sqm', '-pk'))]:
+            _, pages = self.walk(sort_by)
+            expected = list(Property.objects.order_by(*ordering).values_list('pk', flat=True))
+            self.assertEqual([pk for page in pages for pk in page], expected, sort_by)
+            self.assertEqual([len(p) for p in pages], [6, 6, 6, 2])
+
+    def test_previous_cursor_returns_prior_page(self):
+        paginator, pages = self.walk('price_low')
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        self.assertFalse(first.has_previous())
+        back = paginator.get_page(second.previous_cursor)
+        self.assertEqual([p.pk for p in back], pages[0])
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        paginator, pages = self.walk('newest')
+        self.assertEqual([p.pk for p in paginator.get_page('not-a-cursor')], pages[0])
+
+    def test_property_list_renders_cursor_links(self):
+        response = self.client.get(reverse('properties:property_list'), {'sort_by': 'price_low'})
+        self.assertEqual(response.status_code, 200)
+        next_cursor = response.context['page_obj'].next_cursor
+        self.assertContains(response, f'cursor={next_cursor}')
+        response = self.client.get(reverse('properties:property_list'), {'sort_by': 'price_low', 'cursor': next_cursor})
+        self.assertTrue(response.context['page_obj'].has_previous())
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class CardGridQueryCountTests(TempMediaMixin, TestCase):
+    """
+    Listing grids must run a fixed number of queries no matter how many cards
+    they render. Each test renders the page, adds more cards, and compares.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agent = make_agent()
+        cls.other_agent = make_agent('other')
+
+    def add_cards(self, count, **kwargs):
+        for i in range(count):
+            agent = self.agent if i % 2 else self.other_agent
+            property = make_property(agent=kwargs.get('agent', agent), featured=True)
+            make_image(property, order=1)
+            make_image(property, order=0, is_primary=True)
+
+    def assertQueriesConstant(self, url, **kwargs):
+        self.add_cards(2, **kwargs)
+        self.client.get(url)  # warm up one-off work such as creating the Company row
+        with CaptureQueriesContext(connection) as baseline:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_cards(4, **kwargs)
+        with CaptureQueriesContext(connection) as grown:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(
+            len(grown), len(baseline),
+            'Query count grew with the number of cards:\n' + '\n'.join(q['sql'] for q in grown.captured_queries),
+        )
+
+    def test_home(self):
+        self.assertQueriesConstant(reverse('properties:home'))
+
+    def test_property_list(self):
+        self.assertQueriesConstant(reverse('properties:property_list'))
+
+    def test_agent_profile(self):
+        self.assertQueriesConstant(reverse('properties:agent_profile', args=[self.agent.pk]), agent=self.agent)
+
+    def test_agent_dashboard(self):
+        self.client.login(username='agent', password='pass')
+        self.assertQueriesConstant(reverse('properties:agent_dashboard'), agent=self.agent)
+
+
+
+class ImageSummaryTests(TempMediaMixin, TestCase):
+    def test_summary_follows_image_changes(self):
+        property = make_property()
+        first = make_image(property, order=0)
+        property.refresh_from_db()
+        self.assertEqual((property.primary_image, property.image_count), (first, 1))
+
+        flagged = make_image(property, order=3, is_primary=True)
+        property.refresh_from_db()
+        self.assertEqual((property.primary_image, property.image_count), (flagged, 2))
+
+        flagged.is_primary = False
+        flagged.save()
+        property.refresh_from_db()
+        self.assertEqual(property.primary_image, first)
+
+        PropertyImage.objects.filter(pk=first.pk).delete()
+        property.refresh_from_db()
+        self.assertEqual((property.primary_image, property.image_count), (flagged, 1))
+
+        flagged.delete()
+        property.refresh_from_db()
+        self.assertEqual((property.primary_image, property.image_count), (None, 0))
+
+    def test_backfill_command(self):
+        property = make_property()
+        image = make_image(property)
+        Property.objects.filter(pk=property.pk).update(primary_image=None, image_count=0)
+        call_command('backfill_image_summary', stdout=StringIO())
+        property.refresh_from_db()
+        self.assertEqual((property.primary_image, property.image_count), (image, 1))
+
+
+class IndexAdvisorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from properties import benchmark
+        # Planners only prefer indexes once the table has rows and statistics
+        benchmark.seed(400, agent_count=4, images_per_listing=0, batch_size=100, random_seed=3)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_no_search_combination_scans_the_table(self):
+        out = StringIO()
+        call_command('index_advisor', '--fail-on-scan', stdout=out)
+        self.assertIn('0 full scan(s)', out.getvalue())
+
+    def test_scans_are_detected_in_real_plans(self):
+        from properties.management.commands.index_advisor import analyze_plan
+        table = Property._meta.db_table
+        scan = analyze_plan(Property.objects.filter(description__contains='sea').explain(), table, connection.vendor)
+        self.assertTrue(scan['full_scan'])
+        lookup = analyze_plan(Property.objects.filter(status='available', city='Hualien').explain(), table, connection.vendor)
+        self.assertFalse(lookup['full_scan'])
+        self.assertTrue(lookup['indexes'])
+
+    def test_analyze_plan_text(self):
+        from properties.management.commands.index_advisor import analyze_plan
+        sqlite = analyze_plan(
+            'QUERY PLAN\n`--SCAN properties_property\n`--USE TEMP B-TREE FOR ORDER BY', 'properties_property', 'sqlite',
+        )
+        self.assertEqual(sqlite, {'full_scan': True, 'sorts': True, 'indexes': []})
+        postgres = analyze_plan(
+            'Limit\n  ->  Index Scan Backward using property_status_created_idx on properties_property\n'
+            '        Filter: (bedrooms >= 3)',
+            'properties_property', 'postgresql',
+        )
+        self.assertEqual(postgres, {'full_scan': False, 'sorts': False, 'indexes': ['property_status_created_idx']})
+        self.assertTrue(analyze_plan('Seq Scan on properties_property', 'properties_property', 'postgresql')['full_scan'])
+
+
+class CompanyCacheTests(TestCase):
+    def setUp(self):
+        _company_cache['obj'] = None
+        self.addCleanup(_company_cache.update, {'obj': None})
+
+    def test_cached_instance_needs_no_queries(self):
+        Company.get_cached()
+        with self.assertNumQueries(0):
+            self.assertEqual(Company.get_cached().pk, 1)
+
+    def test_save_invalidates(self):
+        company = Company.get_cached()
+        company.name = 'Hualien Homes'
+        company.save()
+        self.assertEqual(Company.get_cached().name, 'Hualien Homes')
+
+    def test_context_processor_is_lazy(self):
+        from .context_processors import company_info
+
+        with self.assertNumQueries(0):
+            context = company_info(None)
+        self.assertEqual(context['company'].pk, 1)
+
+
+class PageCacheTests(TempMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agent = make_agent()
+        cls.property = make_property(agent=cls.agent, title='Seaside Villa')
+        cls.other = make_property(title='Mountain Cabin')
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url, **kwargs):
+        return self.client.get(url, **kwargs)
+
+    def test_anonymous_hit_and_precise_invalidation(self):
+        detail = reverse('properties:property_detail', args=[self.property.pk])
+        other_detail = reverse('properties:property_detail', args=[self.other.pk])
+        self.assertEqual(self.get(detail)['X-Page-Cache'], 'miss')
+        self.get(other_detail)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(detail)['X-Page-Cache'], 'hit')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.property.title = 'Seaside Villa II'
+            self.property.save()
+        response = self.get(detail)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Seaside Villa II')
+        self.assertEqual(self.get(other_detail)['X-Page-Cache'], 'hit')
+
+    def test_agent_change_invalidates_agent_pages(self):
+        profile = reverse('properties:agent_profile', args=[self.agent.pk])
+        self.get(profile)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.agent.specialization = 'Luxury homes'
+            self.agent.save()
+        self.assertEqual(self.get(profile)['X-Page-Cache'], 'miss')
+
+    def test_key_normalizes_query_and_varies_by_language(self):
+        url = reverse('properties:property_list')
+        self.get(url + '?sort_by=price_low&bedrooms=&utm_source=x')
+        self.assertEqual(self.get(url + '?sort_by=price_low')['X-Page-Cache'], 'hit')
+        self.assertEqual(self.get(url + '?sort_by=price_low', HTTP_ACCEPT_LANGUAGE='en')['X-Page-Cache'], 'miss')
+
+    def test_csrf_token_is_not_shared(self):
+        url = reverse('properties:about')
+        first = self.get(url).content.decode()
+        self.client.cookies.clear()
+        second = self.get(url)
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertNotIn('__PAGE_CACHE_CSRF_TOKEN__', second.content.decode())
+        self.assertIn('csrftoken', second.cookies)
+        self.assertNotEqual(first, second.content.decode())
+
+    def test_authenticated_users_bypass_cache(self):
+        self.client.login(username='agent', password='pass')
+        self.assertFalse(self.get(reverse('properties:home')).has_header('X-Page-Cache'))
+
+
+@override_settings(JOBS_EAGER=True)
+class ImageVariantTests(TempMediaMixin, TestCase):
+    def test_upload_generates_variants_and_srcset(self):
+        property = make_property()
+        image = make_image(property, image=make_image_file(size=(1600, 1200)))
+        image.refresh_from_db()
+        variants = image.image_variants['variants']
+        self.assertEqual(sorted(variants), ['card', 'full', 'gallery', 'thumb'])
+        self.assertEqual((variants['thumb']['width'], variants['gallery']['width']), (160, 1280))
+        self.assertTrue(image.image.storage.exists(variants['card']['webp']))
+
+        html = Template("{% load property_filters %}{% responsive_image image.image 'card' sizes='50vw' %}").render(
+            Context({'image': image})
+        )
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(' 160w', html)
+        self.assertIn('_card.jpg', html)
+
+    def test_small_originals_skip_duplicate_sizes(self):
+        image = make_image(make_property(), image=make_image_file(size=(120, 90)))
+        image.refresh_from_db()
+        self.assertEqual(list(image.image_variants['variants']), ['thumb'])
+
+    def test_deleting_removes_variant_files(self):
+        self.addCleanup(_company_cache.update, {'obj': None})
+        image = make_image(make_property(), image=make_image_file(size=(1600, 1200)))
+        company = Company.get_instance()
+        company.hero_image = make_image_file('hero.jpg', size=(1600, 900))
+        company.save()
+        for instance, field_name in ((image, 'image'), (company, 'hero_image')):
+            instance.refresh_from_db()
+            storage = getattr(instance, field_name).storage
+            paths = [entry['webp'] for entry in getattr(instance, f'{field_name}_variants')['variants'].values()]
+            self.assertTrue(all(storage.exists(path) for path in paths))
+            instance.delete()
+            self.assertFalse(any(storage.exists(path) for path in paths), field_name)
+
+
+def failing_task(**kwargs):
+    raise RuntimeError('boom')
+
+
+@override_settings(JOBS_EAGER=False)
+class JobQueueTests(TempMediaMixin, TestCase):
+    def test_create_view_stages_uploads_for_the_worker(self):
+        agent = make_agent()
+        self.client.login(username='agent', password='pass')
+        response = self.client.post(reverse('properties:property_create'), {
+            'title': 'Queued', 'description': 'x', 'price': '1000000', 'property_type': 'house',
+            'listing_type': 'sale', 'status': 'available', 'address': '1 Zhongshan Rd', 'city': 'Hualien',
+            'bedrooms': 3, 'bathrooms': 2, 'area_sqm': '100', 'parking_spaces': 1,
+            'images': [make_image_file('a.jpg'), make_image_file('b.jpg')],
+        })
+        self.assertEqual(response.status_code, 302)
+        property = Property.objects.get(agent=agent)
+        self.assertEqual(property.image_count, 0)
+        self.assertEqual(StagedUpload.objects.count(), 2)
+
+        call_command('run_jobs', burst=True, stdout=StringIO())
+        property.refresh_from_db()
+        self.assertEqual(property.image_count, 2)
+        self.assertTrue(property.primary_image.is_primary)
+        self.assertEqual(property.primary_image.image_variants['variants']['thumb']['width'], 160)
+        self.assertFalse(StagedUpload.objects.exists())
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(AWS_S3_UPLOAD_WORKERS=2)
+    def test_staged_uploads_are_stored_in_bounded_chunks(self):
+        from . import tasks
+        from .views import queue_property_images
+        property = make_property()
+        queue_property_images(property, [make_image_file(f'{i}.jpg') for i in range(5)])
+        # An earlier delivery already stored the first file
+        tasks.store_property_images(property.pk, Job.objects.get().payload['files'][:1])
+        with mock.patch.object(tasks, 'save_many', wraps=tasks.save_many) as save_many:
+            call_command('run_jobs', burst=True, stdout=StringIO())
+        self.assertEqual([len(call.args[1]) for call in save_many.call_args_list], [1, 2, 1])
+        self.assertEqual(PropertyImage.objects.filter(property=property).count(), 5)
+        self.assertFalse(StagedUpload.objects.exists())
+
+    def test_failed_job_backs_off_then_gives_up(self):
+        job = enqueue('properties.tests.failing_task', max_attempts=2)
+        claimed = claim_job('w1')
+        self.assertEqual((claimed.pk, claimed.attempts), (job.pk, 1))
+        with self.assertLogs('properties.jobs', 'WARNING'):
+            self.assertFalse(run_job(claimed, 'w1'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertIn('RuntimeError', job.last_error)
+        # Not due until the backoff passes
+        self.assertIsNone(claim_job('w1'))
+
+        Job.objects.filter(pk=job.pk).update(run_after=job.created_at)
+        with self.assertLogs('properties.jobs', 'WARNING'):
+            self.assertFalse(run_job(claim_job('w1'), 'w1'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_expired_claim_is_redelivered(self):
+        job = enqueue('properties.tests.failing_task')
+        self.assertIsNotNone(claim_job('w1', visibility_timeout=60))
+        self.assertIsNone(claim_job('w2', visibility_timeout=60))
+
+        Job.objects.filter(pk=job.pk).update(locked_until=job.created_at)
+        redelivered = claim_job('w2', visibility_timeout=60)
+        self.assertEqual((redelivered.locked_by, redelivered.attempts), ('w2', 2))
+        # The original worker no longer owns the job and cannot settle it
+        Job.objects.filter(pk=job.pk).update(run_after=job.created_at)
+        with self.assertLogs('properties.jobs', 'WARNING'):
+            run_job(Job(pk=job.pk, task=job.task, attempts=1, max_attempts=5), 'w1')
+        self.assertEqual(Job.objects.get(pk=job.pk).locked_by, 'w2')
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class GeoSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Around Hualien station, plus one listing in Taipei
+        cls.near = make_property(title='Near', latitude=Decimal('23.993'), longitude=Decimal('121.601'))
+        cls.mid = make_property(title='Mid', latitude=Decimal('24.010'), longitude=Decimal('121.620'))
+        cls.far = make_property(title='Far', latitude=Decimal('25.033'), longitude=Decimal('121.565'))
+        make_property(title='Unmapped')
+
+    def test_geohash_is_kept_in_sync(self):
+        from .geo import encode
+        self.assertEqual(encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.near.latitude = Decimal('24.100')
+        self.near.save(update_fields=['latitude'])
+        self.near.refresh_from_db()
+        self.assertEqual(self.near.geohash, encode(Decimal('24.100'), Decimal('121.601')))
+
+    def test_geohash_ranges_select_exactly_the_prefix(self):
+        from .clusters import cell_properties
+        from .geo import BASE32, PREFIX_END
+        # Far from the fixtures above; 'kpQ0' sorts before 'kpq' only in byte order
+        hashes = ['kpq', 'kpq0', 'kpqz', 'kpqzzzzzzzzz', 'kpp', 'kppzzzzzzzzz', 'kpr', 'kpr000000000', 'kp', 'kpQ0']
+        for geohash in hashes:
+            Property.objects.filter(pk=make_property().pk).update(geohash=geohash)
+        for prefix in ('kpq', 'kpp', 'kp', 'k'):
+            selected = Property.objects.filter(geohash__gte=prefix, geohash__lt=prefix + PREFIX_END)
+            expected = sorted(h for h in hashes if h.startswith(prefix))
+            self.assertEqual(sorted(selected.values_list('geohash', flat=True)), expected, prefix)
+            self.assertEqual(cell_properties(prefix).count(), len(expected))
+        self.assertTrue(all(char < PREFIX_END for char in BASE32))
+
+    def test_radius_search_sorts_by_distance(self):
+        response = self.client.get(reverse('properties:property_list'), {'lat': '23.9925', 'lng': '121.6010', 'radius_km': '5'})
+        titles = [p.title for p in response.context['page_obj']]
+        self.assertEqual(titles, ['Near', 'Mid'])
+        self.assertEqual(response.context['current_sort'], 'distance')
+        distances = [p.distance_km for p in response.context['page_obj']]
+        self.assertLess(distances[0], 0.1)
+        from .geo import haversine_km
+        self.assertAlmostEqual(distances[1], haversine_km(23.9925, 121.6010, 24.010, 121.620), delta=0.01)
+
+    def test_bbox_search_and_distance_cursor(self):
+        for i in range(10):
+            make_property(title=f'Box {i}', latitude=Decimal('24.0') + Decimal(i) / 1000, longitude=Decimal('121.61'))
+        params = {'bbox': '23.9,121.5,24.1,121.7'}
+        first = self.client.get(reverse('properties:property_list'), params).context['page_obj']
+        second = self.client.get(reverse('properties:property_list'), {**params, 'cursor': first.next_cursor}).context['page_obj']
+        seen = [p.pk for p in first] + [p.pk for p in second]
+        self.assertEqual(len(seen), 12)
+        self.assertNotIn(self.far.pk, seen)
+        distances = [p.distance_km for p in first] + [p.distance_km for p in second]
+        self.assertEqual(distances, sorted(distances))
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class MapClusterTests(TestCase):
+    def assertClustersMatchRebuild(self):
+        from . import clusters
+        incremental = set(MapCluster.objects.values_list('precision', 'cell', 'count', 'min_price', 'max_price'))
+        clusters.rebuild()
+        rebuilt = set(MapCluster.objects.values_list('precision', 'cell', 'count', 'min_price', 'max_price'))
+        self.assertEqual(incremental, rebuilt)
+
+    def test_saves_update_aggregates_incrementally(self):
+        a = make_property(price=Decimal('100'), latitude=Decimal('23.990'), longitude=Decimal('121.600'))
+        b = make_property(price=Decimal('300'), latitude=Decimal('23.991'), longitude=Decimal('121.601'))
+        make_property(price=Decimal('200'), latitude=Decimal('25.033'), longitude=Decimal('121.565'))
+        self.assertClustersMatchRebuild()
+
+        # Price, move, status change and delete, including loads that defer the map fields
+        b.price = Decimal('50')
+        b.save()
+        a = Property.objects.only('pk', 'title').get(pk=a.pk)
+        a.latitude, a.longitude = Decimal('24.500'), Decimal('121.000')
+        a.save()
+        self.assertClustersMatchRebuild()
+        b.status = 'sold'
+        b.save()
+        Property.objects.get(pk=a.pk).delete()
+        self.assertClustersMatchRebuild()
+        self.assertEqual(MapCluster.objects.get(precision=1).count, 1)
+
+    def test_endpoint_returns_clusters_for_viewport(self):
+        for i in range(5):
+            make_property(price=Decimal(100 + i), latitude=Decimal('23.99') + Decimal(i) / 10000, longitude=Decimal('121.60'))
+        make_property(latitude=Decimal('25.033'), longitude=Decimal('121.565'))
+        url = reverse('properties:map_clusters')
+
+        data = self.client.get(url, {'zoom': 8, 'bbox': '23.5,121.0,24.5,122.0'}).json()
+        self.assertEqual(data['total'], 5)
+        self.assertEqual(len(data['clusters']), 1)
+        cluster = data['clusters'][0]
+        self.assertEqual((cluster['count'], cluster['min_price'], cluster['max_price']), (5, 100.0, 104.0))
+        self.assertAlmostEqual(cluster['latitude'], 23.9902, places=4)
+
+        data = self.client.get(url, {'zoom': 3, 'bbox': '20,118,27,124'}).json()
+        self.assertEqual(data['total'], 6)
+        self.assertEqual(self.client.get(url, {'zoom': 'x', 'bbox': '1,2'}).status_code, 400)
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class FullTextSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.hualien = make_property(
+            title='Sea view apartment', description='Quiet street near the harbour',
+            address='花蓮市中山路１２３號', city='Hualien', postal_code='970',
+        )
+        cls.taipei = make_property(
+            title='Downtown loft', description='Ocean of cafes; sea breeze not included',
+            address='台北市信義路五段7號', city='Taipei', postal_code='110',
+        )
+        cls.sold = make_property(title='Sea cottage', address='花蓮市中正路1號', city='Hualien', status='sold')
+
+    def results(self, **params):
+        response = self.client.get(reverse('properties:property_list'), params)
+        return [p.pk for p in response.context['page_obj']], response.context
+
+    def test_tokenizer_bigrams_chinese_and_normalizes_width(self):
+        from .search import tokenize
+        self.assertEqual(tokenize('花蓮市 中山路１２３號, Hualien'), ['花蓮', '蓮市', '中山', '山路', '123', '號', 'hualien'])
+
+    def test_location_filter_matches_chinese_and_english_prefixes(self):
+        self.assertEqual(self.results(location='中山路')[0], [self.hualien.pk])
+        self.assertEqual(self.results(location='hual')[0], [self.hualien.pk])
+        self.assertEqual(self.results(location='970')[0], [self.hualien.pk])
+        # Description text is not a location
+        self.assertEqual(self.results(location='harbour')[0], [])
+
+    def test_location_filter_matches_words_whatever_other_listings_hold(self):
+        # Word middles don't match, whether or not another listing has a word starting with them
+        self.assertEqual(self.results(location='lien')[0], [])
+        lienchiang = make_property(address='1 Jieshou Rd', city='Lienchiang')
+        self.assertEqual(self.results(location='lien')[0], [lienchiang.pk])
+        self.assertEqual(self.results(location='nowhere')[0], [])
+
+    def test_location_filter_matches_lone_chinese_characters_as_substrings(self):
+        self.assertEqual(sorted(self.results(location='路')[0]), sorted([self.hualien.pk, self.taipei.pk]))
+        make_property(address='路竹區1號', city='Kaohsiung')
+        self.assertEqual(len(self.results(location='路')[0]), 3)
+
+    def test_location_filter_runs_no_query_while_building(self):
+        from .filters import filter_properties
+        with self.assertNumQueries(0):
+            for location in ('hual', 'lien', '路', '中山路'):
+                filter_properties(Property.objects.all(), {'location': location})
+
+    def test_property_search_runs_no_query(self):
+        # The async property_list calls it on the event loop
+        from .views import property_search
+        with self.assertNumQueries(0):
+            property_search({
+                'q': 'sea', 'location': 'hual', 'listing_type': 'sale', 'property_type': 'house,apartment',
+                'min_price': '1', 'max_price': '9', 'bedrooms': '1', 'bathrooms': '1',
+                'lat': '23.99', 'lng': '121.6', 'radius_km': '5', 'bbox': '23,121,25,122', 'sort_by': 'distance',
+            })
+
+    def test_admin_search_uses_the_index(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+
+        def results(term):
+            response = self.client.get(reverse('admin:properties_property_changelist'), {'q': term})
+            return sorted(p.pk for p in response.context['cl'].result_list)
+        # Words from any field, including a full-width address; no substring scan
+        self.assertEqual(results('cafes'), [self.taipei.pk])
+        self.assertEqual(results('afes'), [])
+        self.assertEqual(results('123'), [self.hualien.pk])
+        self.assertEqual(results('hualien sea'), sorted([self.hualien.pk, self.sold.pk]))
+
+    def test_q_ranks_title_matches_first(self):
+        pks, context = self.results(q='sea')
+        self.assertEqual(pks, [self.hualien.pk, self.taipei.pk])
+        self.assertEqual(context['current_sort'], 'relevance')
+        self.assertEqual(self.results(q='sea', sort_by='newest')[0], [self.taipei.pk, self.hualien.pk])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.taipei.address = '花蓮市中山路9號'
+        self.taipei.save()
+        self.assertEqual(sorted(self.results(location='中山路')[0]), sorted([self.hualien.pk, self.taipei.pk]))
+        self.hualien.delete()
+        self.assertEqual(self.results(location='中山路')[0], [self.taipei.pk])
+
+
+class LocationAutocompleteTests(TestCase):
+    def setUp(self):
+        from .autocomplete import location_index
+        self.index = location_index
+        self.index.loaded = False
+
+    def suggest(self, query):
+        return [(s['text'], s['kind'], s['count']) for s in self.client.get(
+            reverse('properties:location_autocomplete'), {'q': query}
+        ).json()['suggestions']]
+
+    def test_suggests_cities_districts_streets_and_postal_codes(self):
+        make_property(address='台北市信義區信義路五段7號', city='Taipei', postal_code='110')
+        make_property(address='花蓮市中山路123號', city='Hualien', postal_code='970')
+        make_property(address='88 Zhongshan Rd.', city='Hualien', postal_code='970')
+        make_property(address='花蓮市中正路1號', city='Hualien', status='sold')
+        self.assertEqual(self.suggest('hua'), [('Hualien', 'city', 2)])
+        self.assertEqual(self.suggest('信義'), [('信義區', 'district', 1), ('信義路五段', 'street', 1)])
+        self.assertEqual(self.suggest('ZHONG'), [('Zhongshan Rd.', 'street', 1)])
+        self.assertEqual(self.suggest('97'), [('970', 'postal_code', 2)])
+        self.assertEqual(self.suggest('中正'), [])
+
+        # Warm lookups are answered from memory
+        with self.assertNumQueries(0):
+            self.suggest('hu')
+
+    def test_index_follows_committed_changes(self):
+        property = make_property(address='花蓮市中山路123號', city='Hualien')
+        self.assertEqual(self.suggest('hua'), [('Hualien', 'city', 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            property.city = 'Hsinchu'
+            property.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('h'), [('Hsinchu', 'city', 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            property.delete()
+        self.assertEqual(self.suggest('h'), [])
+
+    def test_other_workers_changes_are_replayed(self):
+        from .autocomplete import LocationIndex
+        make_property(address='花蓮市中山路123號', city='Hualien')
+        self.assertEqual(self.suggest('hua'), [('Hualien', 'city', 1)])
+        other_worker = LocationIndex()
+        other_worker.apply_change(1001, {}, {'status': 'available', 'city': 'Hualien'})
+        other_worker.apply_change(1002, {}, {'status': 'available', 'city': 'Hsinchu'})
+        self.index.checked_at = 0
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('h'), [('Hualien', 'city', 2), ('Hsinchu', 'city', 1)])
+
+    def test_replaying_a_change_the_rebuild_already_read_is_harmless(self):
+        from .autocomplete import LocationIndex
+        property = make_property(city='Hualien')
+        self.assertEqual(self.suggest('hua'), [('Hualien', 'city', 1)])
+        # Committed before the rebuild read the rows, published after it read the version
+        LocationIndex().apply_change(property.pk, {}, {'status': 'available', 'city': 'Hualien'})
+        self.index.checked_at = 0
+        self.assertEqual(self.suggest('hua'), [('Hualien', 'city', 1)])
+
+    def test_missing_changes_rebuild_in_the_background(self):
+        from .autocomplete import LocationIndex
+        make_property(city='Hualien')
+        self.assertEqual(self.suggest('hua'), [('Hualien', 'city', 1)])
+        make_property(city='Hualien')
+        LocationIndex().invalidate()
+        self.index.checked_at = 0
+        with mock.patch('properties.autocomplete.threading.Thread') as thread:
+            # The stale index answers while the rebuild is pending
+            with self.assertNumQueries(0):
+                self.assertEqual(self.suggest('hua'), [('Hualien', 'city', 1)])
+            self.index.checked_at = 0
+            self.suggest('hua')
+        thread.assert_called_once()
+        with mock.patch('properties.autocomplete.connection'):
+            thread.call_args.kwargs['target']()
+        self.assertEqual(self.suggest('hua'), [('Hualien', 'city', 2)])
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class AgentStatsTests(TempMediaMixin, TestCase):
+    def assertStatsCurrent(self, agent):
+        stats = AgentStats.objects.get(agent=agent)
+        self.assertEqual(
+            {name: getattr(stats, name) for name in ('total', 'available', 'pending', 'sold')},
+            AgentStats.compute(agent.pk),
+        )
+        return stats
+
+    def test_status_and_agent_transitions_keep_counts_current(self):
+        mei, kai = make_agent('mei'), make_agent('kai')
+        listings = [make_property(agent=mei) for _ in range(3)]
+        self.assertEqual(self.assertStatsCurrent(mei).available, 3)
+
+        listings[0].status = 'pending'
+        listings[0].save()
+        listings[1].status = 'sold'
+        listings[1].save()
+        moved = Property.objects.only('pk', 'title').get(pk=listings[2].pk)
+        moved.agent = kai
+        moved.save()
+        listings[0].delete()
+        stats = self.assertStatsCurrent(mei)
+        self.assertEqual((stats.total, stats.sold), (1, 1))
+        self.assertEqual(self.assertStatsCurrent(kai).available, 1)
+
+        AgentStats.objects.all().delete()
+        call_command('rebuild_agent_stats', stdout=StringIO())
+        self.assertStatsCurrent(mei)
+        self.assertStatsCurrent(kai)
+
+    def test_dashboard_is_paginated_with_constant_queries(self):
+        from .views import DASHBOARD_PAGE_SIZE
+        agent = make_agent()
+        for i in range(DASHBOARD_PAGE_SIZE + 5):
+            make_property(agent=agent, title=f'Listing {i}', status='sold' if i % 5 == 0 else 'available')
+        self.client.login(username='agent', password='pass')
+        url = reverse('properties:agent_dashboard')
+        self.client.get(url)
+
+        # Session, user, agent, stats row, one page of listings
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['page_obj']), DASHBOARD_PAGE_SIZE)
+        self.assertEqual((response.context['total_properties'], response.context['sold_properties']), (25, 5))
+        second = self.client.get(url, {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual(len(second.context['page_obj']), 5)
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class AgentDirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_directory_is_one_query_then_cached_and_invalidated(self):
+        mei = make_agent('mei', specialization='Luxury villas')
+        kai = make_agent('kai', specialization='Rentals')
+        User.objects.filter(pk=kai.user_id).update(first_name='Kai')
+        for status in ('available', 'available', 'sold'):
+            make_property(agent=mei, status=status)
+        url = reverse('properties:agent_list')
+
+        # The count, then the page with user and listing counts in a single statement
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        counts = {agent.pk: (agent.active_listings, agent.sold_listings) for agent in response.context['agents']}
+        self.assertEqual(counts, {mei.pk: (2, 1), kai.pk: (0, 0)})
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        self.assertEqual([a.pk for a in self.client.get(url, {'q': 'villa'}).context['agents']], [mei.pk])
+        self.assertEqual([a.pk for a in self.client.get(url, {'q': 'kai'}).context['agents']], [kai.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Property.objects.filter(agent=mei, status='available').first().delete()
+        agents = self.client.get(url).context['agents']
+        self.assertEqual({agent.pk: agent.active_listings for agent in agents}[mei.pk], 1)
+
+    def test_pages_are_limited_in_the_query(self):
+        from .directory import AGENT_PAGE_SIZE
+        for i in range(AGENT_PAGE_SIZE + 1):
+            make_agent(f'agent{i:02}')
+        url = reverse('properties:agent_list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'page': 2})
+        self.assertEqual([agent.user.username for agent in response.context['agents']], [f'agent{AGENT_PAGE_SIZE:02}'])
+        self.assertEqual(response.context['page_obj'].paginator.num_pages, 2)
+        self.assertContains(response, '第 2 頁，共 2 頁')
+        self.assertIn('LIMIT', queries[-1]['sql'])
+        self.assertEqual(len(self.client.get(url).context['agents']), AGENT_PAGE_SIZE)
+
+
+class ListingImportExportTests(TestCase):
+    def import_file(self, content, suffix='.csv', **options):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+        self.addCleanup(os.remove, path)
+        out, err = StringIO(), StringIO()
+        call_command('import_properties', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_validates_and_upserts_in_batches(self):
+        mei = make_agent('mei')
+        header = 'reference,title,description,price,area_sqm,property_type,address,latitude,longitude,bedrooms,featured,agent\n'
+        rows = [
+            'HL-1,Sea view house,Near the coast,12000000,120,house,1 Zhongshan Rd,23.99,121.60,3,yes,mei\n',
+            'HL-2,City flat,Downtown,8500000,60,apartment,2 Zhongzheng Rd,,,2,,\n',
+            'HL-3,Bad price,Cheap,cheap,80,house,3 Road,,,1,,\n',
+            'HL-4,Unknown agent,Castle,100,80,castle,4 Road,,,1,,nobody\n',
+        ]
+        out, err = self.import_file(header + ''.join(rows), batch_size=2)
+        self.assertIn('2 created, 0 updated, 2 skipped', out)
+        self.assertIn('rows/s', out)
+        self.assertIn('Line 4: price:', err)
+        self.assertIn('property_type:', err)
+
+        house = Property.objects.get(reference='HL-1')
+        self.assertEqual((house.agent, house.bedrooms, house.featured, house.city), (mei, 3, True, 'Hualien'))
+        self.assertTrue(house.geohash.startswith('wsq'))
+        self.assertEqual(house.search_document.title_tokens, 'sea view house')
+        self.assertEqual(AgentStats.objects.get(agent=mei).available, 1)
+        self.assertEqual(MapCluster.objects.get(precision=1).count, 1)
+
+        # Same reference again: updated in place, not duplicated
+        out, err = self.import_file(header + 'HL-1,Sea view house,Repriced,9000000,120,house,1 Zhongshan Rd,,,3,no,\n')
+        self.assertIn('0 created, 1 updated', out)
+        house.refresh_from_db()
+        self.assertEqual((house.price, house.agent, house.featured, house.geohash), (Decimal('9000000'), None, False, ''))
+        self.assertEqual(Property.objects.count(), 2)
+        self.assertEqual(AgentStats.objects.get(agent=mei).total, 0)
+
+    def test_export_round_trips_through_jsonl(self):
+        mei = make_agent('mei')
+        make_property(title='花蓮海景', reference='HL-9', agent=mei, latitude=Decimal('23.990000'), longitude=Decimal('121.600000'))
+        make_property(title='Sold house', status='sold')
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        call_command('export_properties', path, status=['available'], stderr=StringIO())
+        with open(path, encoding='utf-8') as stream:
+            rows = [json.loads(line) for line in stream]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['title'], rows[0]['agent'], rows[0]['latitude']), ('花蓮海景', 'mei', '23.990000'))
+
+        Property.objects.filter(reference='HL-9').update(title='Changed')
+        with open(path, encoding='utf-8') as stream:
+            out, err = self.import_file(stream.read(), suffix='.jsonl')
+        self.assertIn('0 created, 1 updated', out)
+        self.assertEqual(Property.objects.get(reference='HL-9').title, '花蓮海景')
+
+
+class PooledS3StorageTests(TestCase):
+    def make_storage(self, **options):
+        from core.storage_backends import PooledS3Storage
+        return make_s3_storage(PooledS3Storage, **options)
+
+    def test_instances_share_one_client_per_credentials(self):
+        a, b = self.make_storage(), self.make_storage(location='media')
+        self.assertIs(a.client, b.client)
+        self.assertIsNot(a.client, self.make_storage(access_key='other').client)
+
+    def stub_client(self, storage, fail=()):
+        """A fake S3 client on ``storage``; uploads of keys ending in ``fail`` raise"""
+        stored = {}
+
+        def upload_fileobj(content, bucket, key, **kwargs):
+            data = content.read()
+            # Later files finish first, so results arrive out of order
+            time.sleep(0.01 / len(data))
+            if key.endswith(tuple(fail)):
+                raise ClientError({'Error': {'Code': '500'}, 'ResponseMetadata': {'HTTPStatusCode': 500}}, 'PutObject')
+            stored[key] = data
+
+        def head_object(Bucket, Key):
+            if Key not in stored:
+                raise ClientError({'Error': {'Code': '404'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}, 'HeadObject')
+
+        client = mock.Mock(upload_fileobj=upload_fileobj, head_object=head_object)
+        patcher = mock.patch.object(type(storage), 'client', new_callable=mock.PropertyMock, return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return stored
+
+    def test_save_many_keeps_order_and_distinct_names(self):
+        storage = self.make_storage(location='media')
+        stored = self.stub_client(storage)
+        files = [(f'properties/{i % 2}.jpg', ContentFile(b'x' * (i + 1))) for i in range(6)]
+        names = storage.save_many(files)
+        self.assertEqual(len(set(names)), 6)
+        self.assertEqual([len(stored[f'media/{name}']) for name in names], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(storage.metrics.snapshot()['batches'], 1)
+
+    def test_save_many_finishes_the_batch_and_raises_the_first_error(self):
+        storage = self.make_storage(location='media')
+        stored = self.stub_client(storage, fail=('bad.jpg',))
+        files = [('properties/a.jpg', ContentFile(b'a')), ('properties/bad.jpg', ContentFile(b'b')), ('properties/c.jpg', ContentFile(b'c'))]
+        with self.assertRaises(ClientError):
+            storage.save_many(files)
+        self.assertEqual(sorted(stored), ['media/properties/a.jpg', 'media/properties/c.jpg'])
+        metrics = storage.metrics.snapshot()
+        self.assertEqual((metrics['uploads'], metrics['failures']), (2, 1))
+
+    @skipUnless(os.environ.get('AWS_S3_ENDPOINT_URL'), 'set AWS_S3_ENDPOINT_URL to an S3-compatible server, e.g. moto_server')
+    def test_save_many_uploads_concurrently(self):
+        storage = self.make_storage(endpoint_url=os.environ['AWS_S3_ENDPOINT_URL'], location='media')
+        try:
+            storage.client.create_bucket(Bucket=storage.bucket_name)
+        except storage.client.exceptions.BucketAlreadyOwnedByYou:
+            pass
+        files = [(f'properties/{i % 3}.jpg', ContentFile(b'x' * (i + 1))) for i in range(12)]
+        names = storage.save_many(files)
+
+        # Same-named files in one batch still get distinct keys
+        self.assertEqual(len(set(names)), 12)
+        self.assertTrue(all(storage.exists(name) for name in names))
+        metrics = storage.metrics.snapshot()
+        self.assertEqual((metrics['uploads'], metrics['bytes'], metrics['batches']), (12, 78, 1))
+        for name in names:
+            storage.delete(name)
+        self.assertFalse(storage.exists(names[0]))
+
+
+class MediaReadCacheTests(TestCase):
+    def make_storage(self, cache_dir, **options):
+        from core.storage_backends import CachedS3Storage
+        with self.settings(MEDIA_CACHE_DIR=cache_dir, MEDIA_CACHE_MAX_BYTES=1000, MEDIA_CACHE_TRUST_SECONDS=0):
+            return make_s3_storage(CachedS3Storage, **options)
+
+    def test_sweep_evicts_least_recently_read(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            storage = self.make_storage(cache_dir)
+            paths = []
+            for i in range(4):
+                key_dir = os.path.join(cache_dir, 'ab', f'key{i}')
+                os.makedirs(key_dir)
+                paths.append(os.path.join(key_dir, 'etag'))
+                with open(paths[-1], 'wb') as handle:
+                    handle.write(b'x' * 300)
+                os.utime(paths[-1], (1000 + i, 1000 + i))
+            # Reading the oldest copy makes it the most recent
+            os.utime(paths[0], (2000, 1000))
+
+            storage.sweep()
+            self.assertEqual([os.path.exists(path) for path in paths], [True, False, True, True])
+            self.assertEqual(storage.cache_metrics.snapshot()['evicted_files'], 1)
+
+    def test_sweep_without_fcntl(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            storage = self.make_storage(cache_dir)
+            os.makedirs(os.path.join(cache_dir, 'ab', 'key'))
+            with open(os.path.join(cache_dir, 'ab', 'key', 'etag'), 'wb') as handle:
+                handle.write(b'x' * 2000)
+            # As on Windows, where importing fcntl fails
+            with mock.patch.dict(sys.modules, {'fcntl': None}):
+                storage.sweep()
+            self.assertFalse(os.path.exists(os.path.join(cache_dir, 'ab', 'key', 'etag')))
+
+    def test_uncacheable_downloads_are_not_left_behind(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            storage = self.make_storage(cache_dir)
+            client = mock.Mock()
+            client.get_object.return_value = {'ETag': '"not/a/file name"', 'Body': BytesIO(b'photo')}
+            with mock.patch.object(storage, '_s3_client', return_value=client):
+                with storage.open('properties/odd.jpg') as handle:
+                    self.assertEqual(handle.read(), b'photo')
+            self.assertEqual([files for _, _, files in os.walk(cache_dir) if files], [])
+
+    @skipUnless(os.environ.get('AWS_S3_ENDPOINT_URL'), 'set AWS_S3_ENDPOINT_URL to an S3-compatible server, e.g. moto_server')
+    def test_reads_are_cached_and_revalidated(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            storage = self.make_storage(cache_dir, endpoint_url=os.environ['AWS_S3_ENDPOINT_URL'], location='media')
+            try:
+                storage.client.create_bucket(Bucket=storage.bucket_name)
+            except storage.client.exceptions.BucketAlreadyOwnedByYou:
+                pass
+            name = storage.save('properties/cached.jpg', ContentFile(b'original'))
+            for _ in range(2):
+                with storage.open(name) as handle:
+                    self.assertEqual(handle.read(), b'original')
+            metrics = storage.cache_metrics.snapshot()
+            # With no trust window the second read is a conditional GET that downloads nothing
+            self.assertEqual((metrics['misses'], metrics['revalidated'], metrics['bytes_downloaded']), (1, 1, 8))
+            storage.delete(name)
+
+
+@override_settings(JOBS_EAGER=True)
+class DirectUploadTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        self.agent = make_agent()
+        self.client.login(username='agent', password='pass')
+
+    def request_targets(self, *files):
+        response = self.client.post(
+            reverse('properties:property_image_uploads'),
+            {'files': [{'name': name, 'content_type': content_type, 'size': size} for name, content_type, size in files]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def upload(self, name='photo.jpg'):
+        data = make_image_file(name).read()
+        targets = self.request_targets((name, 'image/jpeg', len(data)))
+        upload = targets['uploads'][0]
+        self.assertEqual(upload['upload']['method'], 'PUT')
+        response = self.client.generic('PUT', upload['upload']['url'], data, content_type='image/jpeg')
+        self.assertEqual(response.status_code, 204)
+        return upload['token']
+
+    def test_rejects_non_images_and_oversized_files(self):
+        targets = self.request_targets(('notes.txt', 'text/plain', 10), ('huge.jpg', 'image/jpeg', 10 ** 9))
+        self.assertEqual(targets['uploads'], [])
+        self.assertEqual([error['index'] for error in targets['errors']], [0, 1])
+
+    def test_confirm_creates_images_once(self):
+        property = make_property(agent=self.agent)
+        tokens = [self.upload('a.jpg'), self.upload('b.jpg')]
+        url = reverse('properties:property_image_confirm', args=[property.pk])
+        self.assertEqual(len(self.client.post(url, {'uploads': tokens}).json()['images']), 2)
+        # A retried confirm doesn't duplicate the rows
+        self.assertEqual(self.client.post(url, {'uploads': tokens}).json()['images'], [])
+
+        property.refresh_from_db()
+        self.assertEqual(property.image_count, 2)
+        self.assertTrue(property.primary_image.is_primary)
+        self.assertEqual(property.primary_image.image_variants['variants']['thumb']['width'], 160)
+
+    def test_create_view_attaches_uploaded_tokens(self):
+        token = self.upload()
+        response = self.client.post(reverse('properties:property_create'), {
+            'title': 'Direct', 'description': 'x', 'price': '1000000', 'property_type': 'house',
+            'listing_type': 'sale', 'status': 'available', 'address': '1 Zhongshan Rd', 'city': 'Hualien',
+            'bedrooms': 3, 'bathrooms': 2, 'area_sqm': '100', 'parking_spaces': 1,
+            'uploads': [token],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Property.objects.get(agent=self.agent).image_count, 1)
+        self.assertFalse(StagedUpload.objects.exists())
+
+    def test_tokens_are_bound_to_the_agent(self):
+        token = self.upload()
+        other = make_agent('other')
+        property = make_property(agent=other)
+        self.client.login(username='other', password='pass')
+        response = self.client.post(reverse('properties:property_image_confirm', args=[property.pk]), {'uploads': [token]})
+        self.assertEqual(response.json()['images'], [])
+        self.assertFalse(PropertyImage.objects.exists())
+
+    def test_confirmed_files_must_be_images(self):
+        from properties.uploads import image_storage, read_token
+        property = make_property(agent=self.agent)
+        targets = self.request_targets(('fake.jpg', 'image/jpeg', 11))
+        upload = targets['uploads'][0]
+        self.client.generic('PUT', upload['upload']['url'], b'not a photo', content_type='image/jpeg')
+        with self.assertLogs('properties.tasks', 'WARNING'):
+            response = self.client.post(reverse('properties:property_image_confirm', args=[property.pk]), {'uploads': [upload['token']]})
+        self.assertEqual(response.json()['images'], [])
+        self.assertFalse(PropertyImage.objects.exists())
+        self.assertFalse(image_storage().exists(read_token(upload['token'], self.agent)))
+
+    def test_stale_unconfirmed_uploads_are_deleted(self):
+        from properties.uploads import delete_stale_uploads, image_storage, read_token
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with self.settings(MEDIA_ROOT=media_root):
+            property = make_property(agent=self.agent)
+            confirmed, unconfirmed = self.upload('a.jpg'), self.upload('b.jpg')
+            self.client.post(reverse('properties:property_image_confirm', args=[property.pk]), {'uploads': [confirmed]})
+            # Nothing is deleted while the upload token may still be confirmed
+            self.assertEqual(delete_stale_uploads(), 0)
+
+            self.assertEqual(delete_stale_uploads(now=timezone.now() + timedelta(days=2)), 1)
+            storage = image_storage()
+            self.assertTrue(storage.exists(read_token(confirmed, self.agent)))
+            self.assertFalse(storage.exists(read_token(unconfirmed, self.agent)))
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class AsyncViewTests(TestCase):
+    def call(self, view, path, **kwargs):
+        request = AsyncRequestFactory().get(path)
+        request.user = AnonymousUser()
+        request.session = {}
+
+        async def auser():
+            return request.user
+        request.auser = auser
+        return view(request, **kwargs)
+
+    async def test_public_views_render(self):
+        from . import async_views
+        agent = await sync_to_async(make_agent)()
+        property = await sync_to_async(make_property)(address='8 Async Rd', agent=agent, featured=True)
+
+        for view, path, kwargs in (
+            (async_views.home, '/', {}),
+            (async_views.property_list, '/properties/', {}),
+            (async_views.property_detail, f'/properties/{property.pk}/', {'pk': property.pk}),
+            (async_views.agent_profile, f'/agents/{agent.pk}/', {'pk': agent.pk}),
+        ):
+            with self.subTest(path=path):
+                response = await self.call(view, path, **kwargs)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('8 Async Rd', response.content.decode())
+
+    async def test_property_list_filters_by_location(self):
+        from . import async_views
+        await sync_to_async(make_property)(address='8 Async Rd', city='Hualien')
+        response = await self.call(async_views.property_list, '/properties/?location=hual')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('8 Async Rd', response.content.decode())
+
+    async def test_property_list_handles_every_parameter(self):
+        from urllib.parse import urlencode
+
+        from . import async_views
+        from .views import PROPERTY_LIST_PAGE_SIZE
+
+        def make_listings():
+            for i in range(PROPERTY_LIST_PAGE_SIZE + 1):
+                make_property(
+                    title='Seaside home', address=f'{i} Async Rd', city='Hualien', bedrooms=3, bathrooms=2,
+                    latitude=Decimal('23.99'), longitude=Decimal('121.60'),
+                )
+            first = KeysetPaginator(Property.objects.all(), PROPERTY_LIST_PAGE_SIZE, get_ordering('newest')).get_page()
+            return first.next_cursor
+        cursor = await sync_to_async(make_listings)()
+
+        for params, address in (
+            ({'q': 'seaside'}, 'Async Rd'),
+            ({'location': 'hual'}, 'Async Rd'),
+            ({'location': '路'}, None),
+            ({'listing_type': 'sale', 'property_type': 'house,apartment', 'min_price': '1', 'max_price': '99999999',
+              'bedrooms': '3', 'bathrooms': '2'}, 'Async Rd'),
+            ({'lat': '23.99', 'lng': '121.60', 'radius_km': '5'}, 'Async Rd'),
+            ({'bbox': '23.5,121.0,24.5,122.0'}, 'Async Rd'),
+            ({'sort_by': 'price_low'}, 'Async Rd'),
+            # The first page holds the newest listings, 9 to 1
+            ({'cursor': cursor}, '>0 Async Rd'),
+        ):
+            with self.subTest(params=params):
+                response = await self.call(async_views.property_list, f'/properties/?{urlencode(params)}')
+                self.assertEqual(response.status_code, 200)
+                if address:
+                    self.assertIn(address, response.content.decode())
+
+    @override_settings(PAGE_CACHE_ENABLED=True)
+    async def test_async_views_use_the_page_cache(self):
+        from . import async_views
+        await cache.aclear()
+        first = await self.call(async_views.property_list, '/properties/')
+        second = await self.call(async_views.property_list, '/properties/')
+        self.assertEqual((first['X-Page-Cache'], second['X-Page-Cache']), ('miss', 'hit'))
+
+
+@override_settings(PAGE_CACHE_ENABLED=False, PERFORMANCE_SERVER_TIMING=True, PERFORMANCE_SLOW_REQUEST_MS=60000)
+class PerformanceInstrumentationTests(TestCase):
+    def test_server_timing_and_log_line(self):
+        make_property(title='Timed')
+        with self.assertLogs('core.performance', 'INFO') as logs:
+            response = self.client.get(reverse('properties:property_list'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['url_name'], 'properties:property_list')
+        self.assertGreater(record['db_queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertNotIn('sql', record)
+
+    @override_settings(PERFORMANCE_SLOW_REQUEST_MS=0)
+    def test_slow_requests_capture_their_sql(self):
+        make_property(title='Slow')
+        with self.assertLogs('core.performance', 'WARNING') as logs:
+            self.client.get(reverse('properties:property_list'))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertTrue(record['slow'])
+        self.assertTrue(any('properties_property' in query['sql'] for query in record['sql']))
+
+    def test_static_files_are_not_measured(self):
+        with self.assertNoLogs('core.performance'):
+            response = self.client.get('/static/css/missing.css')
+        self.assertNotIn('Server-Timing', response)
+
+    def test_hooks_leave_shared_classes_alone(self):
+        self.client.get(reverse('properties:property_list'))
+        self.assertEqual(BackendTemplate.render.__module__, 'django.template.backends.django')
+        self.assertNotEqual(type(caches['default']).get.__module__, 'core.middleware')
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class BenchmarkTests(TempMediaMixin, TestCase):
+    def test_seed_and_run_writes_results(self):
+        from properties import benchmark
+
+        seeded = benchmark.seed(30, agent_count=3, images_per_listing=0, batch_size=10, random_seed=1)
+        self.assertEqual(seeded['properties'], 30)
+        self.assertEqual(Property.objects.filter(reference__startswith=benchmark.REFERENCE_PREFIX).count(), 30)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            call_command('run_benchmark', requests=40, warmup=5, output=path, stdout=StringIO())
+            with open(path) as handle:
+                results = json.load(handle)
+        self.assertEqual(results['routes']['*']['requests'], 40)
+        self.assertEqual(results['routes']['*']['errors'], 0)
+        self.assertIsNotNone(results['routes']['*']['queries_mean'])
+        self.assertGreater(results['throughput_rps'], 0)
+
+    def test_summarize_percentiles(self):
+        from properties.benchmark import summarize
+        samples = [('list', n / 1000, 4, 200) for n in range(1, 101)] + [('detail', 0.5, None, 404)]
+        stats = summarize(samples)
+        self.assertEqual(stats['list']['requests'], 100)
+        self.assertEqual(stats['list']['queries_max'], 4)
+        self.assertAlmostEqual(stats['list']['p95_ms'], 95, delta=1)
+        self.assertEqual(stats['detail']['errors'], 1)
+        self.assertIsNone(stats['detail']['queries_mean'])
+        self.assertEqual(stats['*']['requests'], 101)
+
+
+@override_settings(PAGE_CACHE_ENABLED=False, PERFORMANCE_SLOW_REQUEST_MS=None)
+class PerformanceBudgetTests(TempMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from properties import benchmark
+        benchmark.seed(60, agent_count=4, images_per_listing=3, batch_size=30, random_seed=2)
+
+    def test_every_route_has_a_budget(self):
+        from properties.budgets import load_budgets, unbudgeted_routes
+        self.assertEqual(unbudgeted_routes(load_budgets()), [])
+
+    def test_routes_stay_within_query_budget(self):
+        from properties.benchmark import build_scenarios
+        from properties.budgets import check_scenarios, load_budgets
+        # Time budgets are for the seeded benchmark dataset, see check_performance_budgets
+        results, problems = check_scenarios(build_scenarios(random.Random(0), sample_size=3), load_budgets(), check_time=False)
+        self.assertIn('properties:agent_dashboard', {name for name, *_ in results})
+        if problems:
+            self.fail('\n\n'.join(problems))
+
+    def test_report_marks_queries_in_a_loop(self):
+        from properties.budgets import sql_report
+        queries = ['SELECT * FROM "properties_property" LIMIT 10'] + [
+            f'SELECT * FROM "properties_propertyimage" WHERE "property_id" = {pk}' for pk in range(1, 4)
+        ]
+        lines = sql_report(queries, 2).splitlines()
+        self.assertEqual([line[0] for line in lines], [' ', ' ', '+', '+'])
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class SearchCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def list_count(self, **params):
+        response = self.client.get(reverse('properties:property_list'), params)
+        return response.context['page_obj'].paginator.count, response.context['count_is_approximate']
+
+    def test_counts_are_cached_per_filter_signature(self):
+        for listing_type in ('sale', 'sale', 'rent'):
+            make_property(listing_type=listing_type, property_type='condo')
+        self.assertEqual(self.list_count(listing_type='sale', property_type='condo,house'), (2, False))
+
+        # Same filters in another order, with a sort: no COUNT query
+        with CaptureQueriesContext(connection) as queries:
+            count = self.list_count(property_type='house,condo', sort_by='price_low', listing_type='sale')
+        self.assertEqual(count, (2, False))
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(self.list_count(listing_type='rent'), (1, False))
+
+    def test_only_filterable_changes_invalidate(self):
+        property = make_property(listing_type='sale')
+        self.assertEqual(self.list_count(listing_type='sale'), (1, False))
+
+        from properties.cache import get_tag_versions
+        from properties.counts import COUNT_TAG
+        version = get_tag_versions([COUNT_TAG])
+        property.featured = True
+        with self.captureOnCommitCallbacks(execute=True):
+            property.save()
+        self.assertEqual(get_tag_versions([COUNT_TAG]), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            property.listing_type = 'rent'
+            property.save()
+        self.assertEqual(self.list_count(listing_type='sale'), (0, False))
+
+    @override_settings(PROPERTY_COUNT_LIMIT=2)
+    def test_large_result_sets_are_approximate(self):
+        for _ in range(3):
+            make_property()
+        self.assertEqual(self.list_count(), (2, True))
+        self.assertContains(self.client.get(reverse('properties:property_list')), 'of 2+ properties')
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def make_listings(self):
+        return [
+            make_property(listing_type='sale', property_type='house', bedrooms=3, bathrooms=2, price=Decimal('12000000')),
+            make_property(listing_type='sale', property_type='condo', bedrooms=2, bathrooms=1, price=Decimal('6000000')),
+            make_property(listing_type='rent', property_type='house', bedrooms=7, bathrooms=1, price=Decimal('25000')),
+            make_property(listing_type='sale', property_type='house', bedrooms=4, status='sold'),
+        ]
+
+    def cells(self):
+        from properties.models import FacetCount
+        return sorted(FacetCount.objects.values_list('listing_type', 'property_type', 'bedrooms', 'bathrooms', 'price_band', 'count'))
+
+    def test_cells_follow_saves_and_deletes(self):
+        from properties import facets
+        house, condo, rental, sold = self.make_listings()
+        condo.bedrooms, condo.price = 3, Decimal('11000000')
+        condo.save()
+        sold.status = 'available'
+        sold.save()
+        rental.delete()
+        maintained = self.cells()
+        facets.rebuild()
+        self.assertEqual(maintained, self.cells())
+        self.assertIn(('sale', 'condo', 3, 1, 2, 1), maintained)
+
+    def test_each_facet_ignores_its_own_filter(self):
+        from properties.facets import facet_counts
+        self.make_listings()
+        result = facet_counts({'listing_type': 'sale', 'property_type': 'house'})
+        counts = {facet: {option.get('value'): option['count'] for option in options} for facet, options in result.items()}
+        self.assertEqual(counts['listing_type'], {'sale': 1, 'rent': 1})
+        self.assertEqual(counts['property_type']['house'], 1)
+        self.assertEqual(counts['property_type']['condo'], 1)
+        self.assertEqual(counts['bedrooms'], {1: 1, 2: 1, 3: 1, 4: 0, 5: 0})
+        sale_bands = [band['count'] for band in result['price'] if band['listing_type'] == 'sale']
+        self.assertEqual(sale_bands, [0, 0, 1, 0, 0, 0])
+        self.assertTrue(next(option for option in result['listing_type'] if option['value'] == 'sale')['selected'])
+
+    def test_cells_and_grouped_query_agree(self):
+        from properties.facets import _cell_counts, _query_counts, options, selection
+        self.make_listings()
+        for params in ({}, {'listing_type': 'rent'}, {'property_type': 'house,condo', 'bedrooms': '2'}, {'bathrooms': '2'}, {'bedrooms': '5'}):
+            current = selection(params)
+            with self.assertNumQueries(1):
+                grouped = _query_counts(params, current, options())
+            self.assertEqual(_cell_counts(current, options()), grouped, params)
+
+    def test_sidebar_and_json(self):
+        self.make_listings()
+        response = self.client.get(reverse('properties:property_list'), {'q': 'Test'})
+        self.assertContains(response, 'class="property-type-checkbox')
+        self.assertEqual(len(response.context['facets']['property_type']), len(Property.TYPE_CHOICES))
+
+        with self.assertNumQueries(0):
+            data = self.client.get(reverse('properties:property_facets'), {'q': 'Test'}).json()
+        self.assertEqual(data['facets'], response.context['facets'])
+
+    def test_price_bands_match_the_filter_they_send(self):
+        from properties.facets import facet_counts
+        make_property(listing_type='sale', price='10000000')
+        bands = [band for band in facet_counts({'listing_type': 'sale'})['price'] if band['listing_type'] == 'sale']
+        self.assertEqual([band['count'] for band in bands], [0, 0, 1, 0, 0, 0])
+        for band in bands:
+            params = {'listing_type': 'sale', 'min_price': band['min'], 'max_price': band['max_price'] or ''}
+            response = self.client.get(reverse('properties:property_list'), params)
+            self.assertEqual(response.context['page_obj'].paginator.count, band['count'], band)
+            self.assertIn({**band, 'selected': True}, response.context['facets']['price'])
+
+
+@override_settings(PAGE_CACHE_ENABLED=False, CARD_CACHE_ENABLED=True)
+class CardFragmentCacheTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.agent = make_agent()
+        self.listings = [make_property(agent=self.agent, price=Decimal(1_000_000 * n)) for n in (1, 2, 3)]
+
+    def render(self, language='en'):
+        properties = list(Property.objects.select_related('agent__user').order_by('pk'))
+        with translation.override(language):
+            return Template('{% load property_filters %}{% property_cards properties show_agent=True %}').render(
+                Context({'properties': properties})
+            )
+
+    def test_unchanged_cards_come_from_one_get_many(self):
+        html = self.render()
+        self.assertEqual(html.count('View Details'), 3)
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, \
+                mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            self.assertEqual(self.render(), html)
+        get_many.assert_called_once()
+        set_many.assert_not_called()
+
+    def test_saves_and_agent_changes_rerender(self):
+        self.render()
+        listing = self.listings[0]
+        listing.price = Decimal('7654321')
+        listing.save()
+        self.assertIn('7,654,321', self.render())
+
+        user = self.agent.user
+        user.first_name = 'Hui'
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(self.render().count('Hui Lin'), 3)
+
+    def test_language_is_part_of_the_key(self):
+        self.render('en')
+        with mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            self.render('zh-hant')
+        self.assertEqual(len(set_many.call_args.args[0]), 3)
+
+    @override_settings(JOBS_EAGER=False)
+    def test_generated_variants_rerender(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_image(self.listings[0], image=make_image_file(size=(800, 600)))
+        self.assertNotIn('type="image/webp"', self.render())
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('run_jobs', burst=True, stdout=StringIO())
+        self.assertIn('type="image/webp"', self.render())
@@ -0,0 +1,196 @@
+"""
+Direct-to-storage uploads for listing photos.
+
+Instead of posting photos through the app, the browser asks for an upload
+target per file, sends the bytes straight to media storage and then hands
+the returned tokens back (to the confirm endpoint or with the listing form),
+which only records PropertyImage rows pointing at the stored keys.
+
+On S3 the target is a presigned POST that S3 itself checks for size and
+content type. FileSystemStorage has no such thing, so in development the
+target is an app URL that writes the body to MEDIA_ROOT.
+
+Tokens are signed ``{key, agent}`` pairs, so no session state is stored.
+Nothing vouches for the bytes themselves: the variants job removes
+confirmed files Pillow can't read (properties.tasks), and
+``delete_stale_uploads`` removes files whose token expired unconfirmed.
+"""
+import posixpath
+import re
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.validators import get_available_image_extensions
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .models import PropertyImage
+
+
+TOKEN_SALT = 'properties.uploads'
+
+# Most files one upload request may ask targets for
+MAX_FILES_PER_REQUEST = 30
+
+UPLOAD_ROOT = 'properties'
+# new_key() puts every upload in a directory of its own
+UPLOAD_DIR_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def max_upload_bytes():
+    return getattr(settings, 'PROPERTY_UPLOAD_MAX_BYTES', 20 * 1024 * 1024)
+
+
+def upload_expires():
+    """Seconds a target (and its token) stays valid"""
+    return getattr(settings, 'PROPERTY_UPLOAD_EXPIRES', 3600)
+
+
+def image_storage():
+    return PropertyImage._meta.get_field('image').storage
+
+
+def new_key(filename):
+    """
+    A fresh storage name under PropertyImage's upload_to, or None if the
+    file is not an image. Keeps within the ImageField's 100 characters.
+    """
+    stem, extension = posixpath.splitext(get_valid_filename(posixpath.basename(filename or '')) or 'image')
+    if extension[1:].lower() not in get_available_image_extensions():
+        return None
+    return posixpath.join(UPLOAD_ROOT, uuid.uuid4().hex, f'{stem[:40]}{extension.lower()}')
+
+
+def make_token(key, agent):
+    return signing.dumps({'key': key, 'agent': agent.pk}, salt=TOKEN_SALT, compress=True)
+
+
+def read_token(token, agent):
+    """The storage key ``token`` grants ``agent``, or None if it is invalid or expired"""
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=upload_expires())
+    except signing.BadSignature:
+        return None
+    if data.get('agent') != agent.pk:
+        return None
+    return data.get('key')
+
+
+def _s3_client(storage):
+    # PooledS3Storage exposes its shared client; plain S3Storage only its resource
+    return getattr(storage, 'client', None) or storage.connection.meta.client
+
+
+def upload_target(request, key, content_type, token):
+    """Where and how the browser should send the file stored at ``key``"""
+    storage = image_storage()
+    if hasattr(storage, 'bucket_name'):
+        fields = {'Content-Type': content_type}
+        conditions = [['content-length-range', 1, max_upload_bytes()], {'Content-Type': content_type}]
+        cache_control = (getattr(storage, 'object_parameters', None) or {}).get('CacheControl')
+        if cache_control:
+            fields['Cache-Control'] = cache_control
+            conditions.append({'Cache-Control': cache_control})
+        post = _s3_client(storage).generate_presigned_post(
+            Bucket=storage.bucket_name,
+            Key=storage._normalize_name(key),
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=upload_expires(),
+        )
+        return {'method': 'POST', 'url': post['url'], 'fields': post['fields']}
+    return {
+        'method': 'PUT',
+        'url': request.build_absolute_uri(reverse('properties:property_image_upload_local', args=[token])),
+        'headers': {'Content-Type': content_type},
+    }
+
+
+def prepare_uploads(request, agent, files):
+    """
+    Targets for ``files``, a list of ``{'name', 'content_type', 'size'}``
+    dicts. Returns ``(uploads, errors)``, one entry per file in either list,
+    each carrying the file's ``index`` in ``files``.
+    """
+    uploads, errors = [], []
+    limit = max_upload_bytes()
+    for index, entry in enumerate(files[:MAX_FILES_PER_REQUEST]):
+        name = str(entry.get('name', ''))[:255]
+        content_type = str(entry.get('content_type', ''))
+        try:
+            size = int(entry.get('size') or 0)
+        except (TypeError, ValueError):
+            size = 0
+        key = new_key(name)
+        if key is None or not content_type.startswith('image/'):
+            errors.append({'index': index, 'name': name, 'error': 'Not an image file'})
+        elif not 0 < size <= limit:
+            errors.append({'index': index, 'name': name, 'error': f'Images must be under {limit // (1024 * 1024)} MB'})
+        else:
+            token = make_token(key, agent)
+            uploads.append({'index': index, 'name': name, 'token': token, 'upload': upload_target(request, key, content_type, token)})
+    return uploads, errors
+
+
+def confirm_uploads(property, agent, tokens, first_order=0, first_is_primary=False):
+    """
+    Create PropertyImage rows for the uploaded files ``tokens`` refer to.
+    Invalid tokens, files that never arrived and ones already confirmed are
+    skipped, so confirming twice is harmless. Returns the new images.
+    """
+    keys = []
+    for token in tokens:
+        key = read_token(token, agent)
+        if key and key not in keys:
+            keys.append(key)
+    existing = set(PropertyImage.objects.filter(image__in=keys).values_list('image', flat=True))
+    storage = image_storage()
+    images = []
+    for key in keys:
+        if key in existing or not storage.exists(key):
+            continue
+        images.append(PropertyImage.objects.create(
+            property=property,
+            image=key,
+            order=first_order + len(images),
+            is_primary=first_is_primary and not images,
+        ))
+    if images and getattr(settings, 'JOBS_EAGER', True):
+        # The variants job already ran, and removed any file that isn't an image
+        kept = set(PropertyImage.objects.filter(pk__in=[image.pk for image in images]).values_list('pk', flat=True))
+        images = [image for image in images if image.pk in kept]
+    return images
+
+
+def delete_stale_uploads(now=None):
+    """
+    Delete uploads that were never confirmed: directories under UPLOAD_ROOT
+    that no PropertyImage points into, whose files are older than a token
+    lives. Returns the number of files deleted.
+    """
+    storage = image_storage()
+    try:
+        directories, _ = storage.listdir(UPLOAD_ROOT)
+    except FileNotFoundError:
+        return 0
+    images = PropertyImage.objects.filter(image__startswith=f'{UPLOAD_ROOT}/').values_list('image', flat=True)
+    referenced = {posixpath.dirname(name) for name in images.iterator()}
+    cutoff = (now or timezone.now()) - timedelta(seconds=upload_expires())
+    deleted = 0
+    for directory in directories:
+        path = posixpath.join(UPLOAD_ROOT, directory)
+        if not UPLOAD_DIR_RE.match(directory) or path in referenced:
+            continue
+        subdirectories, names = storage.listdir(path)
+        names = [posixpath.join(path, name) for name in names]
+        if any(storage.get_modified_time(name) > cutoff for name in names):
+            continue
+        if 'variants' in subdirectories:
+            names += [posixpath.join(path, 'variants', name) for name in storage.listdir(posixpath.join(path, 'variants'))[1]]
+        for name in names:
+            storage.delete(name)
+        deleted += len(names)
+    return deleted
@@ -1,14 +1,21 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = 'properties'
 
+# Public read views have async versions for ASGI serving
+public_views = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
-    path('', views.home, name='home'),
-    path('properties/', views.property_list, name='property_list'),
-    path('properties/<int:pk>/', views.property_detail, name='property_detail'),
+    path('', public_views.home, name='home'),
+    path('properties/', public_views.property_list, name='property_list'),
+    path('properties/<int:pk>/', public_views.property_detail, name='property_detail'),
+    path('properties/map/clusters/', views.map_clusters, name='map_clusters'),
+    path('properties/facets/', views.property_facets, name='property_facets'),
+    path('properties/autocomplete/', views.location_autocomplete, name='location_autocomplete'),
     path('agents/', views.agent_list, name='agent_list'),
-    path('agents/<int:pk>/', views.agent_profile, name='agent_profile'),
+    path('agents/<int:pk>/', public_views.agent_profile, name='agent_profile'),
     path('contacts/', views.contacts, name='contacts'),
     path('about/', views.about, name='about'),
     path('register/', views.agent_register, name='agent_register'),
@@ -20,5 +27,8 @@ urlpatterns = [
     path('properties/create/', views.property_create, name='property_create'),
     path('properties/<int:pk>/edit/', views.property_edit, name='property_edit'),
     path('properties/<int:pk>/delete/', views.property_delete, name='property_delete'),
+    path('properties/<int:pk>/images/confirm/', views.property_image_confirm, name='property_image_confirm'),
+    path('property-images/uploads/', views.property_image_uploads, name='property_image_uploads'),
+    path('property-images/uploads/<str:token>/', views.property_image_upload_local, name='property_image_upload_local'),
     path('property-images/<int:pk>/delete/', views.property_image_delete, name='property_image_delete'),
 ]
@@ -1,91 +1,192 @@
+import json
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_cache_control
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator
-from django.db import models
-from .models import Property, Agent, Contact, PropertyImage
+from django.views.decorators.http import require_POST
+from . import clusters, geo, search
+from .autocomplete import location_index
+from .models import Property, Agent, AgentStats, Contact, PropertyImage, StagedUpload
+from .cache import add_cache_tags, cache_public_page
+from .counts import search_count
+from .facets import facet_counts
+from .directory import agent_directory, agent_directory_page
+from .filters import filter_properties, parse_geo_search
 from .forms import PropertyForm, PropertyImageForm
+from .jobs import enqueue
+from .pagination import DISTANCE_ORDERING, RELEVANCE_ORDERING, KeysetPaginator, get_ordering
+from .uploads import confirm_uploads, image_storage, max_upload_bytes, prepare_uploads, read_token
+
+
+PROPERTY_LIST_PAGE_SIZE = 9
+DASHBOARD_PAGE_SIZE = 20
+
 
+def tag_cards(request, properties):
+    """Make a cached page depend on each card it shows and on the cards' agents"""
+    for property in properties:
+        add_cache_tags(request, f'property:{property.pk}')
+        if property.agent_id:
+            add_cache_tags(request, f'agent:{property.agent_id}')
+
+
+def queue_property_images(property, uploads, first_order=0, first_is_primary=False):
+    """
+    Stage uploaded images in the database and hand them to a background job,
+    so the request doesn't wait on media storage or resizing
+    """
+    files = []
+    for idx, upload in enumerate(uploads):
+        staged = StagedUpload.objects.create(
+            name=upload.name,
+            content_type=upload.content_type or '',
+            data=upload.read(),
+        )
+        files.append({
+            'staged_id': staged.pk,
+            'order': first_order + idx,
+            'is_primary': first_is_primary and idx == 0,
+        })
+    if files:
+        enqueue('properties.tasks.store_property_images', property_id=property.pk, files=files)
+    return len(files)
 
+
+@cache_public_page('property_list', 'company')
 def home(request):
-    featured_properties = Property.objects.filter(featured=True, status='available')[:6]
+    featured_properties = list(Property.objects.filter(featured=True, status='available').with_card_data()[:6])
+    tag_cards(request, featured_properties)
     context = {
         'featured_properties': featured_properties,
     }
     return render(request, 'properties/home.html', context)
 
 
+def property_search(params):
+    """
+    The filtered listings, keyset ordering and sort context for a
+    property_list query string. Only builds querysets: the async
+    property_list calls it on the event loop, where a query would raise
+    SynchronousOnlyOperation.
+    """
+    properties = filter_properties(
+        Property.objects.filter(status='available').with_card_data(),
+        params,
+    )
+    is_geo_search = parse_geo_search(params) is not None
+    is_text_search = bool(search.query_terms(params.get('q', '')))
+    if is_text_search:
+        default_sort = 'relevance'
+    elif is_geo_search:
+        default_sort = 'distance'
+    else:
+        default_sort = 'newest'
+    sort_by = params.get('sort_by') or default_sort
+    if (sort_by == 'distance' and not is_geo_search) or (sort_by == 'relevance' and not is_text_search):
+        sort_by = default_sort
+    if sort_by == 'relevance':
+        ordering = RELEVANCE_ORDERING
+    elif sort_by == 'distance':
+        ordering = DISTANCE_ORDERING
+    else:
+        ordering = get_ordering(sort_by)
+    context = {
+        'current_sort': sort_by,
+        'is_geo_search': is_geo_search,
+        'is_text_search': is_text_search,
+    }
+    return properties, ordering, context
+
+
+@cache_public_page('property_list', 'company')
 def property_list(request):
-    properties = Property.objects.filter(status='available')
-    
-    listing_type = request.GET.get('listing_type')
-    property_type = request.GET.get('property_type')
-    location = request.GET.get('location')
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    bedrooms = request.GET.get('bedrooms')
-    bathrooms = request.GET.get('bathrooms')
-    sort_by = request.GET.get('sort_by', 'newest')
-    
-    if listing_type:
-        properties = properties.filter(listing_type=listing_type)
-    
-    # Handle multiple property types
-    if property_type:
-        property_types = property_type.split(',')
-        properties = properties.filter(property_type__in=property_types)
-    
-    if location:
-        properties = properties.filter(
-            models.Q(city__icontains=location) | 
-            models.Q(address__icontains=location) |
-            models.Q(postal_code__icontains=location)
-        )
-    if min_price:
-        properties = properties.filter(price__gte=min_price)
-    if max_price:
-        properties = properties.filter(price__lte=max_price)
-    if bedrooms:
-        properties = properties.filter(bedrooms__gte=bedrooms)
-    if bathrooms:
-        properties = properties.filter(bathrooms__gte=bathrooms)
-    
-    # Apply sorting
-    if sort_by == 'price_low':
-        properties = properties.order_by('price')
-    elif sort_by == 'price_high':
-        properties = properties.order_by('-price')
-    elif sort_by == 'sqft':
-        properties = properties.order_by('-area_sqm')
-    else:  # newest
-        properties = properties.order_by('-created_at')
-    
-    paginator = Paginator(properties, 9)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    properties, ordering, context = property_search(request.GET)
     
-    context = {
+    # Keyset pagination on the sort key with a pk tiebreaker, so deep pages
+    # cost the same as the first one
+    paginator = KeysetPaginator(properties, PROPERTY_LIST_PAGE_SIZE, ordering)
+    # Cached per filter combination and capped, instead of a COUNT(*) per request
+    paginator.count, count_is_approximate = search_count(properties, request.GET)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    tag_cards(request, page_obj)
+    
+    context.update({
         'properties': page_obj,
         'page_obj': page_obj,
-        'current_sort': sort_by,
-    }
+        'count_is_approximate': count_is_approximate,
+        'facets': facet_counts(request.GET),
+    })
     return render(request, 'properties/property_list.html', context)
 
 
+@cache_public_page('property_counts')
+def property_facets(request):
+    """Sidebar facet counts for a property_list query string, as JSON"""
+    return JsonResponse({'facets': facet_counts(request.GET)})
+
+
+@cache_public_page('property_list')
+def map_clusters(request):
+    """Marker clusters for the available listings in a map viewport"""
+    bbox = geo.parse_bbox(request.GET.get('bbox'))
+    try:
+        zoom = int(request.GET.get('zoom', ''))
+    except ValueError:
+        zoom = None
+    if bbox is None or zoom is None or not 0 <= zoom <= 22:
+        return JsonResponse({'error': 'Expected zoom=0..22 and bbox=south,west,north,east'}, status=400)
+    
+    precision, cluster_list = clusters.clusters_in_view(bbox, zoom)
+    return JsonResponse({
+        'zoom': zoom,
+        'precision': precision,
+        'total': sum(cluster['count'] for cluster in cluster_list),
+        'clusters': cluster_list,
+    })
+
+
+def location_autocomplete(request):
+    """Location suggestions for the search box, answered from process memory"""
+    query = request.GET.get('q', '')[:100]
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+    response = JsonResponse({'query': query, 'suggestions': location_index.suggest(query, limit)})
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
+
+@cache_public_page('property:{pk}', 'company')
 def property_detail(request, pk):
-    property = get_object_or_404(Property, pk=pk)
+    property = get_object_or_404(
+        Property.objects.select_related('agent__user').prefetch_related('images'),
+        pk=pk,
+    )
+    if property.agent_id:
+        add_cache_tags(request, f'agent:{property.agent_id}')
     context = {
         'property': property,
     }
     return render(request, 'properties/property_detail.html', context)
 
 
+@cache_public_page('agent_list', 'company')
 def agent_list(request):
-    agents = Agent.objects.all()
+    query = request.GET.get('q', '').strip()[:100]
+    page_obj = agent_directory_page(query, request.GET.get('page'))
     context = {
-        'agents': agents,
+        'agents': page_obj,
+        'page_obj': page_obj,
+        'query': query,
     }
     return render(request, 'properties/agent_list.html', context)
 
@@ -115,8 +216,9 @@ def contacts(request):
     return render(request, 'properties/contacts.html')
 
 
+@cache_public_page('agent_list', 'company')
 def about(request):
-    agents = Agent.objects.all()
+    agents = agent_directory()
     context = {
         'agents': agents,
     }
@@ -205,19 +307,18 @@ def agent_logout(request):
     return redirect('properties:home')
 
 
+@cache_public_page('agent:{pk}', 'agent_listings:{pk}', 'company')
 def agent_profile(request, pk):
-    agent = get_object_or_404(Agent, pk=pk)
-    agent_properties = Property.objects.filter(agent=agent, status='available').order_by('-created_at')
-    
-    # Calculate stats
-    total_properties = agent_properties.count()
-    sold_properties = Property.objects.filter(agent=agent, status='sold').count()
+    agent = get_object_or_404(Agent.objects.select_related('user'), pk=pk)
+    agent_properties = Property.objects.filter(agent=agent, status='available').with_card_data().order_by('-created_at')
+    tag_cards(request, agent_properties)
+    stats = AgentStats.for_agent(agent)
     
     context = {
         'agent': agent,
         'properties': agent_properties,
-        'total_properties': total_properties,
-        'sold_properties': sold_properties,
+        'total_properties': stats.available,
+        'sold_properties': stats.sold,
     }
     return render(request, 'properties/agent_profile.html', context)
 
@@ -235,21 +336,21 @@ def agent_dashboard(request):
         messages.warning(request, 'Your agent account is pending authorization from admin.')
         return render(request, 'properties/agent_unauthorized.html', {'agent': agent})
     
-    agent_properties = Property.objects.filter(agent=agent).order_by('-created_at')
-    
-    # Stats
-    total_properties = agent_properties.count()
-    available_properties = agent_properties.filter(status='available').count()
-    pending_properties = agent_properties.filter(status='pending').count()
-    sold_properties = agent_properties.filter(status='sold').count()
+    # Counts come from the maintained stats row, not from counting listings
+    stats = AgentStats.for_agent(agent)
+    agent_properties = Property.objects.filter(agent=agent).with_card_data()
+    paginator = KeysetPaginator(agent_properties, DASHBOARD_PAGE_SIZE, get_ordering('newest'))
+    paginator.count = stats.total
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'agent': agent,
-        'properties': agent_properties,
-        'total_properties': total_properties,
-        'available_properties': available_properties,
-        'pending_properties': pending_properties,
-        'sold_properties': sold_properties,
+        'properties': page_obj,
+        'page_obj': page_obj,
+        'total_properties': stats.total,
+        'available_properties': stats.available,
+        'pending_properties': stats.pending,
+        'sold_properties': stats.sold,
     }
     return render(request, 'properties/agent_dashboard.html', context)
 
@@ -274,15 +375,14 @@ def property_create(request):
             property.agent = agent
             property.save()
             
-            # Handle multiple image uploads
-            images = request.FILES.getlist('images')
-            for idx, image in enumerate(images):
-                PropertyImage.objects.create(
-                    property=property,
-                    image=image,
-                    order=idx,
-                    is_primary=(idx == 0)
-                )
+            # Photos uploaded straight to storage, then any posted the old way
+            images = confirm_uploads(property, agent, request.POST.getlist('uploads'), first_is_primary=True)
+            queue_property_images(
+                property,
+                request.FILES.getlist('images'),
+                first_order=len(images),
+                first_is_primary=not images,
+            )
             
             messages.success(request, 'Property created successfully!')
             return redirect('properties:agent_dashboard')
@@ -320,17 +420,9 @@ def property_edit(request, pk):
         if form.is_valid():
             form.save()
             
-            # Handle new image uploads
-            images = request.FILES.getlist('images')
-            if images:
-                current_max_order = property.images.count()
-                for idx, image in enumerate(images):
-                    PropertyImage.objects.create(
-                        property=property,
-                        image=image,
-                        order=current_max_order + idx,
-                        is_primary=False
-                    )
+            # Photos uploaded straight to storage, then any posted the old way
+            images = confirm_uploads(property, agent, request.POST.getlist('uploads'), first_order=property.image_count)
+            queue_property_images(property, request.FILES.getlist('images'), first_order=property.image_count + len(images))
             
             messages.success(request, 'Property updated successfully!')
             return redirect('properties:agent_dashboard')
@@ -399,3 +491,82 @@ def property_image_delete(request, pk):
     image.delete()
     messages.success(request, 'Image deleted successfully!')
     return redirect('properties:property_edit', pk=property_id)
+
+
+def authorized_agent(request):
+    """The signed-in user's agent if it may manage listings, else None"""
+    agent = Agent.objects.filter(user=request.user).first()
+    if agent is None or not agent.is_authorized:
+        return None
+    return agent
+
+
+@login_required
+@require_POST
+def property_image_uploads(request):
+    """
+    Upload targets for photos the browser is about to send straight to media
+    storage. Expects a JSON body ``{"files": [{"name", "content_type", "size"}]}``.
+    """
+    agent = authorized_agent(request)
+    if agent is None:
+        return JsonResponse({'error': 'You are not authorized to manage properties.'}, status=403)
+    try:
+        files = json.loads(request.body)['files']
+        if not isinstance(files, list) or not all(isinstance(entry, dict) for entry in files):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected {"files": [{"name", "content_type", "size"}, ...]}'}, status=400)
+    
+    uploads, errors = prepare_uploads(request, agent, files)
+    return JsonResponse({'uploads': uploads, 'errors': errors, 'max_bytes': max_upload_bytes()})
+
+
+@login_required
+def property_image_upload_local(request, token):
+    """Upload target standing in for S3 when media lives on the local disk"""
+    if request.method != 'PUT':
+        return HttpResponse(status=405, headers={'Allow': 'PUT'})
+    storage = image_storage()
+    if hasattr(storage, 'bucket_name'):
+        return HttpResponse(status=404)
+    agent = authorized_agent(request)
+    key = read_token(token, agent) if agent is not None else None
+    if key is None:
+        return HttpResponse(status=403)
+    
+    limit = max_upload_bytes()
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if not 0 < length <= limit:
+        return HttpResponse(status=413 if length else 411)
+    if storage.exists(key):
+        return HttpResponse(status=409)
+    
+    # Spool the body rather than going through request.body and its size limit
+    with tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE) as buffer:
+        shutil.copyfileobj(request, buffer)
+        buffer.seek(0)
+        storage.save(key, File(buffer, name=key))
+    return HttpResponse(status=204)
+
+
+@login_required
+@require_POST
+def property_image_confirm(request, pk):
+    """Record the photos an agent uploaded directly to storage (``uploads`` tokens)"""
+    property = get_object_or_404(Property, pk=pk)
+    agent = authorized_agent(request)
+    if agent is None or property.agent_id != agent.pk:
+        return JsonResponse({'error': 'You can only add images to your own properties.'}, status=403)
+    
+    images = confirm_uploads(
+        property,
+        agent,
+        request.POST.getlist('uploads'),
+        first_order=property.image_count,
+        first_is_primary=not property.image_count,
+    )
+    return JsonResponse({'images': [{'id': image.pk, 'url': image.image.url} for image in images]})